@@ -0,0 +1,83 @@
+"""Measure the work the Streamlit app repeats on every rerun, with and without the caching layer.
+
+Usage:
+    python benchmarks/app_rerun_benchmark.py [--config config.yaml] [--reruns 20] [--app]
+
+"before" repeats what every rerun used to do: parse the config (twice, once more inside connect_to_db),
+configure the Gemini SDK, connect to MongoDB, build a GenerativeModel and query the expenditure report.
+"after" calls the cached equivalents the app now uses. With ``--app`` the whole script is also rerun
+through Streamlit's AppTest harness. Requires a reachable MongoDB from the configuration file.
+"""
+import os
+import statistics
+import time
+from datetime import date, timedelta
+
+import click
+import google.generativeai as genai
+
+from invoicer.data.base import (cached_report, configure_gemini, get_config, get_extraction_cache,
+                                get_gemini_model, init_db)
+from invoicer.data.cache import ExtractionCache
+from invoicer.data.config import load_config
+from invoicer.data.rollups import rollup_report
+from invoicer.db_connection import connect_to_db
+
+REPORT_GROUPINGS = ('product', 'day')
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'invoicer', 'app.py')
+
+
+def uncached_rerun(config_path, start, end):
+    config = load_config(config_path)
+    genai.configure(api_key=config['gemini']['google_api_key'])
+    ExtractionCache.from_config(config)
+    connect_to_db(config_path)
+    genai.GenerativeModel(config['gemini']['gemini_model'])
+    rollup_report(start, end, REPORT_GROUPINGS)
+
+
+def cached_rerun(config_path, start, end):
+    config = get_config(config_path)
+    configure_gemini(config['gemini']['google_api_key'])
+    get_extraction_cache(config_path)
+    init_db(config_path)
+    get_gemini_model(config['gemini']['gemini_model'])
+    cached_report(start, end, REPORT_GROUPINGS)
+
+
+def time_runs(func, reruns, *args):
+    timings = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def describe(label, timings):
+    click.echo(f"{label:<28} median {statistics.median(timings):8.2f} ms   max {max(timings):8.2f} ms")
+
+
+@click.command()
+@click.option('--config', default='config.yaml', show_default=True, help='Path to configuration file')
+@click.option('--reruns', default=20, show_default=True, help='Number of reruns to time')
+@click.option('--app', 'run_app', is_flag=True, help='Also time full reruns of invoicer/app.py via AppTest')
+def main(config, reruns, run_app):
+    end = date.today()
+    start = end - timedelta(days=365)
+
+    # The first cached call populates the caches, as the first run of the app does.
+    cached_rerun(config, start, end)
+    describe("before (uncached setup)", time_runs(uncached_rerun, reruns, config, start, end))
+    describe("after (cached setup)", time_runs(cached_rerun, reruns, config, start, end))
+
+    if run_app:
+        from streamlit.testing.v1 import AppTest
+
+        app = AppTest.from_file(APP_PATH, default_timeout=60)
+        app.run()
+        describe("full app rerun", time_runs(app.run, reruns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""Offline end-to-end extraction benchmark.
+
+Runs the CLI extraction path (``cli.parse_invoice`` -> ``build_invoice`` -> ``save_invoice``) for the sample
+images against a local fake Gemini endpoint (see ``fake_gemini.py``) and a local MongoDB, or an in-memory
+one with ``--in-memory`` (requires ``mongomock``). Each concurrency level runs in a fresh process so its
+peak RSS is measured in isolation. Results are printed as a table and written as JSON for comparing runs:
+
+    python benchmarks/extraction_benchmark.py --concurrency 1,4,16 --images 200 --latency 0.8 \\
+        --error-rate 0.02 --in-memory --output bench.json
+"""
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from fake_gemini import FakeGeminiServer, load_responses
+
+STAGES = ('llm', 'prepare_and_parse', 'build', 'save', 'total')
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class TimedClient:
+    """Wraps a GeminiClient and records the duration of the last ``extract`` call on the calling thread."""
+
+    def __init__(self, client):
+        self.client = client
+        self.model = client.model
+        self._local = threading.local()
+
+    def extract(self, image_data, mime_type, prompt):
+        started = time.perf_counter()
+        try:
+            return self.client.extract(image_data, mime_type, prompt)
+        finally:
+            self._local.elapsed = time.perf_counter() - started
+
+    @property
+    def last_elapsed(self):
+        return getattr(self._local, 'elapsed', 0.0)
+
+
+def _connect(settings):
+    import mongoengine
+
+    from invoicer.data.model import ExtractionJob, Invoice, PricePoint, Product, SpendRollup
+    from invoicer.db_connection import ensure_indexes
+
+    if settings['in_memory']:
+        try:
+            import mongomock
+        except ImportError:
+            raise click.ClickException("--in-memory requires mongomock: pip install mongomock")
+        mongoengine.connect(settings['db_name'], host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+    else:
+        mongoengine.connect(settings['db_name'], host=settings['mongo_uri'])
+    for document in (Invoice, SpendRollup, Product, PricePoint, ExtractionJob):
+        document.drop_collection()
+    ensure_indexes()
+
+
+def run_level(settings):
+    """Run one concurrency level; executed in its own process."""
+    from invoicer.batch import collect_images, percentile
+    from invoicer.cli import parse_invoice
+    from invoicer.data.extraction import INVOICE_PROMPT, build_invoice
+    from invoicer.data.store import save_invoice
+    from invoicer.gemini import GeminiClient
+
+    rss_start = _peak_rss_mb()
+    _connect(settings)
+    paths = collect_images(settings['source'])
+    paths = [paths[i % len(paths)] for i in range(settings['images'])]
+    client = TimedClient(GeminiClient('benchmark', model='fake-model', endpoint=settings['endpoint'],
+                                      backoff_base=settings['backoff_base'], pool_size=settings['concurrency']))
+
+    def process(path):
+        started = time.perf_counter()
+        response = parse_invoice(path, client, prompt=INVOICE_PROMPT, preprocess_options=settings['preprocess'])
+        llm = client.last_elapsed
+        parsed = time.perf_counter()
+        invoice = build_invoice(response)
+        invoice.validate()
+        built = time.perf_counter()
+        save_invoice(invoice)
+        saved = time.perf_counter()
+        return {'llm': llm, 'prepare_and_parse': parsed - started - llm, 'build': built - parsed,
+                'save': saved - built, 'total': saved - started}
+
+    timings = {stage: [] for stage in STAGES}
+    failures = Counter()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=settings['concurrency']) as pool:
+        for future in [pool.submit(process, path) for path in paths]:
+            try:
+                for stage, value in future.result().items():
+                    timings[stage].append(value)
+            except Exception as e:
+                failures[type(e).__name__] += 1
+    elapsed = time.perf_counter() - started
+
+    return {
+        'concurrency': settings['concurrency'],
+        'images': len(paths),
+        'failures': sum(failures.values()),
+        'failure_types': dict(failures),
+        'elapsed_s': elapsed,
+        'images_per_s': len(paths) / elapsed if elapsed else 0.0,
+        'stages_ms': {stage: {'p50': percentile(values, 50) * 1000,
+                              'p95': percentile(values, 95) * 1000,
+                              'p99': percentile(values, 99) * 1000,
+                              'mean': sum(values) / len(values) * 1000 if values else 0.0}
+                      for stage, values in timings.items()},
+        'rss_start_mb': rss_start,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+@click.command()
+@click.option('--source', default='data/org/', show_default=True, help='Directory or glob of sample images')
+@click.option('--images', default=50, show_default=True, help='Images processed per concurrency level')
+@click.option('--concurrency', default='1,4,8', show_default=True, help='Comma-separated concurrency levels')
+@click.option('--latency', default=0.5, show_default=True, help='Mean fake API latency in seconds')
+@click.option('--jitter', default=0.1, show_default=True, help='Standard deviation of the fake API latency')
+@click.option('--error-rate', default=0.0, show_default=True, help='Share of fake API calls failing with 429/503')
+@click.option('--responses', default=None, help='JSON file with canned invoice responses')
+@click.option('--backoff-base', default=0.05, show_default=True, help='Client retry backoff base in seconds')
+@click.option('--no-preprocess', is_flag=True, help='Send the images without pre-processing')
+@click.option('--mongo-uri', default='mongodb://localhost:27017', show_default=True)
+@click.option('--db-name', default='invoicer_benchmark', show_default=True, help='Database dropped and reused per run')
+@click.option('--in-memory', is_flag=True, help='Use an in-memory mongomock database instead of --mongo-uri')
+@click.option('--output', default=None, help='Write the results as JSON to this file')
+def main(source, images, concurrency, latency, jitter, error_rate, responses, backoff_base, no_preprocess,
+         mongo_uri, db_name, in_memory, output):
+    levels = [int(level) for level in concurrency.split(',')]
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with FakeGeminiServer(latency=latency, jitter=jitter, error_rate=error_rate,
+                          responses=load_responses(responses)) as server:
+        for level in levels:
+            settings = {'source': source, 'images': images, 'concurrency': level, 'endpoint': server.endpoint,
+                        'backoff_base': backoff_base, 'preprocess': {'enabled': not no_preprocess},
+                        'mongo_uri': mongo_uri, 'db_name': db_name, 'in_memory': in_memory}
+            with context.Pool(1) as pool:
+                result = pool.apply(run_level, (settings,))
+            results.append(result)
+            stages = result['stages_ms']
+            click.echo(f"concurrency {level:>3}: {result['images_per_s']:7.2f} images/s, "
+                       f"total p50 {stages['total']['p50']:7.1f} ms p95 {stages['total']['p95']:7.1f} ms, "
+                       f"llm p50 {stages['llm']['p50']:7.1f} ms, save p50 {stages['save']['p50']:6.1f} ms, "
+                       f"failures {result['failures']}, peak RSS {result['peak_rss_mb']:.0f} MB")
+            if result['failures']:
+                click.echo("  failures by type: " +
+                           ", ".join(f"{name} {count}" for name, count in result['failure_types'].items()))
+        requests_served, errors_injected = server.requests, server.errors
+
+    report = {
+        'benchmark': 'extraction',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'settings': {'source': source, 'images': images, 'latency_s': latency, 'jitter_s': jitter,
+                     'error_rate': error_rate, 'preprocess': not no_preprocess,
+                     'database': 'in-memory' if in_memory else mongo_uri},
+        'fake_server': {'requests': requests_served, 'errors_injected': errors_injected},
+        'levels': results,
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        click.echo(f"Results written to {output}")
+    else:
+        click.echo(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
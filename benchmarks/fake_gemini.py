@@ -0,0 +1,151 @@
+"""A local stand-in for the Gemini ``generateContent`` REST endpoint.
+
+Answers every ``POST /<version>/models/<model>:generateContent`` with a canned invoice after a
+configurable delay (each with its own invoice number, so the answers are not stored as duplicates), and fails
+a configurable share of requests (or the first ``fail_first`` ones) with 429/503 and a ``Retry-After`` header
+so client retries are exercised. Used by
+``extraction_benchmark.py``; can also be run on its own and targeted through ``gemini.endpoint`` in config.yaml:
+
+    python benchmarks/fake_gemini.py --port 8765 --latency 1.5 --error-rate 0.05
+"""
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+
+DEFAULT_RESPONSE = {
+    "Items": [
+        {"Name": "Lindt Excell.85%", "Quantity": 1, "Unit Price (EUR)": 2.69, "Total Price (EUR)": 2.69,
+         "Product Name (German)": "Lindt Excell.85%", "Product Name (English)": "Lindt Excellence 85%"},
+        {"Name": "G&G Sahnejoghurt", "Quantity": 2, "Unit Price (EUR)": 0.99, "Total Price (EUR)": 1.98,
+         "Product Name (German)": "G&G Sahnejoghurt", "Product Name (English)": "G&G Cream Yoghurt"},
+        {"Name": "KIRSCHEN lose", "Quantity": 0.592, "Unit Price (EUR)": 6.9, "Total Price (EUR)": 4.08,
+         "Product Name (German)": "Kirschen lose", "Product Name (English)": "Loose cherries"},
+    ],
+    "Issuer": "EDEKA Christ",
+    "Issuer Address": "Hildburghauser Str. 52, 12279 Berlin",
+    "Issuer Phone": "030-710 99 49-0",
+    "Invoice Number": "3793",
+    "Date Issued": "2024-07-05",
+    "Time Issued": "20:37:58",
+    "Total Invoice Expense (EUR)": 8.75
+}
+
+
+class FakeGeminiServer:
+    """Threaded fake endpoint; use as a context manager or call ``start()``/``stop()``."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.5, jitter=0.2, error_rate=0.0, responses=None,
+                 fenced=True, fail_first=0, retry_after='0'):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.fenced = fenced
+        self.fail_first = fail_first
+        self.retry_after = retry_after
+        self._responses = itertools.cycle(responses or [DEFAULT_RESPONSE])
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+    def _next(self):
+        with self._lock:
+            self.requests += 1
+            failed = self.requests <= self.fail_first or random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return failed, dict(next(self._responses), **{"Invoice Number": str(self.requests)})
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body, headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if not self.path.endswith(':generateContent'):
+                    self._reply(404, b'{"error": "not found"}')
+                    return
+                failed, response = server._next()
+                time.sleep(max(0.0, random.gauss(server.latency, server.jitter)))
+                if failed:
+                    status = random.choice((429, 503))
+                    headers = {'Retry-After': server.retry_after} if server.retry_after is not None else {}
+                    self._reply(status, b'{"error": "injected failure"}', headers)
+                    return
+                text = json.dumps(response, ensure_ascii=False)
+                if server.fenced:
+                    text = f"```json\n{text}\n```"
+                body = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+                self._reply(200, json.dumps(body).encode('utf-8'))
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def load_responses(path):
+    """Canned responses from a JSON file holding one invoice object or a list of them."""
+    if not path:
+        return None
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return data if isinstance(data, list) else [data]
+
+
+@click.command()
+@click.option('--port', default=8765, show_default=True)
+@click.option('--latency', default=0.5, show_default=True, help='Mean response delay in seconds')
+@click.option('--jitter', default=0.2, show_default=True, help='Standard deviation of the delay')
+@click.option('--error-rate', default=0.0, show_default=True, help='Share of requests answered with 429/503')
+@click.option('--responses', default=None, help='JSON file with the canned invoice(s) to return')
+def main(port, latency, jitter, error_rate, responses):
+    server = FakeGeminiServer(port=port, latency=latency, jitter=jitter, error_rate=error_rate,
+                              responses=load_responses(responses))
+    click.echo(f"Fake Gemini endpoint listening on {server.endpoint}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Compare request payloads and latency with and without image pre-processing.
+
+Usage:
+    python benchmarks/preprocess_benchmark.py data/org/ [--uplink-mbps 5] [--config config.yaml]
+
+Without ``--config`` the end-to-end latency is estimated as pre-processing time plus the time to upload
+the base64 payload at ``--uplink-mbps``. With ``--config`` every image is also sent to the configured
+Gemini endpoint twice (raw and pre-processed, bypassing the extraction cache) and the measured round
+trip is reported.
+"""
+import base64
+import time
+
+import click
+
+from invoicer.batch import collect_images
+from invoicer.cli import parse_invoice
+from invoicer.data.config import load_config
+from invoicer.data.preprocess import preprocess_image
+from invoicer.gemini import GeminiClient
+
+
+def upload_seconds(payload_bytes, uplink_mbps):
+    return payload_bytes * 8 / (uplink_mbps * 1_000_000)
+
+
+def timed_extraction(path, client, options):
+    started = time.perf_counter()
+    parse_invoice(path, client, preprocess_options=options)
+    return time.perf_counter() - started
+
+
+@click.command()
+@click.argument('source', default='data/org/')
+@click.option('--uplink-mbps', default=5.0, show_default=True, help='Uplink bandwidth used for the estimate')
+@click.option('--config', default=None, help='Configuration file; enables real API round trips')
+def main(source, uplink_mbps, config):
+    config_data = load_config(config) if config else {}
+    options = config_data.get('preprocess')
+    client = GeminiClient.from_config(config_data) if config else None
+
+    totals = {'raw': 0, 'processed': 0, 'raw_s': 0.0, 'processed_s': 0.0}
+    click.echo(f"{'image':<45} {'raw KB':>8} {'sent KB':>8} {'prep ms':>8} {'before s':>9} {'after s':>9}")
+    for path in collect_images(source):
+        with open(path, 'rb') as f:
+            raw = f.read()
+        started = time.perf_counter()
+        processed, _ = preprocess_image(raw, 'image/jpeg', options)
+        prep_s = time.perf_counter() - started
+
+        raw_payload, processed_payload = len(base64.b64encode(raw)), len(base64.b64encode(processed))
+        if client:
+            before = timed_extraction(path, client, {'enabled': False})
+            after = timed_extraction(path, client, options)
+        else:
+            before = upload_seconds(raw_payload, uplink_mbps)
+            after = prep_s + upload_seconds(processed_payload, uplink_mbps)
+
+        totals['raw'] += raw_payload
+        totals['processed'] += processed_payload
+        totals['raw_s'] += before
+        totals['processed_s'] += after
+        click.echo(f"{path[-45:]:<45} {raw_payload / 1024:>8.0f} {processed_payload / 1024:>8.0f} "
+                   f"{prep_s * 1000:>8.1f} {before:>9.2f} {after:>9.2f}")
+
+    if totals['raw']:
+        click.echo(f"\nPayload: {totals['raw'] / 1024:.0f} KB -> {totals['processed'] / 1024:.0f} KB "
+                   f"({100 * (1 - totals['processed'] / totals['raw']):.0f}% smaller)")
+        click.echo(f"Latency: {totals['raw_s']:.2f}s -> {totals['processed_s']:.2f}s "
+                   f"({'measured' if client else f'estimated at {uplink_mbps} Mbit/s'})")
+
+
+if __name__ == '__main__':
+    main()
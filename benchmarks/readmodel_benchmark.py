@@ -0,0 +1,118 @@
+"""Time and memory of the invoice read paths: mongoengine documents against read-model records and columns.
+
+Usage:
+    python benchmarks/readmodel_benchmark.py [--invoices 20000] [--items 10] [--in-memory | --mongo-uri URI]
+
+Generates invoices with ``--items`` items each. Without a database option only the mapping of raw documents
+is measured: ``Invoice._from_son`` (what iterating ``Invoice.objects`` does for every document) against
+``InvoiceRecord`` and ``item_columns``. With ``--mongo-uri`` (or ``--in-memory``, requires mongomock) the
+invoices are also inserted and read back end to end through ``Invoice.objects`` and the read model. Times and
+the peak memory held by the result (measured in a separate run with tracemalloc) are scaled to one million
+items.
+"""
+import gc
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import click
+from bson import ObjectId
+
+ISSUERS = ['EDEKA Christ', 'REWE', 'Lidl', 'ALDI SÜD', 'dm-drogerie markt', 'Rossmann', 'Kaufland', 'Netto']
+PRODUCTS = ['Milch 1,5%', 'Vollkornbrot', 'Bananen', 'Lindt Excell.85%', 'Eier M 10St', 'Gouda jung',
+            'Spaghetti', 'Tomaten', 'Apfelsaft', 'Joghurt Natur']
+
+
+def generate_documents(invoices, items, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1)
+    documents = []
+    for number in range(invoices):
+        lines = []
+        for _ in range(items):
+            quantity = float(rng.randint(1, 4))
+            unit_price = round(rng.uniform(0.3, 9.0), 2)
+            product = rng.choice(PRODUCTS)
+            lines.append({'Name': product, 'Unit_Price_EUR': unit_price, 'Total_Price_EUR': unit_price * quantity,
+                          'Quantity': quantity, 'Product_Name_German': product, 'Product_Name_English': product})
+        documents.append({
+            '_id': ObjectId(), 'Items': lines, 'Issuer': rng.choice(ISSUERS), 'Issuer_Address': 'Berlin',
+            'Invoice_Number': float(number), 'Date_Issued': start + timedelta(minutes=rng.randint(0, 10 ** 6)),
+            'Time_Issued': '12:00:00', 'Total_Invoice_Expense_EUR': sum(line['Total_Price_EUR'] for line in lines),
+            'Image_SHA256': f"{number:064x}",
+        })
+    return documents
+
+
+def measure(build):
+    """Seconds to build the result, and the peak memory in MB allocated while building it (second run)."""
+    gc.collect()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, peak / (1 << 20)
+
+
+def _connect(mongo_uri, db_name, in_memory):
+    import mongoengine
+
+    from invoicer.data.model import Invoice
+
+    if in_memory:
+        try:
+            import mongomock
+        except ImportError:
+            raise click.ClickException("--in-memory requires mongomock: pip install mongomock")
+        mongoengine.connect(db_name, host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+    else:
+        mongoengine.connect(db_name, host=mongo_uri)
+    Invoice.drop_collection()
+
+
+@click.command()
+@click.option('--invoices', default=20000, show_default=True, help='Number of generated invoices')
+@click.option('--items', default=10, show_default=True, help='Items per invoice')
+@click.option('--mongo-uri', default=None, help='Also read the invoices back from this MongoDB')
+@click.option('--db-name', default='invoicer_benchmark', show_default=True, help='Database dropped and reused')
+@click.option('--in-memory', is_flag=True, help='Also read the invoices back from an in-memory mongomock database')
+def main(invoices, items, mongo_uri, db_name, in_memory):
+    from invoicer.data.model import Invoice
+    from invoicer.data.readmodel import SUMMARY_FIELDS, InvoiceRecord, find_invoices, find_item_columns, item_columns
+
+    documents = generate_documents(invoices, items)
+    scale = 1e6 / (invoices * items)
+    cases = [
+        ('mapping', 'mongoengine Invoice', lambda: [Invoice._from_son(document) for document in documents]),
+        ('mapping', 'InvoiceRecord', lambda: [InvoiceRecord(document) for document in documents]),
+        ('mapping', 'item_columns', lambda: item_columns(documents)),
+    ]
+    if mongo_uri or in_memory:
+        _connect(mongo_uri, db_name, in_memory)
+        Invoice._get_collection().insert_many(documents)
+        cases += [
+            ('query', 'Invoice.objects', lambda: list(Invoice.objects)),
+            ('query', 'find_invoices (all fields)',
+             lambda: list(find_invoices(fields=[name for name in documents[0] if name != '_id']))),
+            ('query', 'find_invoices (summary)', lambda: list(find_invoices(fields=SUMMARY_FIELDS))),
+            ('query', 'Invoice.objects (summary)',
+             lambda: list(Invoice.objects.only(*SUMMARY_FIELDS))),
+            ('query', 'find_item_columns (totals)', lambda: find_item_columns(fields=('Name', 'Total_Price_EUR'))),
+        ]
+
+    click.echo(f"{invoices} invoices, {invoices * items} items; figures per million items")
+    click.echo(f"{'path':<8} {'read':<30} {'seconds':>9} {'peak MB':>9}")
+    for kind, name, build in cases:
+        elapsed, peak_mb = measure(build)
+        click.echo(f"{kind:<8} {name:<30} {elapsed * scale:>9.2f} {peak_mb * scale:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
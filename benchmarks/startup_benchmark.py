@@ -0,0 +1,90 @@
+"""Measure how long the ``invoicer`` CLI takes to start.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--runs 10] [--budget-ms 200] [--command "--help"]
+
+Each run starts a fresh interpreter with ``python -X importtime`` and invokes the CLI with the given
+arguments. The script reports the median wall time and import time and the slowest top-level imports of
+the last run. It exits with an error if the median wall time exceeds the budget, so it can guard startup
+time in CI.
+"""
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+RUNNER = "import sys; from invoicer.cli import cli; cli(sys.argv[1:], prog_name='invoicer')"
+
+
+def parse_importtime(stderr: str):
+    """(module, cumulative µs, depth) for every line of ``-X importtime`` output, in the order printed."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((name.strip(), int(cumulative_us), (len(name) - len(name.lstrip()) - 1) // 2))
+    return rows
+
+
+def cli_imports(rows, baseline):
+    """Top-level imports not made by a bare interpreter, each with its direct children.
+
+    ``-X importtime`` prints a module after everything it imports, so the children of a top-level
+    module are the rows since the previous top-level one.
+    """
+    groups, children = [], []
+    for name, cumulative, depth in rows:
+        if depth > 0:
+            if depth == 1:
+                children.append((name, cumulative))
+            continue
+        if name not in baseline:
+            groups.append((name, cumulative, children))
+        children = []
+    return groups
+
+
+def run_once(code, *args):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code, *args], capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        errors = '\n'.join(line for line in result.stderr.splitlines() if not line.startswith('import time:'))
+        raise click.ClickException(f"invoicer {' '.join(args)} failed:\n{errors[-2000:]}")
+    return elapsed, parse_importtime(result.stderr)
+
+
+@click.command()
+@click.option('--runs', default=10, show_default=True, help='Number of fresh interpreters started')
+@click.option('--budget-ms', default=200.0, show_default=True, help='Maximum median wall time')
+@click.option('--command', 'command', default='--help', show_default=True, help='Arguments passed to invoicer')
+@click.option('--top', default=10, show_default=True, help='Number of slowest imports listed')
+def main(runs, budget_ms, command, top):
+    args = shlex.split(command)
+    _, rows = run_once('pass')
+    baseline = {name for name, _, depth in rows if depth == 0}
+    wall, imports = [], []
+    for _ in range(runs):
+        elapsed, rows = run_once(RUNNER, *args)
+        groups = cli_imports(rows, baseline)
+        wall.append(elapsed)
+        imports.append(sum(cumulative for _, cumulative, _ in groups))
+
+    median_ms = statistics.median(wall) * 1000
+    click.echo(f"invoicer {command}: median wall time {median_ms:.0f} ms, "
+               f"median import time {statistics.median(imports) / 1000:.0f} ms over {runs} runs")
+    click.echo("\nSlowest imports of the last run:")
+    modules = [(name, cumulative) for root, root_cumulative, children in groups
+               for name, cumulative in children + [(root, root_cumulative)]]
+    for name, cumulative in sorted(modules, key=lambda module: -module[1])[:top]:
+        click.echo(f"  {cumulative / 1000:>7.1f} ms  {name}")
+    if median_ms > budget_ms:
+        raise click.ClickException(f"Startup takes {median_ms:.0f} ms, over the budget of {budget_ms:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,46 @@
 import json
+from contextlib import closing
 from datetime import datetime
 
 import streamlit as st
 from PIL import Image
-import google.generativeai as genai
 
-from invoicer.data.model import Invoice
-from invoicer.db_connection import connect_to_db
-from invoicer.data.config import load_config
+from invoicer.data.dedup import max_distance_from_config
+from invoicer.data.catalog import complete_translations
+from invoicer.data.extraction import COMPACT_INVOICE_PROMPT, INVOICE_PROMPT, ItemStreamParser, load_response_json
+from invoicer.data.pdf import is_pdf, iter_pdf_pages, resolve_options as resolve_pdf_options
+from invoicer.data.prices import DEFAULT_MONTHS, price_summary
 import plotly.express as px
 import pandas as pd
 import logging
-from data.base import (get_gemini_response, save_uploaded_file, input_image_setup, parse_response,
-                       save_to_mongodb, query_invoices, add_new_invoice, edit_delete_invoice)
+from invoicer.data.base import (get_gemini_response, stream_gemini_response, get_pdf_response, save_uploaded_file,
+                                parse_response, cached_report, get_config, configure_gemini, init_db, init_metrics,
+                                get_extraction_cache, get_product_catalog, get_blob_store, get_analytics_snapshot,
+                                gemini_text, cached_price_history)
+from invoicer.data.forms import (save_to_mongodb, add_new_invoice, edit_delete_invoice, queue_invoices,
+                                 upload_duplicates, report_duplicates)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CONFIG_PATH = 'config.yaml'
+
 # Load application configuration
-config = load_config('config.yaml')
+config = get_config(CONFIG_PATH)
+init_metrics(CONFIG_PATH)
 
 # Configure Gemini API
-genai.configure(api_key=config['gemini']['google_api_key'])
+configure_gemini(config['gemini']['google_api_key'])
 gemini_model = config['gemini']['gemini_model']
+extraction_cache = get_extraction_cache(CONFIG_PATH)
+# With a product catalog, product names are translated locally and the prompt omits them.
+product_catalog = get_product_catalog(CONFIG_PATH)
+extraction_prompt = INVOICE_PROMPT if product_catalog is None else COMPACT_INVOICE_PROMPT
 
 # Initialize Database connection (Singleton)
-connect_to_db('config.yaml')
+init_db(CONFIG_PATH)
+# Uploaded images, referenced by the Image_SHA256 of their invoices
+blob_store = get_blob_store(CONFIG_PATH)
 
 # Initialize session state variables
 if 'uploaded_file' not in st.session_state:
@@ -46,71 +61,90 @@ option = st.sidebar.radio("Select an option",
                           [
                               "None",
                               "Automatically Add New Invoice",
+                              "Queue Invoices for Background Extraction",
                               "Manually Add New Invoice",
                               "Edit/Delete Previous Invoice"
                            ])
 
 st.sidebar.header("Analysis")
 show_graphs = st.sidebar.checkbox("Show Expenditure Analysis", False)
+show_prices = st.sidebar.checkbox("Show Price History", False)
 
 if option == "Manually Add New Invoice":
     add_new_invoice()
 
-elif option == "Edit/Delete Invoice":
-    edit_delete_invoice()
+elif option == "Edit/Delete Previous Invoice":
+    edit_delete_invoice(blob_store)
+
+elif option == "Queue Invoices for Background Extraction":
+    queue_invoices(blob_store, config.get('jobs'), max_distance_from_config(config))
 
 elif option == "Automatically Add New Invoice":
-    uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "jpeg", "png"])
+    duplicates = []
+    uploaded_file = st.file_uploader("Choose an image or PDF...", type=["jpg", "jpeg", "png", "pdf"])
     if uploaded_file is not None:
         st.session_state.uploaded_file = uploaded_file
+    pdf_options = resolve_pdf_options(config.get('pdf'))
+    uploaded_pdf = st.session_state.uploaded_file is not None and is_pdf(st.session_state.uploaded_file.getvalue())
 
     if st.session_state.uploaded_file is not None:
-        image = Image.open(st.session_state.uploaded_file)
-        st.image(image, caption="Uploaded Image.", use_column_width=True)
-        image_path = save_uploaded_file(st.session_state.uploaded_file)
-
-    submit = st.button("Extract the invoice data")
-
-    input_prompt = """
-    Extract the following values in JSON format: Items (each item should be a nested dictionary with keys: Name, 
-    Quantity, Unit Price (EUR), Total Price (EUR), Product Name (German), Product Name (English)), Issuer, 
-    Issuer Address, Issuer Phone, Invoice Number, Date Issued, Time Issued.
-
-    Ensure the output JSON structure matches this example:
-    {
-        "Items": [
-            {
-                "Name": "Lindt Excell.85%",
-                "Quantity": 1,
-                "Unit Price (EUR)": 2.69,
-                "Total Price (EUR)": 2.69,
-                "Product Name (German)": "Lindt Excell.85%",
-                "Product Name (English)": "Lindt Excellence 85%"
-            }
-        ],
-        "Issuer": "EDEKA Christ",
-        "Issuer Address": "Hildburghauser Str. 52, 12279 Berlin",
-        "Issuer Phone": "030-710 99 49-0",
-        "Invoice Number": "3793",
-        "Date Issued": "05.07.2024",
-        "Time Issued": "20:37:58",
-        "Total Invoice Expense (EUR)": 17.2
-    }
-    """
+        if uploaded_pdf:
+            with closing(iter_pdf_pages(st.session_state.uploaded_file.getvalue(), pdf_options['max_long_edge'],
+                                        config.get('preprocess'))) as pages:
+                st.image(next(pages)[0], caption="First page of the uploaded PDF.", use_column_width=True)
+        else:
+            image = Image.open(st.session_state.uploaded_file)
+            st.image(image, caption="Uploaded Image.", use_column_width=True)
+        save_uploaded_file(st.session_state.uploaded_file, blob_store)
+
+        # Catch re-uploads of a stored receipt before spending an extraction call on them.
+        fingerprint, duplicates = upload_duplicates(st.session_state.uploaded_file, max_distance_from_config(config))
+        st.session_state.image_fingerprint = fingerprint
+        if duplicates:
+            report_duplicates(st.session_state.uploaded_file.name, duplicates)
+            extract_anyway = st.checkbox("Extract anyway", False)
+
+    bypass_cache = st.checkbox("Bypass extraction cache", False)
+    # The pages of a PDF are extracted concurrently and merged, so their items cannot be streamed.
+    stream_items = st.checkbox("Show items while they are extracted", True, disabled=uploaded_pdf)
+    submit = st.button("Extract the invoice data", disabled=bool(duplicates) and not extract_anyway)
 
     if submit and st.session_state.uploaded_file is not None:
-        image_data = input_image_setup(st.session_state.uploaded_file)
         try:
-            response = get_gemini_response(gemini_model, input_prompt, image_data)
-            st.subheader("The Response is")
+            st.subheader("Extracted Items")
+            items_table = st.empty()
+
+            if uploaded_pdf:
+                with st.spinner("Extracting the pages of the PDF..."):
+                    response_dict = load_response_json(get_pdf_response(
+                        gemini_model, extraction_prompt, st.session_state.uploaded_file, pdf_options,
+                        config.get('preprocess'), cache=extraction_cache, bypass_cache=bypass_cache))
+            elif stream_items:
+                # Render every completed item as soon as its closing brace arrives.
+                parser = ItemStreamParser()
+                streamed_items = []
+                for chunk in stream_gemini_response(gemini_model, extraction_prompt, st.session_state.uploaded_file,
+                                                    config.get('preprocess'), cache=extraction_cache,
+                                                    bypass_cache=bypass_cache):
+                    new_items = parser.feed(chunk)
+                    if new_items:
+                        streamed_items.extend(new_items)
+                        items_table.dataframe(pd.DataFrame(streamed_items))
+                response = parser.text
+            else:
+                response = get_gemini_response(gemini_model, extraction_prompt, st.session_state.uploaded_file,
+                                               config.get('preprocess'), cache=extraction_cache,
+                                               bypass_cache=bypass_cache)
+            if not uploaded_pdf:
+                response_dict = load_response_json(response) if response and response.strip() else None
 
-            if not response:
+            if response_dict is None:
                 st.error("Received empty response from the API.")
             else:
-                response = response.replace('```', '').replace('\n', '').replace('json', '')
-
-                response_dict = json.loads(response)
-                if response_dict['Date Issued'] is None:
+                if product_catalog is not None:
+                    complete_translations(response_dict, product_catalog,
+                                          lambda prompt: gemini_text(gemini_model, prompt))
+                if response_dict.get('Date Issued') is None:
                     response_dict['Date Issued'] = datetime.now().date()
                     response_dict['Time Issued'] = datetime.now().time().isoformat()
 
@@ -121,19 +155,18 @@ elif option == "Automatically Add New Invoice":
 
                 invoice_metadata = pd.DataFrame([response_dict])
 
-                st.subheader("Extracted Items")
-                st.dataframe(items_df)
+                items_table.dataframe(items_df)
 
                 st.subheader("Invoice Metadata")
                 st.dataframe(invoice_metadata)
 
-            st.session_state.processed_items = items
-            st.session_state.invoice_metadata = invoice_metadata
+                st.session_state.processed_items = items
+                st.session_state.invoice_metadata = invoice_metadata
 
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("Reprocess Image"):
-                    st.experimental_rerun()
+                    st.rerun()
             with col2:
                 st.button("Save to MongoDB", on_click=save_to_mongodb)
         except json.JSONDecodeError as e:
@@ -145,37 +178,51 @@ if show_graphs:
     st.header("Expenditure Analysis")
     start_date = st.date_input("Start Date")
     end_date = st.date_input("End Date")
+    granularity = st.selectbox("Group expenses by", ["day", "week", "month"])
 
     if st.button("Generate Report"):
-        invoices = query_invoices(start_date, end_date)
+        analytics = get_analytics_snapshot(CONFIG_PATH)
+        if analytics is not None:
+            # Bring the local snapshot up to date; the report itself does not query the database.
+            analytics.sync()
+            report = analytics.report(start_date, end_date, ("product", granularity))
+        else:
+            report = cached_report(start_date, end_date, ("product", granularity))
 
-        if not invoices:
+        if not report['invoices']:
             st.warning("No invoices found for the selected date range.")
         else:
-            df = pd.DataFrame(invoices)
-
-            total_expenditure = df['total_price'].sum()
-
             st.subheader(f"Total Expenditure from {start_date} to {end_date}")
-            st.write(f"Total Expenditure: {total_expenditure:.2f} EUR")
-
-            # Prepare data for pie chart
-            item_summary = {}
-            for invoice in Invoice.objects(date__gte=start_date, date__lte=end_date):
-                for item in invoice.items:
-                    if item.name in item_summary:
-                        item_summary[item.name] += item.price
-                    else:
-                        item_summary[item.name] = item.price
+            st.write(f"Total Expenditure: {report['total']:.2f} EUR")
 
             # Pie chart for expenditure distribution
-            item_names = list(item_summary.keys())
-            item_prices = list(item_summary.values())
-
-            fig_pie = px.pie(values=item_prices, names=item_names, title="Expenditure Distribution")
+            products = pd.DataFrame(report['product'])
+            fig_pie = px.pie(products, values='total', names='key', title="Expenditure Distribution")
             st.plotly_chart(fig_pie)
 
             # Line chart for total expenses over time
-            df = df.sort_values('date')
-            fig_line = px.line(df, x='date', y='total_price', title='Total Expenses Over Time')
+            periods = pd.DataFrame(report[granularity])
+            fig_line = px.line(periods, x='key', y='total', title='Total Expenses Over Time',
+                               labels={'key': granularity, 'total': 'total (EUR)'})
             st.plotly_chart(fig_line)
+
+if show_prices:
+    st.header("Price History")
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        product = st.text_input("Product (receipt, German or English name)")
+    with col2:
+        months = st.number_input("Months", min_value=1, max_value=120, value=DEFAULT_MONTHS, step=1)
+
+    if product.strip():
+        points = cached_price_history(product.strip(), int(months))
+        if not points:
+            st.warning(f"No purchases of {product} in the last {months} months.")
+        else:
+            st.subheader(f"Unit price per store over the last {months} months")
+            st.dataframe(pd.DataFrame(price_summary(points)).rename(columns={
+                'issuer': 'Store', 'min': 'Min (EUR)', 'median': 'Median (EUR)', 'last': 'Last (EUR)',
+                'last_date': 'Last bought', 'purchases': 'Purchases'}))
+            fig_prices = px.line(pd.DataFrame(points), x='Date_Issued', y='Unit_Price_EUR', color='Issuer',
+                                 markers=True, labels={'Date_Issued': 'date', 'Unit_Price_EUR': 'unit price (EUR)'})
+            st.plotly_chart(fig_prices)
@@ -0,0 +1,124 @@
+import glob
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+
+from invoicer.data.dedup import DEFAULT_MAX_DISTANCE, describe_duplicate, find_image_duplicates, image_fingerprint
+from invoicer.data.extraction import build_invoice
+from invoicer.data.model import Invoice
+from invoicer.data.store import insert_invoices
+from invoicer.metrics import percentile, timed
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.pdf')
+
+
+def collect_images(source: str) -> List[str]:
+    """Return the image files in a directory, or the files matching a glob pattern, sorted by path."""
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(p for p in paths if os.path.isfile(p) and p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@timed('mongo.ingested_lookup')
+def already_ingested(hashes: List[str], chunk_size: int = 1000) -> set:
+    """Return the subset of ``hashes`` that already have an Invoice in the database."""
+    found = set()
+    for i in range(0, len(hashes), chunk_size):
+        found.update(Invoice.objects(Image_SHA256__in=hashes[i:i + chunk_size]).distinct('Image_SHA256'))
+    return found
+
+
+def run_batch(paths: List[str], extract: Callable[[str], dict], concurrency: int = 4,
+              batch_size: int = 50, max_distance: Optional[int] = DEFAULT_MAX_DISTANCE,
+              echo: Callable[[str], None] = logger.info) -> Dict[str, float]:
+    """Extract and store every image in ``paths`` through a bounded worker pool.
+
+    Images whose SHA-256 already appears on a stored invoice are skipped, so an interrupted
+    run can simply be restarted. Images perceptually within ``max_distance`` of a stored invoice's
+    image are reported as duplicates without being extracted (None disables this check).
+    Returns a throughput summary.
+    """
+    started = time.monotonic()
+    hashes = {}
+    for path in paths:
+        hashes.setdefault(file_sha256(path), path)
+    done = already_ingested(list(hashes))
+    pending = [(digest, path) for digest, path in hashes.items() if digest not in done]
+    echo(f"{len(paths)} images found, {len(paths) - len(pending)} already ingested or duplicated, "
+         f"{len(pending)} to process")
+
+    def work(path):
+        with open(path, 'rb') as f:
+            fingerprint = image_fingerprint(f.read())
+        if max_distance is not None:
+            similar = find_image_duplicates(fingerprint, max_distance, limit=1)
+            if similar:
+                return None, fingerprint, similar[0], 0.0
+        call_started = time.monotonic()
+        response = extract(path)
+        return response, fingerprint, None, time.monotonic() - call_started
+
+    def flush(invoices):
+        """Insert the buffered invoices; returns the number written, 0 if the batch insert failed."""
+        try:
+            return insert_invoices(invoices)
+        except Exception as e:
+            echo(f"Failed: batch of {len(invoices)} invoices: {e}")
+            return 0
+
+    latencies, buffer = [], []
+    failures = inserted = duplicates = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {pool.submit(work, path): path for _, path in pending}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                response, fingerprint, similar, latency = future.result()
+                if similar is not None:
+                    duplicates += 1
+                    echo(f"Duplicate: {path} looks like {describe_duplicate(similar)}")
+                    continue
+                invoice = build_invoice(response, **fingerprint)
+                invoice.validate()
+                buffer.append(invoice)
+                latencies.append(latency)
+            except Exception as e:
+                failures += 1
+                echo(f"Failed: {path}: {e}")
+                continue
+            if len(buffer) >= batch_size:
+                written = flush(buffer)
+                failures += len(buffer) - written
+                inserted += written
+                buffer = []
+        written = flush(buffer)
+        failures += len(buffer) - written
+        inserted += written
+
+    elapsed = time.monotonic() - started
+    return {
+        'processed': len(pending),
+        'inserted': inserted,
+        'skipped': len(paths) - len(pending),
+        'duplicates': duplicates,
+        'failures': failures,
+        'elapsed_s': elapsed,
+        'images_per_s': len(pending) / elapsed if elapsed else 0.0,
+        'p50_latency_s': percentile(latencies, 50),
+        'p95_latency_s': percentile(latencies, 95),
+    }
@@ -1,14 +1,28 @@
-import base64
+"""The ``invoicer`` command line.
+
+Commands import what they need when they run, so ``invoicer --help`` only loads click and starting one command
+does not pay for the database, image, model and dataframe libraries used by the others.
+"""
+import json
 import os
 import subprocess
 
 import click
-from datetime import datetime
-from invoicer.db_connection import connect_to_db
-from invoicer.data.model import Invoice, Item
-from invoicer.data.config import load_config
-import requests
-import json
+
+from invoicer.data.formats import DEFAULT_BATCH_SIZE, FORMATS
+from invoicer.data.reports import GROUPINGS
+
+
+def setup(config_path):
+    """Load the configuration, enable instrumentation if configured and connect to the database."""
+    from invoicer import metrics
+    from invoicer.data.config import load_config
+    from invoicer.db_connection import connect_to_db
+
+    config_data = load_config(config_path)
+    metrics.configure(config_data)
+    connect_to_db(config_path)
+    return config_data
 
 
 @click.group()
@@ -20,78 +34,391 @@ def cli():
 @cli.command()
 @click.argument('image_path', type=click.Path(exists=True))
 @click.option('--config', default='config.yaml', help='Path to configuration file')
-def process_invoice(image_path, config):
-    """Process an invoice image and save it to the database."""
-    connect_to_db(config)
-    config_data = load_config(config)
-    api_key = config_data['gemini']['google_api_key']
+@click.option('--no-cache', is_flag=True, help='Bypass the extraction cache and always call the API')
+def process_invoice(image_path, config, no_cache):
+    """Process an invoice image or PDF and save it to the database."""
+    from invoicer.data.cache import ExtractionCache
+    from invoicer.data.dedup import image_fingerprint
+    from invoicer.data.extraction import INVOICE_PROMPT, build_invoice
+    from invoicer.data.store import DuplicateInvoiceError, save_invoice
+    from invoicer.gemini import GeminiClient
+
+    config_data = setup(config)
+    client = GeminiClient.from_config(config_data)
+    cache = ExtractionCache.from_config(config_data)
 
     click.echo(f"Processing invoice: {image_path}")
-    parsed_data = parse_invoice(image_path, api_key)
-
-    invoice = Invoice(
-        items=[Item(**item) for item in parsed_data['items']],
-        total_price=parsed_data['total_price'],
-        date=datetime.now()
-    )
-    invoice.save()
+    try:
+        parsed_data = parse_invoice(image_path, client, prompt=INVOICE_PROMPT, cache=cache, bypass_cache=no_cache,
+                                    preprocess_options=config_data.get('preprocess'),
+                                    pdf_options=config_data.get('pdf'))
+    except RuntimeError as e:
+        # E.g. a PDF without the pdf extra installed.
+        raise click.ClickException(str(e))
+
+    with open(image_path, 'rb') as image_file:
+        fingerprint = image_fingerprint(image_file.read())
+    invoice = build_invoice(parsed_data, **fingerprint)
+    invoice.validate()
+    try:
+        save_invoice(invoice)
+    except DuplicateInvoiceError as e:
+        raise click.ClickException(str(e))
     click.echo("Invoice saved to MongoDB Atlas")
 
 
 @cli.command()
 @click.option('--start-date', type=click.DateTime(), help='Start date for report (YYYY-MM-DD)')
 @click.option('--end-date', type=click.DateTime(), help='End date for report (YYYY-MM-DD)')
+@click.option('--group-by', type=click.Choice(GROUPINGS), default='product', show_default=True,
+              help='How to break down the expenditure')
+@click.option('--from-invoices', is_flag=True,
+              help='Aggregate the invoices themselves instead of the rollups or the analytics snapshot')
 @click.option('--config', default='config.yaml', help='Path to configuration file')
-def generate_report(start_date, end_date, config):
+def generate_report(start_date, end_date, group_by, from_invoices, config):
     """Generate a report of invoices within a date range."""
-    connect_to_db(config)
-    invoices = Invoice.objects(date__gte=start_date, date__lte=end_date)
+    from invoicer.data.analytics import AnalyticsSnapshot
+    from invoicer.data.reports import expenditure_report
+    from invoicer.data.rollups import rollup_report
+
+    config_data = setup(config)
+    start_date, end_date = start_date and start_date.date(), end_date and end_date.date()
+    try:
+        analytics = None if from_invoices else AnalyticsSnapshot.from_config(config_data)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    if from_invoices:
+        report = expenditure_report(start_date, end_date, groupings=(group_by,))
+    elif analytics is not None:
+        analytics.sync()
+        report = analytics.report(start_date, end_date, groupings=(group_by,))
+    else:
+        report = rollup_report(start_date, end_date, groupings=(group_by,))
+
+    click.echo(f"Total Expenditure from {start_date} to {end_date}: {report['total']:.2f} EUR "
+               f"({report['invoices']} invoices)")
+
+    click.echo(f"\nExpenditure by {group_by.capitalize()}:")
+    for row in report[group_by]:
+        click.echo(f"{row['key']}: {row['total']:.2f} EUR")
+
+
+@cli.command()
+@click.argument('source')
+@click.option('--config', default='config.yaml', help='Path to configuration file')
+@click.option('--concurrency', default=4, show_default=True, help='Number of parallel extraction workers')
+@click.option('--rpm', type=float, default=None,
+              help='Maximum API requests per minute (default: gemini.requests_per_minute from the config)')
+@click.option('--batch-size', default=50, show_default=True, help='Invoices written per insert_many call')
+@click.option('--no-cache', is_flag=True, help='Bypass the extraction cache and always call the API')
+@click.option('--allow-similar', is_flag=True,
+              help='Extract images that look like an already stored receipt instead of skipping them')
+def process_batch(source, config, concurrency, rpm, batch_size, no_cache, allow_similar):
+    """Process every invoice image in a directory or glob pattern and save them to the database."""
+    from invoicer.batch import collect_images, run_batch
+    from invoicer.data.cache import ExtractionCache
+    from invoicer.data.catalog import ProductCatalog
+    from invoicer.data.dedup import max_distance_from_config
+    from invoicer.data.extraction import INVOICE_PROMPT
+    from invoicer.gemini import GeminiClient
+
+    config_data = setup(config)
+    client = GeminiClient.from_config(config_data, requests_per_minute=rpm, pool_size=concurrency)
+    cache = ExtractionCache.from_config(config_data)
+    catalog = ProductCatalog.from_config(config_data)
+
+    paths = collect_images(source)
+    if not paths:
+        click.echo(f"No images found in {source}")
+        return
+
+    def extract(path):
+        return parse_invoice(path, client, prompt=INVOICE_PROMPT, cache=cache, bypass_cache=no_cache,
+                             preprocess_options=config_data.get('preprocess'), catalog=catalog,
+                             pdf_options=config_data.get('pdf'))
 
-    total_expenditure = sum(invoice.total_price for invoice in invoices)
-    click.echo(f"Total Expenditure from {start_date} to {end_date}: {total_expenditure:.2f} EUR")
+    max_distance = None if allow_similar else max_distance_from_config(config_data)
+    summary = run_batch(paths, extract, concurrency=concurrency, batch_size=batch_size, max_distance=max_distance,
+                        echo=click.echo)
 
-    item_summary = {}
-    for invoice in invoices:
-        for item in invoice.items:
-            if item.name in item_summary:
-                item_summary[item.name] += item.price
-            else:
-                item_summary[item.name] = item.price
+    click.echo(f"\nProcessed {summary['processed']} images in {summary['elapsed_s']:.1f}s "
+               f"({summary['images_per_s']:.2f} images/s), skipped {summary['skipped']}")
+    click.echo(f"Inserted: {summary['inserted']}, duplicates: {summary['duplicates']}, "
+               f"failures: {summary['failures']}")
+    click.echo(f"Extraction latency p50: {summary['p50_latency_s']:.2f}s, p95: {summary['p95_latency_s']:.2f}s")
 
-    click.echo("\nExpenditure by Item:")
-    for item, price in item_summary.items():
-        click.echo(f"{item}: {price:.2f} EUR")
 
+@cli.command()
+@click.option('--config', default='config.yaml', help='Path to configuration file')
+@click.option('--concurrency', default=1, show_default=True, help='Jobs processed in parallel by this worker')
+@click.option('--rpm', type=float, default=None,
+              help='Maximum API requests per minute (default: gemini.requests_per_minute from the config)')
+@click.option('--poll-interval', default=2.0, show_default=True, help='Seconds to wait when the queue is empty')
+@click.option('--max-jobs', type=int, default=None, help='Exit after this many jobs, or when the queue is empty')
+def worker(config, concurrency, rpm, poll_interval, max_jobs):
+    """Process queued extraction jobs until interrupted."""
+    from invoicer.data.blobs import BlobStore
+    from invoicer.data.cache import ExtractionCache
+    from invoicer.data.catalog import ProductCatalog
+    from invoicer.data.extraction import INVOICE_PROMPT
+    from invoicer.gemini import GeminiClient
+    from invoicer.jobs import DEFAULT_LEASE_SECONDS, pending_images, queue_counts, run_worker
+
+    config_data = setup(config)
+    jobs_config = config_data.get('jobs') or {}
+    client = GeminiClient.from_config(config_data, requests_per_minute=rpm, pool_size=concurrency)
+    cache = ExtractionCache.from_config(config_data)
+    catalog = ProductCatalog.from_config(config_data)
+    store = BlobStore.from_config(config_data, protect=pending_images)
+
+    def extract(path):
+        return parse_invoice(path, client, prompt=INVOICE_PROMPT, cache=cache,
+                             preprocess_options=config_data.get('preprocess'), catalog=catalog,
+                             pdf_options=config_data.get('pdf'))
+
+    counts = queue_counts()
+    click.echo(f"Worker started: {counts['queued']} jobs queued, {counts['running']} running")
+    processed = run_worker(extract, store, concurrency=concurrency, poll_interval=poll_interval, max_jobs=max_jobs,
+                           lease_seconds=jobs_config.get('lease_seconds', DEFAULT_LEASE_SECONDS), echo=click.echo)
+    click.echo(f"Done: {processed['done']}, duplicates: {processed['duplicate']}, requeued: {processed['queued']}, "
+               f"failed: {processed['failed']}")
+
+
+@cli.command()
+@click.option('--config', default='config.yaml', help='Path to configuration file')
+def explain(config):
+    """Explain the app's standard queries and flag any that fall back to a collection scan."""
+    from invoicer.data.query_plans import check_query_plans
+
+    setup(config)
+    results = check_query_plans()
+    for result in results:
+        status = "COLLSCAN" if result['collscan'] else "ok"
+        click.echo(f"{result['name']:<24} {status:<9} {' > '.join(result['stages'])}")
+
+    scans = [result['name'] for result in results if result['collscan']]
+    if scans:
+        raise click.ClickException(f"{len(scans)} queries use a collection scan: {', '.join(scans)}")
+    click.echo("All standard queries use an index.")
+
+
+@cli.command()
+@click.option('--limit', default=100, show_default=True, help='Maximum number of duplicate groups listed')
+@click.option('--config', default='config.yaml', help='Path to configuration file')
+def duplicates(limit, config):
+    """List invoices stored more than once (same issuer, invoice number and issue date)."""
+    from invoicer.data.dedup import describe_duplicate, duplicate_invoice_groups
+
+    setup(config)
+    groups = duplicate_invoice_groups(limit)
+    for group in groups:
+        click.echo(f"{describe_duplicate(group['_id'])}: {group['count']} copies "
+                   f"({', '.join(str(invoice_id) for invoice_id in group['ids'])})")
+    if groups:
+        raise click.ClickException(f"{len(groups)} invoices are stored more than once; delete the extra copies "
+                                   f"so the unique invoice index can be created.")
+    click.echo("No duplicate invoices.")
+
+
+@cli.command(name='build-catalog')
+@click.option('--config', default='config.yaml', help='Path to configuration file')
+def build_catalog(config):
+    """Learn the product catalog from all stored invoices."""
+    from invoicer.data.catalog import learn_from_invoices
+
+    setup(config)
+    click.echo(f"The product catalog holds {learn_from_invoices()} products.")
 
-def parse_invoice(image_path, api_key):
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro-vision:generateContent?key={api_key}"
+
+@cli.command(name='rebuild-rollups')
+@click.option('--check', is_flag=True, help='Only report inconsistencies, do not repair them')
+@click.option('--config', default='config.yaml', help='Path to configuration file')
+def rebuild_rollups_command(check, config):
+    """Recompute the spend rollups from all invoices and repair any rows that disagree."""
+    from invoicer.data.rollups import rebuild_rollups
+
+    setup(config)
+    counts = rebuild_rollups(apply=not check)
+    click.echo(f"Missing rows: {counts['missing']}, stale rows: {counts['stale']}, "
+               f"orphaned rows: {counts['orphaned']}")
+    if check and any(counts.values()):
+        raise click.ClickException("Rollups are out of date; run without --check to repair them.")
+    click.echo("Rollups are consistent." if check or not any(counts.values()) else "Rollups repaired.")
+
+
+@cli.command(name='price-history')
+@click.argument('product')
+@click.option('--months', default=12, show_default=True, help='How many months back to look')
+@click.option('--config', default='config.yaml', help='Path to configuration file')
+def price_history_command(product, months, config):
+    """Show the min, median and last unit price of PRODUCT per store.
+
+    PRODUCT is matched by its receipt, German or English name, ignoring case, spaces and punctuation.
+    """
+    from invoicer.data.prices import price_history, price_summary
+
+    setup(config)
+    points = price_history(product, months)
+    if not points:
+        click.echo(f"No purchases of {product} in the last {months} months.")
+        return
+    click.echo(f"Unit price of {product} over the last {months} months ({len(points)} purchases):")
+    click.echo(f"{'Store':<30} {'Min':>8} {'Median':>8} {'Last':>8}  {'Last bought':<10} {'Purchases':>9}")
+    for row in price_summary(points):
+        click.echo(f"{(row['issuer'] or 'Unknown')[:30]:<30} {row['min']:>8.2f} {row['median']:>8.2f} "
+                   f"{row['last']:>8.2f}  {row['last_date']:%Y-%m-%d} {row['purchases']:>10}")
+
+
+@cli.command(name='rebuild-price-history')
+@click.option('--config', default='config.yaml', help='Path to configuration file')
+def rebuild_price_history_command(config):
+    """Rebuild the price history from all invoices, e.g. for invoices stored before it existed."""
+    from invoicer.data.prices import rebuild_price_history
+
+    setup(config)
+    click.echo(f"The price history holds {rebuild_price_history()} price points.")
+
+
+@cli.command()
+@click.option('--max-mb', type=float, default=None,
+              help='Size to shrink the blob store to (default: blobs.max_mb from the config)')
+@click.option('--dry-run', is_flag=True, help='Only report what would be evicted')
+@click.option('--config', default='config.yaml', help='Path to configuration file')
+def gc(max_mb, dry_run, config):
+    """Evict the least recently used uploaded images beyond the blob store's size budget."""
+    from invoicer.data.blobs import BlobStore
+    from invoicer.jobs import pending_images
+
+    config_data = setup(config)
+    store = BlobStore.from_config(config_data, protect=pending_images)
+    max_bytes = None if max_mb is None else int(max_mb * (1 << 20))
+    if max_bytes is None and store.max_bytes is None:
+        raise click.ClickException("The blob store has no size budget; pass --max-mb.")
+    summary = store.gc(max_bytes, dry_run=dry_run)
+    click.echo(f"{'Would evict' if dry_run else 'Evicted'} {summary['evicted']} of {summary['blobs']} images, "
+               f"{summary['evicted_bytes'] / (1 << 20):.1f} of {summary['bytes'] / (1 << 20):.1f} MB")
+
+
+@cli.command(name='export')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'file_format', type=click.Choice(FORMATS), default=None,
+              help='Output format; inferred from the file extension by default')
+@click.option('--start-date', type=click.DateTime(), help='Only export invoices issued on or after this date')
+@click.option('--end-date', type=click.DateTime(), help='Only export invoices issued on or before this date')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Documents fetched per round trip')
+@click.option('--config', default='config.yaml', help='Path to configuration file')
+def export_command(output, file_format, start_date, end_date, batch_size, config):
+    """Export invoices to JSONL, item-level CSV or Parquet."""
+    from invoicer.data.formats import infer_format
+    from invoicer.data.reports import date_match
+    from invoicer.data.transfer import export_invoices
+
+    setup(config)
+    query = date_match(start_date and start_date.date(), end_date and end_date.date())['$match']
+    try:
+        file_format = file_format or infer_format(output)
+        summary = export_invoices(output, file_format, query, batch_size)
+    except (RuntimeError, ValueError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Exported {summary['invoices']} invoices to {output} in {summary['elapsed_s']:.1f}s "
+               f"({summary['invoices_per_s']:.0f} invoices/s)")
+
+
+@cli.command(name='import')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(FORMATS), default=None,
+              help='Input format; inferred from the file extension by default')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Invoices per insert_many call')
+@click.option('--new-ids', is_flag=True, help='Assign new ids instead of keeping the ids stored in the file')
+@click.option('--config', default='config.yaml', help='Path to configuration file')
+def import_command(source, file_format, batch_size, new_ids, config):
+    """Import invoices from a JSONL, CSV or Parquet file written by `invoicer export`."""
+    from invoicer.data.formats import infer_format
+    from invoicer.data.transfer import import_invoices
+
+    setup(config)
+    try:
+        file_format = file_format or infer_format(source)
+        summary = import_invoices(source, file_format, batch_size, keep_ids=not new_ids, echo=click.echo)
+    except (RuntimeError, ValueError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Read {summary['rows']} rows ({summary['invoices']} invoices) in {summary['elapsed_s']:.1f}s "
+               f"({summary['rows_per_s']:.0f} rows/s)")
+    click.echo(f"Inserted: {summary['inserted']}, invalid: {summary['invalid']}, "
+               f"rejected by the database: {summary['failed']}")
+
+
+@cli.command()
+@click.option('--since', type=click.DateTime(), default=None, help='Only include spans recorded after this time')
+@click.option('--log', 'log_path', default=None, help='Span log to read (default: metrics.log_path from the config)')
+@click.option('--config', default='config.yaml', help='Path to configuration file')
+def stats(since, log_path, config):
+    """Summarize the recorded timing spans: count, errors and latency percentiles per stage."""
+    from invoicer import metrics
+    from invoicer.data.config import load_config
+
+    if log_path is None:
+        metrics_config = (load_config(config) if os.path.exists(config) else {}).get('metrics') or {}
+        log_path = metrics_config.get('log_path', metrics.DEFAULT_LOG_PATH)
+    if not os.path.exists(log_path):
+        raise click.ClickException(f"No span log at {log_path}; enable the metrics section in the config first.")
+
+    summary = metrics.summarize(metrics.read_span_log(log_path, since and since.timestamp()))
+    if not summary:
+        click.echo("No spans recorded.")
+        return
+    click.echo(f"{'span':<24} {'count':>7} {'errors':>6} {'total s':>9} {'mean ms':>9} "
+               f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, row in summary.items():
+        click.echo(f"{name:<24} {row['count']:>7} {row['errors']:>6} {row['total']:>9.2f} {row['mean'] * 1000:>9.1f} "
+                   f"{row['p50'] * 1000:>9.1f} {row['p95'] * 1000:>9.1f} {row['p99'] * 1000:>9.1f}")
+
+
+DEFAULT_PROMPT = ("Extract the items, quantities, and prices from this invoice image. Format the response as a JSON "
+                  "object with 'items' as a list of objects containing 'name', 'quantity', and 'price', and a "
+                  "'total_price' field.")
+
+
+def parse_invoice(image_path, client, prompt=None, cache=None, bypass_cache=False, preprocess_options=None,
+                  catalog=None, pdf_options=None):
+    """Extract an invoice image or PDF; with a ``catalog``, product names are translated locally (compact prompt).
+
+    The pages of a PDF are extracted separately, ``pdf_options['concurrency']`` at a time, and merged; the merged
+    response is cached for the whole document.
+    """
+    from invoicer.data.cache import cached_extraction
+    from invoicer.data.catalog import complete_translations
+    from invoicer.data.extraction import COMPACT_INVOICE_PROMPT, load_response_json
+    from invoicer.data.pdf import extract_pdf, extraction_options, is_pdf, resolve_options
+    from invoicer.data.preprocess import image_mime_type, preprocess_image, resolve_options as resolve_preprocess
+
+    prompt = COMPACT_INVOICE_PROMPT if catalog is not None else prompt or DEFAULT_PROMPT
 
     with open(image_path, 'rb') as image_file:
         image_data = image_file.read()
 
-    payload = {
-        "contents": [{
-            "parts": [
-                {
-                    "text": "Extract the items, quantities, and prices from this invoice image. Format the response as a JSON object with 'items' as a list of objects containing 'name', 'quantity', and 'price', and a 'total_price' field."},
-                {
-                    "inline_data": {
-                        "mime_type": "image/jpeg",
-                        "data": base64.b64encode(image_data).decode('utf-8')
-                    }
-                }
-            ]
-        }]
-    }
-
-    response = requests.post(url, json=payload)
-    response_data = response.json()
-
-    # Extract the generated text from the response
-    generated_text = response_data['candidates'][0]['content']['parts'][0]['text']
+    # The cache is keyed on the file's bytes and the options, so a hit neither pre-processes nor renders.
+    if is_pdf(image_data):
+        pdf_options = resolve_options(pdf_options)
+        options = extraction_options(pdf_options, preprocess_options)
+
+        def generate():
+            merged = extract_pdf(image_data,
+                                 lambda page, mime_type: load_response_json(client.extract(page, mime_type, prompt)),
+                                 pdf_options['concurrency'], pdf_options['max_long_edge'], preprocess_options)
+            return json.dumps(merged, ensure_ascii=False)
+    else:
+        options = resolve_preprocess(preprocess_options)
+
+        def generate():
+            prepared, mime_type = preprocess_image(image_data, image_mime_type(image_data, image_path), options)
+            return client.extract(prepared, mime_type, prompt)
 
     # Parse the generated text as JSON
-    parsed_data = json.loads(generated_text)
+    parsed_data = load_response_json(cached_extraction(cache, image_data, client.model, prompt, generate,
+                                                       bypass=bypass_cache, options=options))
+    if catalog is not None:
+        complete_translations(parsed_data, catalog, client.generate_text)
 
     return parsed_data
 
@@ -99,9 +426,9 @@ def parse_invoice(image_path, api_key):
 @click.command()
 def run_app():
     """Run the Streamlit application."""
-    streamlit_app_path = os.path.join(os.path.dirname(__file__), 'streamlit_app.py')
+    app_path = os.path.join(os.path.dirname(__file__), 'app.py')
     click.echo("Starting Streamlit app...")
-    subprocess.run(["streamlit", "run", streamlit_app_path])
+    subprocess.run(["streamlit", "run", app_path])
 
 
 # Add the new command to your cli group
@@ -0,0 +1,189 @@
+"""Local columnar snapshot of the invoices for the dashboard and reports.
+
+The snapshot keeps two Parquet tables on disk: one row per invoice and one row per item. ``sync()`` brings
+them up to date incrementally: it lists the invoice ids (an index-only query) to find new and deleted
+invoices, and fetches only those plus the invoices whose ``Updated_At`` is newer than the last sync.
+Reports are vectorized pandas group-bys over the in-memory tables, so they never query the database.
+Requires pyarrow (the ``analytics`` extra).
+"""
+import importlib.util
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+import pandas as pd
+from bson import ObjectId
+
+from invoicer.data.model import Invoice
+from invoicer.data.readmodel import ANALYTICS_FIELDS, ANALYTICS_PROJECTION, ITEM_FIELDS
+from invoicer.data.reports import GROUPINGS, DateLike
+from invoicer.data.rollups import UNNAMED_PRODUCT
+from invoicer.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ANALYTICS_DIR = '.invoicer_cache/analytics'
+DEFAULT_SYNC_INTERVAL = 60
+# Invoices changed up to this long before the last sync are fetched again, in case the writers' clocks differ.
+CLOCK_SKEW = timedelta(minutes=5)
+
+INVOICE_COLUMNS = list(ANALYTICS_FIELDS)
+ITEM_COLUMNS = list(ITEM_FIELDS)
+_PERIOD_FORMATS = {'day': '%Y-%m-%d', 'week': '%G-W%V', 'month': '%Y-%m'}
+
+
+def _frames(documents: Iterable[dict]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Invoice and item tables for raw invoice documents projected to ``ANALYTICS_PROJECTION``."""
+    invoices, items = [], []
+    for document in documents:
+        invoice_id = str(document['_id'])
+        invoices.append([invoice_id] + [document.get(name) for name in INVOICE_COLUMNS])
+        for item in document.get('Items') or []:
+            items.append([invoice_id, document.get('Issuer'), document.get('Date_Issued')] +
+                         [item.get(name) for name in ITEM_COLUMNS])
+    invoices = pd.DataFrame(invoices, columns=['id'] + INVOICE_COLUMNS)
+    items = pd.DataFrame(items, columns=['id', 'Issuer', 'Date_Issued'] + ITEM_COLUMNS)
+    # Invoices extracted without a date or price keep them as None; make the columns typed for group-bys.
+    for frame in (invoices, items):
+        frame['Date_Issued'] = pd.to_datetime(frame['Date_Issued'], errors='coerce')
+    invoices['Updated_At'] = pd.to_datetime(invoices['Updated_At'], errors='coerce')
+    for column in ('Invoice_Number', 'Total_Invoice_Expense_EUR'):
+        invoices[column] = pd.to_numeric(invoices[column], errors='coerce')
+    for column in ('Quantity', 'Unit_Price_EUR', 'Total_Price_EUR'):
+        items[column] = pd.to_numeric(items[column], errors='coerce')
+    return invoices, items
+
+
+class AnalyticsSnapshot:
+    """Invoice and item tables mirrored from MongoDB into Parquet files in ``directory``.
+
+    ``sync()`` does nothing if the last sync is less than ``sync_interval`` seconds old. Safe to share
+    between threads.
+    """
+
+    def __init__(self, directory: str = DEFAULT_ANALYTICS_DIR, sync_interval: float = DEFAULT_SYNC_INTERVAL):
+        self.directory = directory
+        self.sync_interval = sync_interval
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._synced_at = None
+        self._invoices = None
+        self._items = None
+        self._watermark = None
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional['AnalyticsSnapshot']:
+        """Build the snapshot from the ``analytics`` section of the app config, or None if it is disabled."""
+        analytics_config = config.get('analytics') or {}
+        if not analytics_config.get('enabled', False):
+            return None
+        if importlib.util.find_spec('pyarrow') is None:
+            raise RuntimeError("The analytics snapshot requires pyarrow: pip install 'invoicer[analytics]'")
+        return cls(analytics_config.get('path', DEFAULT_ANALYTICS_DIR),
+                   analytics_config.get('sync_interval', DEFAULT_SYNC_INTERVAL))
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        if self._invoices is not None:
+            return
+        try:
+            self._invoices = pd.read_parquet(self._path('invoices.parquet'))
+            self._items = pd.read_parquet(self._path('items.parquet'))
+            with open(self._path('state.json')) as f:
+                self._watermark = datetime.fromisoformat(json.load(f)['watermark'])
+        except (FileNotFoundError, KeyError, TypeError, ValueError):
+            (self._invoices, self._items), self._watermark = _frames([]), None
+
+    def _write(self, name: str, frame: pd.DataFrame):
+        temp_path = self._path(f"{name}.{uuid.uuid4().hex}.tmp")
+        frame.to_parquet(temp_path, index=False)
+        os.replace(temp_path, self._path(name))
+
+    def _save(self, tables: bool = True):
+        if tables:
+            self._write('invoices.parquet', self._invoices)
+            self._write('items.parquet', self._items)
+        temp_path = self._path(f"state.json.{uuid.uuid4().hex}.tmp")
+        with open(temp_path, 'w') as f:
+            json.dump({'watermark': self._watermark.isoformat()}, f)
+        os.replace(temp_path, self._path('state.json'))
+
+    @timed('analytics.sync')
+    def sync(self, force: bool = False) -> Dict[str, int]:
+        """Fetch new and changed invoices and drop deleted ones; returns what changed."""
+        with self._lock:
+            if not force and self._synced_at is not None and time.monotonic() - self._synced_at < self.sync_interval:
+                return {'fetched': 0, 'deleted': 0}
+            self._load()
+            started = datetime.now(timezone.utc).replace(tzinfo=None)
+            collection = Invoice._get_collection()
+            stored = {str(row['_id']) for row in collection.find({}, {'_id': 1})}
+            known = set(self._invoices['id'])
+            deleted = known - stored
+            query = {'_id': {'$in': [ObjectId(invoice_id) for invoice_id in stored - known]}}
+            if not known:
+                query = {}
+            elif self._watermark is not None:
+                query = {'$or': [query, {'Updated_At': {'$gte': self._watermark - CLOCK_SKEW}}]}
+            invoices, items = _frames(collection.find(query, ANALYTICS_PROJECTION))
+
+            changed = deleted | set(invoices['id'])
+            if changed:
+                self._invoices = pd.concat([self._invoices[~self._invoices['id'].isin(changed)], invoices],
+                                           ignore_index=True)
+                self._items = pd.concat([self._items[~self._items['id'].isin(changed)], items], ignore_index=True)
+            self._watermark = started
+            self._save(tables=bool(changed))
+            self._synced_at = time.monotonic()
+            return {'fetched': len(invoices), 'deleted': len(deleted)}
+
+    def tables(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """The invoice and item tables as of the last sync."""
+        with self._lock:
+            self._load()
+            return self._invoices, self._items
+
+    @timed('analytics.report')
+    def report(self, start_date: DateLike = None, end_date: DateLike = None, groupings=GROUPINGS) -> dict:
+        """Same result as ``reports.expenditure_report``, computed from the local tables."""
+        invoices, items = self.tables()
+        if start_date is not None or end_date is not None:
+            issued = invoices['Date_Issued']
+            selected = issued.notna()
+            if start_date is not None:
+                selected &= issued >= pd.Timestamp(start_date)
+            if end_date is not None:
+                # A plain date includes the whole day.
+                end = pd.Timestamp(end_date)
+                selected &= issued < end + pd.Timedelta(days=1) if not isinstance(end_date, datetime) else issued <= end
+            invoices = invoices[selected]
+            items = items[items['id'].isin(invoices['id'])]
+
+        report = {'total': float(invoices['Total_Invoice_Expense_EUR'].sum()), 'invoices': len(invoices)}
+        for grouping in groupings:
+            if grouping == 'product':
+                grouped = (items.assign(Name=items['Name'].fillna(UNNAMED_PRODUCT))
+                           .groupby('Name')[['Total_Price_EUR', 'Quantity']].sum()
+                           .rename(columns={'Total_Price_EUR': 'total', 'Quantity': 'quantity'}))
+            else:
+                keys = (invoices['Issuer'] if grouping == 'issuer'
+                        else invoices['Date_Issued'].dt.strftime(_PERIOD_FORMATS[grouping]))
+                grouped = (invoices.groupby(keys.rename('key'), dropna=False)['Total_Invoice_Expense_EUR']
+                           .agg(total='sum', invoices='size'))
+            grouped = grouped.sort_values('total', ascending=False) if grouping in ('product', 'issuer') \
+                else grouped.sort_index()
+            rows = grouped.reset_index().rename(columns={'Name': 'key'}).to_dict('records')
+            for row in rows:
+                row['key'] = None if pd.isna(row['key']) else row['key']
+                row['total'] = float(row['total'])
+                if 'invoices' in row:
+                    row['invoices'] = int(row['invoices'])
+            report[grouping] = rows
+        return report
@@ -1,40 +1,151 @@
+import json
+import logging
 import re
-import os
-from datetime import datetime
-from typing import Union
 
-import google.generativeai as genai
-from invoicer.data.model import Invoice, Item
-import logging
 import streamlit as st
 
+from invoicer.data.analytics import AnalyticsSnapshot
+from invoicer.data.blobs import BlobStore
+from invoicer.data.cache import ExtractionCache, cached_extraction, cached_extraction_stream
+from invoicer.data.catalog import ProductCatalog
+from invoicer.data.config import load_config
+from invoicer.data.extraction import load_response_json
+from invoicer.data.model import Item
+from invoicer.data.pdf import extract_pdf, extraction_options
+from invoicer.data.preprocess import preprocess_image, resolve_options as resolve_preprocess_options
+from invoicer.data.prices import price_history
+from invoicer.data.rollups import rollup_report
+from invoicer.db_connection import connect_to_db
+from invoicer.jobs import pending_images
+from invoicer.metrics import configure as configure_metrics, span, timed
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def get_gemini_response(gemini_model, prompt, image):
-    model = genai.GenerativeModel(gemini_model)
-    response = model.generate_content([prompt, image[0]])
-    print(response.text)
+# Query results shown in the app are cached for this many seconds, or until an invoice is changed.
+QUERY_CACHE_TTL = 300
+
+
+# Process-wide resources: created on the first run of the app and reused by every rerun and session.
+@st.cache_resource
+def get_config(config_path):
+    return load_config(config_path)
+
+
+@st.cache_resource
+def configure_gemini(api_key):
+    # The SDK is slow to import; only the extraction pages need it.
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+
+
+@st.cache_resource
+def init_db(config_path):
+    connect_to_db(config_path)
+
+
+@st.cache_resource
+def init_metrics(config_path):
+    configure_metrics(get_config(config_path))
+
+
+@st.cache_resource
+def get_extraction_cache(config_path):
+    return ExtractionCache.from_config(get_config(config_path))
+
+
+@st.cache_resource
+def get_analytics_snapshot(config_path):
+    return AnalyticsSnapshot.from_config(get_config(config_path))
+
+
+@st.cache_resource
+def get_blob_store(config_path):
+    return BlobStore.from_config(get_config(config_path), protect=pending_images)
+
+
+@st.cache_resource
+def get_product_catalog(config_path):
+    return ProductCatalog.from_config(get_config(config_path))
+
+
+@st.cache_resource
+def get_gemini_model(gemini_model):
+    import google.generativeai as genai
+
+    return genai.GenerativeModel(gemini_model)
+
+
+def gemini_text(gemini_model, prompt):
+    """Text-only model call, e.g. to translate product names missing from the catalog."""
+    return get_gemini_model(gemini_model).generate_content(prompt).text
+
+
+def _generate(gemini_model, prompt, image_part):
+    model = get_gemini_model(gemini_model)
+    with span('llm.call', model=gemini_model):
+        response = model.generate_content([prompt, image_part])
+    logger.debug(f"Gemini response: {response.text}")
     return response.text
 
 
-def save_uploaded_file(uploadedfile):
-    temp_dir = "tempDir"
-    if not os.path.exists(temp_dir):
-        os.makedirs(temp_dir)
-    file_path = os.path.join(temp_dir, uploadedfile.name)
-    with open(file_path, "wb") as f:
-        f.write(uploadedfile.getbuffer())
-    return file_path
+def get_gemini_response(gemini_model, prompt, uploaded_file, preprocess_options=None, cache=None, bypass_cache=False):
+    """Extract an uploaded image; a cache hit is looked up from the upload's bytes, before any pre-processing."""
+    def generate():
+        return _generate(gemini_model, prompt, input_image_setup(uploaded_file, preprocess_options)[0])
+
+    return cached_extraction(cache, uploaded_file.getvalue(), gemini_model, prompt, generate, bypass=bypass_cache,
+                             options=resolve_preprocess_options(preprocess_options))
+
+
+def stream_gemini_response(gemini_model, prompt, uploaded_file, preprocess_options=None, cache=None,
+                           bypass_cache=False):
+    """Yield the response text in chunks as the model generates it."""
+    def stream():
+        image_part = input_image_setup(uploaded_file, preprocess_options)[0]
+        model = get_gemini_model(gemini_model)
+        with span('llm.call', model=gemini_model, stream=True):
+            for chunk in model.generate_content([prompt, image_part], stream=True):
+                yield chunk.text
+
+    return cached_extraction_stream(cache, uploaded_file.getvalue(), gemini_model, prompt, stream,
+                                    bypass=bypass_cache, options=resolve_preprocess_options(preprocess_options))
+
+
+def get_pdf_response(gemini_model, prompt, uploaded_file, pdf_options, preprocess_options=None, cache=None,
+                     bypass_cache=False):
+    """Extract an uploaded PDF page by page and merge the pages; the merged response is cached per document."""
+    def extract_page(page, mime_type):
+        return load_response_json(_generate(gemini_model, prompt, {"mime_type": mime_type, "data": page}))
 
+    def generate():
+        merged = extract_pdf(uploaded_file.getvalue(), extract_page, pdf_options['concurrency'],
+                             pdf_options['max_long_edge'], preprocess_options)
+        return json.dumps(merged, ensure_ascii=False)
 
-def input_image_setup(uploaded_file):
+    return cached_extraction(cache, uploaded_file.getvalue(), gemini_model, prompt, generate, bypass=bypass_cache,
+                             options=extraction_options(pdf_options, preprocess_options))
+
+
+@timed('upload.save')
+def save_uploaded_file(uploadedfile, store):
+    """Put an uploaded image in the blob store once per upload; returns its SHA-256."""
+    stored = st.session_state.setdefault('stored_uploads', {})
+    if uploadedfile.file_id not in stored:
+        uploadedfile.seek(0)
+        stored[uploadedfile.file_id] = store.put(uploadedfile)
+        uploadedfile.seek(0)
+    return stored[uploadedfile.file_id]
+
+
+def input_image_setup(uploaded_file, preprocess_options=None):
     if uploaded_file is not None:
-        bytes_data = uploaded_file.getvalue()
+        bytes_data, mime_type = preprocess_image(uploaded_file.getvalue(), uploaded_file.type, preprocess_options)
         image_parts = [
             {
-                "mime_type": uploaded_file.type,
+                "mime_type": mime_type,
                 "data": bytes_data
             }
         ]
@@ -89,149 +200,19 @@ def parse_response(response_text):
     return items, total_price
 
 
-def convert_response_object_to_pydantic_model(data: Union[dict, list]):
-    if isinstance(data, list):
-        for item in data:
-            convert_response_object_to_pydantic_model(item)
-    else:
-        for k, v in data.copy().items():
-            if isinstance(v, (dict, list)):
-                convert_response_object_to_pydantic_model(data[k])
-
-            new_k = k.replace(' ', '_').replace('(', '').replace(')', '')
-            del data[k]
-            data[new_k] = v
-    return data
-
-
-def save_to_mongodb():
-    print("Save to MongoDB function called")
-    if st.session_state.processed_items is not None and st.session_state.response_dict is not None:
-        try:
-            data = convert_response_object_to_pydantic_model(st.session_state.response_dict)
-            invoice = Invoice(**data)
-            st.info(f"Invoice created!")
-            invoice.save()
-            st.info("Invoice saved successfully!")
-            st.success("Invoice saved to MongoDB Atlas!")
-            st.session_state.processed_items = None
-            st.session_state.processed_total_price = None
-        except Exception as e:
-            st.error(f"Failed to save to MongoDB: {str(e)}")
-    else:
-        st.warning("No processed data available. Please extract invoice data first.")
-
-
-def query_invoices(start_date, end_date):
-    invoices = Invoice.objects(date__gte=start_date, date__lte=end_date)
-    return [{"date": inv.date.date(), "total_price": inv.total_price} for inv in invoices]
-
-
-def add_new_invoice(data=None):
-    if data is None:
-        data = {}
-    st.subheader("Add New Invoice")
-
-    if 'item_count' not in st.session_state:
-        st.session_state.item_count = 1
-
-    with st.form("new_invoice_form2"):
-        date = st.date_input("Invoice Date", datetime.now())
-        time = st.time_input("Invoice Time", datetime.now().time())
-        total_price = st.number_input("Total Price", min_value=0.0, step=0.01)
-        issuer = st.text_input("Issuer", '')
-        issuer_address = st.text_input("Issuer Address", '')
-        issuer_phone = st.text_input("Issuer Phone", '')
-
-        items = []
-        for i in range(st.session_state.item_count):
-            col1, col2, col3, col4, col5, col6 = st.columns([1, 1, 1, 1, 1.5, 1.5])
-            with col1:
-                name = st.text_input(f"Name {i + 1}", key=f"name_{i}")
-            with col2:
-                unit_price_eur = st.number_input(f"Unit Price (EUR) {i + 1}", min_value=0, step=1,
-                                                 key=f"unit_price_eur{i}")
-            with col3:
-                total_price_eur = st.number_input(
-                    f"Total Price (EUR) {i + 1}", min_value=0.0, step=0.01, key=f"total_price_eur{i}")
-            with col4:
-                quantity = st.number_input(
-                    f"Quantity {i + 1}", min_value=0, step=1, key=f"quantity{i}")
-            with col5:
-                product_name_ger = st.text_input(
-                    f"Product Name (German) {i + 1}", key=f"product_name_ger{i}")
-            with col6:
-                product_name_eng = st.text_input(
-                    f"Product Name (English) {i + 1}", key=f"product_name_eng{i}")
-
-            if name is not None and quantity > 0 and total_price_eur > 0:
-                items.append(Item(
-                    Name=name,
-                    Unit_Price_EUR=unit_price_eur,
-                    Total_Price_EUR=total_price_eur,
-                    Quantity=quantity,
-                    Product_Name_German=product_name_ger,
-                    Product_Name_English=product_name_eng,
-                ))
-
-        add_item = st.form_submit_button("Add a New Item")
-        if add_item:
-            st.session_state.item_count += 1
-            st.experimental_rerun()
-
-        submitted = st.form_submit_button("Upload Invoice")
-        if submitted:
-            new_invoice = Invoice(
-                Date_Issued=datetime.combine(date, time),
-                Time_Issued=time.isoformat(),
-                Items=items,
-                Total_Invoice_Expense_EUR=total_price,
-                Issuer=issuer,
-                Issuer_Address=issuer_address,
-                Issuer_Phone=issuer_phone
-            )
-            new_invoice.save()
-            st.success("New invoice added successfully!")
-            st.session_state.item_count = 1
-
-
-def edit_delete_invoice():
-    st.subheader("Edit/Delete Invoice")
-    invoices = Invoice.objects.order_by('-date')
-    selected_invoice = st.selectbox("Select an invoice", options=invoices,
-                                    format_func=lambda x: f"{x.date} - Total: {x.total_price}")
-
-    if selected_invoice:
-        with st.form("edit_invoice_form"):
-            date = st.date_input("Invoice Date", selected_invoice.date)
-            total_price = st.number_input("Total Price", min_value=0.0, step=0.01, value=selected_invoice.total_price)
-
-            items = []
-            for i, item in enumerate(selected_invoice.items):
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    name = st.text_input(f"Item {i + 1} Name", value=item.name, key=f"edit_name_{i}")
-                with col2:
-                    quantity = st.number_input(f"Item {i + 1} Quantity", min_value=0, step=1, value=item.quantity,
-                                               key=f"edit_quantity_{i}")
-                with col3:
-                    price = st.number_input(f"Item {i + 1} Price", min_value=0.0, step=0.01, value=item.price,
-                                            key=f"edit_price_{i}")
-
-                if name and quantity > 0 and price > 0:
-                    items.append(Item(name=name, quantity=quantity, price=price))
-
-            update = st.form_submit_button("Update Invoice")
-            delete = st.form_submit_button("Delete Invoice")
-
-            if update:
-                selected_invoice.date = date
-                selected_invoice.items = items
-                selected_invoice.total_price = total_price
-                selected_invoice.save()
-                st.success("Invoice updated successfully!")
-
-            if delete:
-                selected_invoice.delete()
-                st.success("Invoice deleted successfully!")
-                st.experimental_rerun()
+@st.cache_data(ttl=QUERY_CACHE_TTL, show_spinner=False)
+def cached_report(start_date, end_date, groupings):
+    return rollup_report(start_date, end_date, groupings)
+
+
+@st.cache_data(ttl=QUERY_CACHE_TTL, show_spinner=False)
+def cached_price_history(product, months):
+    return price_history(product, months)
+
+
+def invalidate_query_cache():
+    """Drop cached query results after an invoice was saved, edited or deleted."""
+    cached_report.clear()
+    cached_price_history.clear()
+    # The next report reloads the analytics snapshot and syncs it right away.
+    get_analytics_snapshot.clear()
@@ -0,0 +1,195 @@
+"""Content-addressed store for uploaded invoice images.
+
+Every image is stored once under its SHA-256 (the ``Image_SHA256`` of the invoice extracted from it) in
+directories sharded by the first two bytes of the digest, e.g. ``blobs/3f/a0/3fa0...``. Writes are streamed
+in chunks to a temporary file that is renamed into place, so readers never see a partial image and
+identical uploads are stored once. Reads are memory-mapped. The store is kept under a byte budget by evicting
+the least recently used images; ``invoicer gc`` does the same on demand.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, Optional, Set, Tuple, Union
+
+from invoicer.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOB_DIR = 'tempDir/blobs'
+DEFAULT_MAX_MB = 1024
+CHUNK_SIZE = 1 << 20
+# Temporary files older than this are left over from a crashed write.
+STALE_TEMP_SECONDS = 3600
+# Seconds between scans of the store size, which otherwise only counts this process's writes.
+RESCAN_SECONDS = 300
+
+
+class BlobStore:
+    """Images stored under their SHA-256, with least recently used images evicted beyond ``max_bytes``.
+
+    ``protect`` returns the digests that must not be evicted, e.g. the images of queued extraction jobs.
+    Safe to share between threads and processes. Each process tracks the size of the store from its own writes
+    and re-scans the directory every ``RESCAN_SECONDS`` (and on every ``gc``), so images written by other
+    processes count toward the budget within that interval.
+    """
+
+    def __init__(self, root: str = DEFAULT_BLOB_DIR, max_bytes: Optional[int] = DEFAULT_MAX_MB << 20,
+                 protect: Optional[Callable[[], Set[str]]] = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.protect = protect
+        self._temp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self._temp_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = None
+        self._scanned_at = 0.0
+
+    @classmethod
+    def from_config(cls, config: dict, protect: Optional[Callable[[], Set[str]]] = None) -> 'BlobStore':
+        """Build the store from the ``blobs`` section of the app config; ``max_mb: null`` disables eviction."""
+        blob_config = config.get('blobs') or {}
+        max_mb = blob_config.get('max_mb', DEFAULT_MAX_MB)
+        return cls(blob_config.get('path', DEFAULT_BLOB_DIR), None if max_mb is None else int(max_mb * (1 << 20)),
+                   protect)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def __contains__(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    @timed('blob.put')
+    def put(self, data: Union[bytes, BinaryIO, Iterable[bytes]]) -> str:
+        """Store bytes, a binary file object or an iterable of chunks; returns the SHA-256 of the content."""
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            chunks = (memoryview(data)[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE))
+        elif hasattr(data, 'read'):
+            chunks = iter(lambda: data.read(CHUNK_SIZE), b'')
+        else:
+            chunks = data
+
+        digest = hashlib.sha256()
+        size = 0
+        temp_path = os.path.join(self._temp_dir, f"{uuid.uuid4().hex}.tmp")
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = digest.hexdigest()
+            path = self.path(digest)
+            if os.path.exists(path):
+                os.utime(path)
+                return digest
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            over_budget = self.max_bytes is not None and self.size() > self.max_bytes
+        if over_budget:
+            self.gc(keep={digest})
+        return digest
+
+    def _touch(self, path: str):
+        # Access times are unreliable (noatime, relatime), so the modification time records the last use.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    @contextmanager
+    def open(self, digest: str) -> Iterator[Union[mmap.mmap, bytes]]:
+        """Memory-map a stored image; raises FileNotFoundError if it is not (or no longer) stored."""
+        path = self.path(digest)
+        with open(path, 'rb') as f:
+            self._touch(path)
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b''
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield data
+
+    def read(self, digest: str) -> bytes:
+        with self.open(digest) as data:
+            return bytes(data)
+
+    def _entries(self) -> Iterator[os.DirEntry]:
+        for first in os.scandir(self.root):
+            if not first.is_dir() or len(first.name) != 2:
+                continue
+            for second in os.scandir(first.path):
+                if second.is_dir():
+                    yield from (entry for entry in os.scandir(second.path) if entry.is_file())
+
+    def _stats(self) -> Iterator[Tuple[os.stat_result, os.DirEntry]]:
+        """Stored images with their stats, skipping those another process removes during the scan."""
+        for entry in self._entries():
+            try:
+                yield entry.stat(), entry
+            except FileNotFoundError:
+                continue
+
+    def size(self) -> int:
+        """Total size of the stored images in bytes; tracked between scans every ``RESCAN_SECONDS``."""
+        if self._size is None or time.monotonic() - self._scanned_at > RESCAN_SECONDS:
+            self._size = sum(stat.st_size for stat, _ in self._stats())
+            self._scanned_at = time.monotonic()
+        return self._size
+
+    @timed('blob.gc')
+    def gc(self, max_bytes: Optional[int] = None, keep: Iterable[str] = (), dry_run: bool = False) -> Dict[str, int]:
+        """Evict least recently used images until the store fits in ``max_bytes`` (default: the store's budget).
+
+        Images in ``keep`` or returned by ``protect`` are never evicted. Returns the number and size of the
+        images stored before the collection and of those evicted.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        protected = set(keep) | (self.protect() if self.protect else set())
+        now = time.time()
+        for entry in os.scandir(self._temp_dir):
+            if dry_run:
+                break
+            # Another store (or gc) may have finished or removed the temp file since the scan.
+            try:
+                if now - entry.stat().st_mtime > STALE_TEMP_SECONDS:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+
+        entries = list(self._stats())
+        total = sum(stat.st_size for stat, _ in entries)
+        summary = {'blobs': len(entries), 'bytes': total, 'evicted': 0, 'evicted_bytes': 0}
+        if max_bytes is not None and total > max_bytes:
+            for stat, entry in sorted(entries, key=lambda pair: pair[0].st_mtime):
+                if total <= max_bytes:
+                    break
+                if entry.name in protected:
+                    continue
+                total -= stat.st_size
+                if not dry_run:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        # Already evicted by another process: no longer stored, but not freed by this one.
+                        continue
+                summary['evicted'] += 1
+                summary['evicted_bytes'] += stat.st_size
+        if not dry_run:
+            with self._lock:
+                self._size = total
+                self._scanned_at = time.monotonic()
+        if summary['evicted']:
+            logger.info(f"Evicted {summary['evicted']} images ({summary['evicted_bytes'] / (1 << 20):.1f} MB) "
+                        f"from {self.root}")
+        return summary
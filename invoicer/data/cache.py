@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = '.invoicer_cache/extractions.sqlite3'
+DEFAULT_MAX_ENTRIES = 5000
+
+
+def extraction_key(image_bytes: bytes, model: str, prompt: str, options: Optional[dict] = None) -> str:
+    """Cache key for one extraction: image content, model name and prompt version (a digest of its text).
+
+    ``options`` are the settings that turn the uploaded bytes into what the model sees (pre-processing, PDF
+    rendering); keying on the uploaded bytes plus their digest lets a cache hit skip that work entirely.
+    """
+    prompt_version = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+    image_digest = hashlib.sha256(image_bytes).hexdigest()
+    key = f"{image_digest}:{model}:{prompt_version}"
+    if options is not None:
+        key += ':' + hashlib.sha256(json.dumps(options, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+    return key
+
+
+class ExtractionCache:
+    """Persistent SQLite-backed cache of raw model responses with LRU eviction.
+
+    At most ``max_entries`` responses are kept; the least recently read or written entries
+    are evicted first. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS extractions_last_access ON extractions (last_access)")
+        self._conn.commit()
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional['ExtractionCache']:
+        """Build the cache from the ``cache`` section of the app config, or None if it is disabled."""
+        cache_config = config.get('cache') or {}
+        if not cache_config.get('enabled', True):
+            return None
+        return cls(cache_config.get('path', DEFAULT_CACHE_PATH),
+                   cache_config.get('max_entries', DEFAULT_MAX_ENTRIES))
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM extractions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE extractions SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return row[0]
+
+    def put(self, key: str, response: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO extractions (key, response, last_access) VALUES (?, ?, ?)",
+                               (key, response, time.time()))
+            self._conn.execute(
+                "DELETE FROM extractions WHERE key IN ("
+                "SELECT key FROM extractions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM extractions")
+            self._conn.commit()
+
+
+def cached_extraction(cache: Optional[ExtractionCache], image_bytes: bytes, model: str, prompt: str,
+                      extract: Callable[[], str], bypass: bool = False, options: Optional[dict] = None) -> str:
+    """Return the cached response for this image/model/prompt/options, or call ``extract`` and cache its result.
+
+    ``image_bytes`` are the uploaded bytes; ``extract`` does any pre-processing itself, so it only runs on a
+    miss. With ``bypass`` the cache is not read, but the fresh response still replaces the stored one.
+    """
+    if cache is None:
+        return extract()
+    key = extraction_key(image_bytes, model, prompt, options)
+    if not bypass:
+        response = cache.get(key)
+        if response is not None:
+            logger.info(f"Extraction cache hit for {key[:12]}")
+            return response
+    response = extract()
+    if response:
+        cache.put(key, response)
+    return response
+
+
+def cached_extraction_stream(cache: Optional[ExtractionCache], image_bytes: bytes, model: str, prompt: str,
+                             stream: Callable[[], Iterable[str]], bypass: bool = False,
+                             options: Optional[dict] = None) -> Iterator[str]:
+    """Streaming counterpart of ``cached_extraction``: yields the response in chunks as ``stream`` produces them.
+
+    A cached response is yielded as a single chunk; a fresh one is cached once the stream completes.
+    """
+    key = extraction_key(image_bytes, model, prompt, options) if cache is not None else None
+    if key is not None and not bypass:
+        response = cache.get(key)
+        if response is not None:
+            logger.info(f"Extraction cache hit for {key[:12]}")
+            yield response
+            return
+    chunks = []
+    for chunk in stream():
+        chunks.append(chunk)
+        yield chunk
+    response = ''.join(chunks)
+    if key is not None and response:
+        cache.put(key, response)
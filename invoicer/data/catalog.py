@@ -0,0 +1,155 @@
+"""Product catalog: canonical German/English names for the item names printed on receipts.
+
+The catalog is learned from every saved invoice and from manually entered invoices (which take
+precedence). With ``catalog.translate_locally`` enabled, extraction uses a prompt without the translation
+fields and fills them from an in-memory dict of the catalog, asking the model only about unknown names.
+"""
+import re
+import threading
+import time
+import unicodedata
+from typing import Callable, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+from invoicer.data.extraction import load_response_json
+from invoicer.data.model import Invoice, Product
+from invoicer.data.readmodel import CATALOG_PROJECTION
+from invoicer.metrics import span
+
+GERMAN = 'Product Name (German)'
+ENGLISH = 'Product Name (English)'
+DEFAULT_MAX_AGE = 300
+
+TRANSLATION_PROMPT = """
+These are item names printed on German grocery receipts. For each name, give the full German product name and its
+English translation. Answer with a JSON object mapping every name exactly as given to an object with the keys
+"German" and "English", for example:
+{{"Lindt Excell.85%": {{"German": "Lindt Excellence 85%", "English": "Lindt Excellence 85%"}}}}
+
+Names:
+{names}
+"""
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """Catalog key for a receipt item name: case-folded, without punctuation and spaces.
+
+    Receipts print the same product with varying spacing and abbreviation dots ("Lindt Excell.85%",
+    "LINDT EXCELL 85 %"), so only letters, digits, "%" and "&" are kept.
+    """
+    if not name:
+        return ''
+    return re.sub(r'[^\w%&]+|_', '', unicodedata.normalize('NFKC', name).casefold())
+
+
+def learn_products(items: Iterable[dict], source: str = 'extracted'):
+    """Record the product names of stored invoice items (raw ``Item`` documents) in the catalog.
+
+    Manually entered names overwrite existing entries; extracted names only fill in unknown ones.
+    """
+    entries = {}
+    for item in items:
+        key = normalize_name(item.get('Name'))
+        if key and item.get('Product_Name_German') and item.get('Product_Name_English'):
+            entries[key] = item
+    if not entries:
+        return
+    names = '$set' if source == 'manual' else '$setOnInsert'
+    Product._get_collection().bulk_write([
+        UpdateOne({'Key': key}, {
+            names: {'Name': item['Name'], 'Product_Name_German': item['Product_Name_German'],
+                    'Product_Name_English': item['Product_Name_English'], 'Source': source},
+            '$inc': {'Seen_Count': 1},
+        }, upsert=True)
+        for key, item in entries.items()
+    ], ordered=False)
+
+
+def learn_from_invoices(batch_size: int = 1000) -> int:
+    """Backfill the catalog from every stored invoice; returns the number of catalog entries afterwards."""
+    items = []
+    for invoice in Invoice._get_collection().find({}, CATALOG_PROJECTION, batch_size=batch_size):
+        items.extend(invoice.get('Items') or [])
+        if len(items) >= batch_size:
+            learn_products(items)
+            items = []
+    learn_products(items)
+    return Product.objects.count()
+
+
+class ProductCatalog:
+    """In-memory index of the catalog, reloaded from the database once it is older than ``max_age`` seconds."""
+
+    def __init__(self, max_age: float = DEFAULT_MAX_AGE):
+        self.max_age = max_age
+        self._names = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional['ProductCatalog']:
+        """The catalog used for extraction, or None unless ``catalog.translate_locally`` is enabled."""
+        catalog_config = config.get('catalog') or {}
+        if not catalog_config.get('translate_locally', False):
+            return None
+        return cls(catalog_config.get('max_age', DEFAULT_MAX_AGE))
+
+    def refresh(self, force: bool = False):
+        with self._lock:
+            if not force and self._loaded_at is not None and time.monotonic() - self._loaded_at < self.max_age:
+                return
+            fields = {'Key': 1, 'Product_Name_German': 1, 'Product_Name_English': 1, '_id': 0}
+            self._names = {row['Key']: (row.get('Product_Name_German'), row.get('Product_Name_English'))
+                           for row in Product._get_collection().find({}, fields)}
+            self._loaded_at = time.monotonic()
+
+    def __len__(self):
+        self.refresh()
+        return len(self._names)
+
+    def lookup(self, name: str):
+        """The (German, English) names for a receipt item name, or None if it is unknown."""
+        self.refresh()
+        return self._names.get(normalize_name(name))
+
+    def remember(self, name: str, german: str, english: str):
+        """Add a translation to the in-memory index; it is stored once an invoice using it is saved."""
+        self._names[normalize_name(name)] = (german, english)
+
+    def fill(self, items: List[dict]) -> List[str]:
+        """Fill the translation fields of extracted ``items`` in place; returns the names not in the catalog."""
+        unknown = []
+        for item in items:
+            if item.get(GERMAN) and item.get(ENGLISH):
+                continue
+            names = self.lookup(item.get('Name'))
+            if names is None:
+                if item.get('Name') and item['Name'] not in unknown:
+                    unknown.append(item['Name'])
+                continue
+            item[GERMAN], item[ENGLISH] = names
+        return unknown
+
+
+def translation_prompt(names: List[str]) -> str:
+    return TRANSLATION_PROMPT.format(names='\n'.join(f"- {name}" for name in names))
+
+
+def complete_translations(response: dict, catalog: ProductCatalog, translate: Callable[[str], str]) -> Dict[str, int]:
+    """Fill the product names of an extraction response from the catalog.
+
+    Names missing from the catalog are translated with a single text-only model call through ``translate``.
+    Returns how many items were filled locally and how many needed the model.
+    """
+    items = response.get('Items') or []
+    unknown = catalog.fill(items)
+    if unknown:
+        with span('llm.translate', names=len(unknown)):
+            translations = load_response_json(translate(translation_prompt(unknown)))
+        for name, names in translations.items():
+            if isinstance(names, dict) and names.get('German') and names.get('English'):
+                catalog.remember(name, names['German'], names['English'])
+        catalog.fill(items)
+    translated = sum(item.get('Name') in unknown for item in items)
+    return {'local': len(items) - translated, 'translated': translated}
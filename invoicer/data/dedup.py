@@ -0,0 +1,142 @@
+"""Duplicate receipt detection.
+
+Every extracted invoice stores the SHA-256 of its source image and a 64-bit perceptual difference hash
+(dHash). Different photos of the same receipt have dHashes that differ in only a few bits. The hash is
+also stored as eight 8-bit bands in a multikey-indexed field. By the pigeonhole principle, two hashes
+within Hamming distance 7 share at least one band, so near-duplicate candidates are found with an
+indexed ``$in`` lookup and then checked for their exact distance.
+"""
+import hashlib
+import io
+import logging
+from typing import Dict, List, Optional
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from invoicer.data.model import Invoice
+from invoicer.data.pdf import is_pdf
+from invoicer.data.readmodel import SUMMARY_PROJECTION
+from invoicer.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+BANDS = 8
+BAND_BITS = HASH_BITS // BANDS
+# Distances up to BANDS - 1 are guaranteed to share a band with the query hash.
+MAX_DISTANCE = BANDS - 1
+DEFAULT_MAX_DISTANCE = 6
+
+
+def max_distance_from_config(config: dict) -> Optional[int]:
+    """The ``dedup.max_distance`` setting, or None if near-duplicate detection is disabled."""
+    dedup_config = config.get('dedup') or {}
+    if not dedup_config.get('enabled', True):
+        return None
+    return dedup_config.get('max_distance', DEFAULT_MAX_DISTANCE)
+
+
+def perceptual_hash(image_bytes: bytes) -> Optional[str]:
+    """64-bit difference hash of the image as 16 hex digits, or None if the image cannot be decoded."""
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image = ImageOps.exif_transpose(image).convert('L').resize((9, 8), Image.LANCZOS)
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning(f"Cannot compute a perceptual hash: {e}")
+        return None
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            value = (value << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return f"{value:016x}"
+
+
+def hash_bands(phash: str) -> List[str]:
+    """The hash split into ``BANDS`` position-tagged bands, e.g. ``['0:3f', '1:a0', ...]``."""
+    digits = BAND_BITS // 4
+    return [f"{band}:{phash[band * digits:(band + 1) * digits]}" for band in range(BANDS)]
+
+
+def hamming_distance(first: str, second: str) -> int:
+    return bin(int(first, 16) ^ int(second, 16)).count('1')
+
+
+def image_fingerprint(image_bytes: bytes) -> Dict[str, object]:
+    """The Invoice fields identifying its source image: exact and perceptual hashes."""
+    fields = {'Image_SHA256': hashlib.sha256(image_bytes).hexdigest()}
+    # A PDF is only matched exactly; rendering it just for a perceptual hash is not worth it.
+    phash = None if is_pdf(image_bytes) else perceptual_hash(image_bytes)
+    if phash is not None:
+        fields['Image_PHash'] = phash
+        fields['Image_PHash_Bands'] = hash_bands(phash)
+    return fields
+
+
+@timed('mongo.duplicate_lookup')
+def find_image_duplicates(fingerprint: Dict[str, object], max_distance: int = DEFAULT_MAX_DISTANCE,
+                          limit: int = 5) -> List[dict]:
+    """Stored invoices whose source image is identical or perceptually close, closest first.
+
+    Each result is an invoice summary with ``distance`` set (0 for an identical image file).
+    """
+    collection = Invoice._get_collection()
+    exact = list(collection.find({'Image_SHA256': fingerprint['Image_SHA256']}, SUMMARY_PROJECTION).limit(limit))
+    for row in exact:
+        row['distance'] = 0
+    phash = fingerprint.get('Image_PHash')
+    if phash is None or len(exact) >= limit:
+        return exact
+
+    max_distance = min(max_distance, MAX_DISTANCE)
+    seen = {row['_id'] for row in exact}
+    near = []
+    candidates = collection.find({'Image_PHash_Bands': {'$in': fingerprint['Image_PHash_Bands']}},
+                                 dict(SUMMARY_PROJECTION, Image_PHash=1))
+    for row in candidates:
+        if row['_id'] in seen:
+            continue
+        distance = hamming_distance(phash, row.pop('Image_PHash'))
+        if distance <= max_distance:
+            row['distance'] = distance
+            near.append(row)
+    near.sort(key=lambda row: row['distance'])
+    return exact + near[:limit - len(exact)]
+
+
+def find_invoice_duplicate(invoice: Invoice) -> Optional[dict]:
+    """The stored invoice with the same issuer, invoice number and issue date as ``invoice``, if any."""
+    document = invoice.to_mongo()
+    query = {field: document.get(field) for field in ('Issuer', 'Invoice_Number', 'Date_Issued')}
+    if not query['Issuer'] or query['Invoice_Number'] is None or query['Date_Issued'] is None:
+        return None
+    if invoice.id is not None:
+        query['_id'] = {'$ne': invoice.id}
+    return Invoice._get_collection().find_one(query, SUMMARY_PROJECTION)
+
+
+def duplicate_invoice_groups(limit: int = 100) -> List[dict]:
+    """Groups of stored invoices sharing issuer, invoice number and issue date."""
+    pipeline = [
+        {'$match': {'Issuer': {'$type': 'string'}, 'Invoice_Number': {'$type': 'number'},
+                    'Date_Issued': {'$type': 'date'}}},
+        {'$group': {'_id': {'Issuer': '$Issuer', 'Invoice_Number': '$Invoice_Number',
+                            'Date_Issued': '$Date_Issued'},
+                    'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+        {'$sort': {'count': -1}},
+        {'$limit': limit},
+    ]
+    return list(Invoice._get_collection().aggregate(pipeline, allowDiskUse=True))
+
+
+def describe_duplicate(row: dict) -> str:
+    issued = row.get('Date_Issued')
+    parts = [row.get('Issuer') or "Unknown issuer", f"{issued:%Y-%m-%d %H:%M}" if issued else "(no date)"]
+    if row.get('Invoice_Number') is not None:
+        parts.append(f"#{row['Invoice_Number']:g}")
+    if row.get('Total_Invoice_Expense_EUR') is not None:
+        parts.append(f"{row['Total_Invoice_Expense_EUR']:.2f} EUR")
+    if 'distance' in row:
+        parts.append("identical image" if row['distance'] == 0 else f"similar image (distance {row['distance']})")
+    return " | ".join(parts)
@@ -0,0 +1,170 @@
+import copy
+import json
+from datetime import datetime
+from typing import List, Union
+
+from invoicer.data.model import Invoice
+from invoicer.metrics import span, timed
+
+INVOICE_PROMPT = """
+Extract the following values in JSON format: Items (each item should be a nested dictionary with keys: Name,
+Quantity, Unit Price (EUR), Total Price (EUR), Product Name (German), Product Name (English)), Issuer,
+Issuer Address, Issuer Phone, Invoice Number, Date Issued, Time Issued.
+
+Ensure the output JSON structure matches this example:
+{
+    "Items": [
+        {
+            "Name": "Lindt Excell.85%",
+            "Quantity": 1,
+            "Unit Price (EUR)": 2.69,
+            "Total Price (EUR)": 2.69,
+            "Product Name (German)": "Lindt Excell.85%",
+            "Product Name (English)": "Lindt Excellence 85%"
+        }
+    ],
+    "Issuer": "EDEKA Christ",
+    "Issuer Address": "Hildburghauser Str. 52, 12279 Berlin",
+    "Issuer Phone": "030-710 99 49-0",
+    "Invoice Number": "3793",
+    "Date Issued": "05.07.2024",
+    "Time Issued": "20:37:58",
+    "Total Invoice Expense (EUR)": 17.2
+}
+"""
+
+# Used when product names are translated from the local catalog (see invoicer.data.catalog).
+COMPACT_INVOICE_PROMPT = """
+Extract the following values in JSON format: Items (each item should be a nested dictionary with keys: Name,
+Quantity, Unit Price (EUR), Total Price (EUR)), Issuer, Issuer Address, Issuer Phone, Invoice Number, Date Issued,
+Time Issued.
+
+Ensure the output JSON structure matches this example:
+{
+    "Items": [
+        {
+            "Name": "Lindt Excell.85%",
+            "Quantity": 1,
+            "Unit Price (EUR)": 2.69,
+            "Total Price (EUR)": 2.69
+        }
+    ],
+    "Issuer": "EDEKA Christ",
+    "Issuer Address": "Hildburghauser Str. 52, 12279 Berlin",
+    "Issuer Phone": "030-710 99 49-0",
+    "Invoice Number": "3793",
+    "Date Issued": "05.07.2024",
+    "Time Issued": "20:37:58",
+    "Total Invoice Expense (EUR)": 17.2
+}
+"""
+
+
+@timed('response.parse')
+def load_response_json(response_text: str) -> dict:
+    """Parse the JSON object contained in a model response, ignoring markdown code fences and surrounding prose."""
+    text = response_text.strip()
+    if text.startswith('```'):
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        text = text.rsplit('```', 1)[0]
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find('{'), text.rfind('}')
+        if start == -1 or end < start:
+            raise
+        return json.loads(text[start:end + 1])
+
+
+class ItemStreamParser:
+    """Incremental parser for a streamed extraction response.
+
+    ``feed()`` takes the response text chunk by chunk and returns the entries of the top-level ``Items``
+    array completed by that chunk, so they can be shown before the response is finished. Text outside the
+    root object (code fences, prose) is ignored. ``result()`` parses the complete response.
+    """
+
+    def __init__(self):
+        self._text = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._last_key = None
+        self._in_items = False
+        self._item_start = None
+
+    def feed(self, chunk: str) -> List[dict]:
+        self._text += chunk
+        items = []
+        text = self._text
+        for pos in range(self._pos, len(text)):
+            char = text[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = text[self._string_start:pos + 1]
+            elif self._depth == 0:
+                if char == '{':
+                    self._depth = 1
+            elif char == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif char in '{[':
+                if self._depth == 1 and char == '[' and self._last_key == '"Items"':
+                    self._in_items = True
+                elif self._in_items and self._depth == 2 and char == '{':
+                    self._item_start = pos
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._in_items and self._depth == 2 and char == '}' and self._item_start is not None:
+                    try:
+                        items.append(json.loads(text[self._item_start:pos + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self._item_start = None
+                elif self._in_items and self._depth == 1:
+                    self._in_items = False
+        self._pos = len(text)
+        return items
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def result(self) -> dict:
+        return load_response_json(self._text)
+
+
+def convert_response_object_to_pydantic_model(data: Union[dict, list]):
+    if isinstance(data, list):
+        for item in data:
+            convert_response_object_to_pydantic_model(item)
+    else:
+        for k, v in data.copy().items():
+            if isinstance(v, (dict, list)):
+                convert_response_object_to_pydantic_model(data[k])
+
+            new_k = k.replace(' ', '_').replace('(', '').replace(')', '')
+            del data[k]
+            data[new_k] = v
+    return data
+
+
+def build_invoice(response_dict: dict, **fields) -> Invoice:
+    """Build an (unsaved) Invoice from an extraction response; extra ``fields`` are set on the document."""
+    data = copy.deepcopy(response_dict)
+    if data.get('Date Issued') is None:
+        data['Date Issued'] = datetime.now().date()
+        data['Time Issued'] = datetime.now().time().isoformat()
+    with span('response.convert'):
+        data = convert_response_object_to_pydantic_model(data)
+    data.update(fields)
+    return Invoice(**data)
@@ -0,0 +1,16 @@
+"""File formats of ``invoicer export`` and ``invoicer import``.
+
+Kept free of database imports so the CLI can declare its options without loading them.
+"""
+
+FORMATS = ('jsonl', 'csv', 'parquet')
+DEFAULT_BATCH_SIZE = 1000
+
+
+def infer_format(path: str) -> str:
+    extension = path.rsplit('.', 1)[-1].lower()
+    if extension in ('jsonl', 'ndjson', 'json'):
+        return 'jsonl'
+    if extension in ('csv', 'parquet'):
+        return extension
+    raise ValueError(f"Cannot infer the file format of {path}; pass it explicitly")
@@ -0,0 +1,332 @@
+"""Streamlit forms and pages of the app: saving, adding, editing and queueing invoices."""
+import logging
+from datetime import datetime
+
+import streamlit as st
+
+from invoicer.data.base import invalidate_query_cache
+from invoicer.data.dedup import describe_duplicate, find_image_duplicates, image_fingerprint
+from invoicer.data.extraction import convert_response_object_to_pydantic_model
+from invoicer.data.model import Invoice, Item
+from invoicer.data.pagination import fetch_invoice_page, invoice_filter
+from invoicer.data.readmodel import find_invoices, get_invoice
+from invoicer.data.store import DuplicateInvoiceError, delete_invoice, save_invoice, snapshot
+from invoicer.jobs import DEFAULT_MAX_ATTEMPTS, enqueue, job_statuses
+from invoicer.metrics import span
+
+logger = logging.getLogger(__name__)
+
+
+def save_to_mongodb():
+    logger.debug("Saving the extracted invoice")
+    if st.session_state.processed_items is not None and st.session_state.response_dict is not None:
+        try:
+            with span('response.convert'):
+                data = convert_response_object_to_pydantic_model(st.session_state.response_dict)
+            data.update(st.session_state.get('image_fingerprint') or {})
+            invoice = Invoice(**data)
+            st.info(f"Invoice created!")
+            save_invoice(invoice)
+            invalidate_query_cache()
+            st.info("Invoice saved successfully!")
+            st.success("Invoice saved to MongoDB Atlas!")
+            st.session_state.processed_items = None
+            st.session_state.processed_total_price = None
+        except DuplicateInvoiceError as e:
+            st.warning(f"Not saved: {e}")
+        except Exception as e:
+            st.error(f"Failed to save to MongoDB: {str(e)}")
+    else:
+        st.warning("No processed data available. Please extract invoice data first.")
+
+
+def add_new_invoice(data=None):
+    if data is None:
+        data = {}
+    st.subheader("Add New Invoice")
+
+    if 'item_count' not in st.session_state:
+        st.session_state.item_count = 1
+
+    with st.form("new_invoice_form2"):
+        date = st.date_input("Invoice Date", datetime.now())
+        time = st.time_input("Invoice Time", datetime.now().time())
+        total_price = st.number_input("Total Price", min_value=0.0, step=0.01)
+        issuer = st.text_input("Issuer", '')
+        issuer_address = st.text_input("Issuer Address", '')
+        issuer_phone = st.text_input("Issuer Phone", '')
+
+        items = []
+        for i in range(st.session_state.item_count):
+            col1, col2, col3, col4, col5, col6 = st.columns([1, 1, 1, 1, 1.5, 1.5])
+            with col1:
+                name = st.text_input(f"Name {i + 1}", key=f"name_{i}")
+            with col2:
+                unit_price_eur = st.number_input(f"Unit Price (EUR) {i + 1}", min_value=0, step=1,
+                                                 key=f"unit_price_eur{i}")
+            with col3:
+                total_price_eur = st.number_input(
+                    f"Total Price (EUR) {i + 1}", min_value=0.0, step=0.01, key=f"total_price_eur{i}")
+            with col4:
+                quantity = st.number_input(
+                    f"Quantity {i + 1}", min_value=0, step=1, key=f"quantity{i}")
+            with col5:
+                product_name_ger = st.text_input(
+                    f"Product Name (German) {i + 1}", key=f"product_name_ger{i}")
+            with col6:
+                product_name_eng = st.text_input(
+                    f"Product Name (English) {i + 1}", key=f"product_name_eng{i}")
+
+            if name is not None and quantity > 0 and total_price_eur > 0:
+                items.append(Item(
+                    Name=name,
+                    Unit_Price_EUR=unit_price_eur,
+                    Total_Price_EUR=total_price_eur,
+                    Quantity=quantity,
+                    Product_Name_German=product_name_ger,
+                    Product_Name_English=product_name_eng,
+                ))
+
+        add_item = st.form_submit_button("Add a New Item")
+        if add_item:
+            st.session_state.item_count += 1
+            st.rerun()
+
+        submitted = st.form_submit_button("Upload Invoice")
+        if submitted:
+            new_invoice = Invoice(
+                Date_Issued=datetime.combine(date, time),
+                Time_Issued=time.isoformat(),
+                Items=items,
+                Total_Invoice_Expense_EUR=total_price,
+                Issuer=issuer,
+                Issuer_Address=issuer_address,
+                Issuer_Phone=issuer_phone
+            )
+            try:
+                save_invoice(new_invoice, source='manual')
+            except DuplicateInvoiceError as e:
+                st.warning(f"Not saved: {e}")
+                return
+            invalidate_query_cache()
+            st.success("New invoice added successfully!")
+            st.session_state.item_count = 1
+
+
+def upload_duplicates(uploaded_file, max_distance):
+    """Fingerprint of an uploaded image and the stored invoices it duplicates, computed once per upload."""
+    cache = st.session_state.setdefault('upload_fingerprints', {})
+    if uploaded_file.file_id not in cache:
+        fingerprint = image_fingerprint(uploaded_file.getvalue())
+        duplicates = find_image_duplicates(fingerprint, max_distance) if max_distance is not None else []
+        cache[uploaded_file.file_id] = (fingerprint, duplicates)
+    return cache[uploaded_file.file_id]
+
+
+def report_duplicates(name, duplicates):
+    st.warning(f"{name} looks like an invoice that is already stored:\n\n" +
+               "\n".join(f"- {describe_duplicate(row)}" for row in duplicates))
+
+
+# How often the job status panel polls the queue, in seconds.
+JOB_POLL_INTERVAL = 2
+
+
+def queue_invoices(store, jobs_config=None, max_distance=None):
+    """Upload any number of invoice images to the blob store and queue them for extraction by ``invoicer worker``.
+
+    Images that look like a stored invoice are reported instead of queued unless the user insists.
+    """
+    jobs_config = jobs_config or {}
+    st.subheader("Queue Invoices for Extraction")
+    if 'job_ids' not in st.session_state:
+        st.session_state.job_ids = []
+        st.session_state.jobs_done = 0
+
+    uploaded_files = st.file_uploader("Choose images...", type=["jpg", "jpeg", "png", "pdf"],
+                                      accept_multiple_files=True)
+    duplicated = set()
+    for uploaded_file in uploaded_files or []:
+        _, duplicates = upload_duplicates(uploaded_file, max_distance)
+        if duplicates:
+            report_duplicates(uploaded_file.name, duplicates)
+            duplicated.add(uploaded_file.file_id)
+    queue_duplicates = bool(duplicated) and st.checkbox("Queue these images anyway", False)
+
+    if st.button("Queue for extraction", disabled=not uploaded_files):
+        queued = [uploaded_file for uploaded_file in uploaded_files
+                  if queue_duplicates or uploaded_file.file_id not in duplicated]
+        for uploaded_file in queued:
+            uploaded_file.seek(0)
+            job = enqueue(store, uploaded_file, uploaded_file.name, uploaded_file.type,
+                          max_attempts=jobs_config.get('max_attempts', DEFAULT_MAX_ATTEMPTS))
+            st.session_state.job_ids.append(job.id)
+        skipped = len(uploaded_files) - len(queued)
+        st.success(f"Queued {len(queued)} images" + (f", skipped {skipped} duplicates" if skipped else "") +
+                   ". They are processed by `invoicer worker`.")
+
+    job_status_panel()
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def job_status_panel():
+    if not st.session_state.get('job_ids'):
+        st.info("No invoices queued in this session.")
+        return
+    jobs = job_statuses(st.session_state.job_ids)
+    invoice_ids = [job['Invoice_Id'] for job in jobs if job.get('Invoice_Id')]
+    invoices = {invoice.id: invoice for invoice in find_invoices({'_id': {'$in': invoice_ids}})}
+
+    done = sum(job['Status'] == 'done' for job in jobs)
+    if done != st.session_state.jobs_done:
+        # Newly extracted invoices change the reports.
+        st.session_state.jobs_done = done
+        invalidate_query_cache()
+
+    rows = []
+    for job in jobs:
+        invoice = invoices.get(job.get('Invoice_Id'))
+        rows.append({
+            'File': job.get('Filename'),
+            'Status': job['Status'],
+            'Attempts': f"{job.get('Attempts', 0)}/{job.get('Max_Attempts')}",
+            'Issuer': invoice and invoice.Issuer,
+            'Date': invoice and invoice.Date_Issued,
+            'Total (EUR)': invoice and invoice.Total_Invoice_Expense_EUR,
+            'Error': job.get('Error'),
+        })
+    pending = sum(job['Status'] in ('queued', 'running') for job in jobs)
+    duplicates = sum(job['Status'] == 'duplicate' for job in jobs)
+    st.caption(f"{done} done, {pending} pending, {duplicates} duplicates, "
+               f"{len(jobs) - done - pending - duplicates} failed")
+    st.dataframe(rows)
+
+
+def format_invoice_summary(row):
+    issued = row.get('Date_Issued')
+    parts = [f"{issued:%Y-%m-%d %H:%M}" if issued else "(no date)", row.get('Issuer') or "Unknown issuer"]
+    if row.get('Invoice_Number') is not None:
+        parts.append(f"#{row['Invoice_Number']:g}")
+    if row.get('Total_Invoice_Expense_EUR') is not None:
+        parts.append(f"Total: {row['Total_Invoice_Expense_EUR']:.2f} EUR")
+    return " - ".join(parts)
+
+
+def invoice_picker():
+    """Filterable, page-by-page invoice list; returns the summary row of the selected invoice, or None."""
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        issuer = st.text_input("Issuer", key="picker_issuer")
+    with col2:
+        start_date = st.date_input("From", value=None, key="picker_start")
+    with col3:
+        end_date = st.date_input("To", value=None, key="picker_end")
+    with col4:
+        number = st.text_input("Invoice Number", key="picker_number")
+
+    invoice_number = None
+    if number.strip():
+        try:
+            invoice_number = float(number)
+        except ValueError:
+            st.warning("The invoice number must be numeric.")
+    query = invoice_filter(issuer.strip() or None, start_date, end_date, invoice_number)
+
+    # Start again from the first page whenever the filters change.
+    if st.session_state.get('picker_query') != query:
+        st.session_state.picker_query = query
+        st.session_state.picker_cursors = [None]
+    cursors = st.session_state.picker_cursors
+    rows, next_cursor = fetch_invoice_page(query, cursors[-1])
+
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button("Previous page", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+    with col_page:
+        st.caption(f"Page {len(cursors)}")
+    with col_next:
+        if st.button("Next page", disabled=next_cursor is None):
+            cursors.append(next_cursor)
+            st.rerun()
+
+    if not rows:
+        st.info("No invoices match the filters.")
+        return None
+    return st.selectbox("Select an invoice", options=rows, format_func=format_invoice_summary)
+
+
+def edit_delete_invoice(store=None):
+    st.subheader("Edit/Delete Invoice")
+    selected_row = invoice_picker()
+    if selected_row is None:
+        return
+
+    # Load the invoice with its items only when the selection changes.
+    if st.session_state.get('picker_selected_id') != selected_row['_id']:
+        st.session_state.picker_selected = get_invoice(selected_row['_id'])
+        st.session_state.picker_selected_id = selected_row['_id']
+    selected_invoice = st.session_state.picker_selected
+    if selected_invoice is None:
+        st.warning("This invoice was deleted in the meantime.")
+        return
+
+    if store is not None and selected_invoice.Image_SHA256 and selected_invoice.Image_SHA256 in store:
+        with st.expander("Source image"):
+            st.image(store.read(selected_invoice.Image_SHA256))
+
+    with st.form("edit_invoice_form"):
+        issued = selected_invoice.Date_Issued
+        date = st.date_input("Invoice Date", issued or datetime.now())
+        total_price = st.number_input("Total Price", min_value=0.0, step=0.01,
+                                      value=float(selected_invoice.Total_Invoice_Expense_EUR or 0.0))
+
+        items = []
+        for i, item in enumerate(selected_invoice.Items):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                name = st.text_input(f"Item {i + 1} Name", value=item.Name or '', key=f"edit_name_{i}")
+            with col2:
+                quantity = st.number_input(f"Item {i + 1} Quantity", min_value=0.0, step=1.0,
+                                           value=float(item.Quantity or 0.0), key=f"edit_quantity_{i}")
+            with col3:
+                price = st.number_input(f"Item {i + 1} Price", min_value=0.0, step=0.01,
+                                        value=float(item.Total_Price_EUR or 0.0), key=f"edit_price_{i}")
+
+            if name and quantity > 0 and price > 0:
+                items.append(Item(
+                    Name=name,
+                    Unit_Price_EUR=item.Unit_Price_EUR,
+                    Total_Price_EUR=price,
+                    Quantity=quantity,
+                    Product_Name_German=item.Product_Name_German,
+                    Product_Name_English=item.Product_Name_English,
+                ))
+
+        update = st.form_submit_button("Update Invoice")
+        delete = st.form_submit_button("Delete Invoice")
+
+        if update:
+            invoice = selected_invoice.to_document()
+            previous = snapshot(invoice)
+            invoice.Date_Issued = datetime.combine(date, issued.time() if issued else datetime.min.time())
+            invoice.Items = items
+            invoice.Total_Invoice_Expense_EUR = total_price
+            try:
+                save_invoice(invoice, previous)
+            except DuplicateInvoiceError as e:
+                st.warning(f"Not updated: {e}")
+            else:
+                invalidate_query_cache()
+                # Show the saved values on the next rerun.
+                st.session_state.picker_selected_id = None
+                st.success("Invoice updated successfully!")
+
+        if delete:
+            delete_invoice(selected_invoice.to_document())
+            invalidate_query_cache()
+            st.session_state.picker_query = None
+            st.session_state.picker_selected_id = None
+            st.success("Invoice deleted successfully!")
+            st.rerun()
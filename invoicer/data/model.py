@@ -1,6 +1,6 @@
 import dateutil
-from mongoengine import (Document, StringField, FloatField, DateTimeField, ListField, EmbeddedDocument,
-                         EmbeddedDocumentField)
+from mongoengine import (Document, StringField, FloatField, IntField, DateTimeField, ListField, EmbeddedDocument,
+                         EmbeddedDocumentField, ObjectIdField)
 
 
 class Item(EmbeddedDocument):
@@ -21,3 +21,115 @@ class Invoice(Document):
     Date_Issued = DateTimeField()
     Time_Issued = StringField()
     Total_Invoice_Expense_EUR = FloatField()
+    Image_SHA256 = StringField()
+    Image_PHash = StringField()
+    Image_PHash_Bands = ListField(StringField())
+    Updated_At = DateTimeField()
+
+    meta = {
+        'indexes': [
+            ('Date_Issued', '_id'),
+            ('Issuer', 'Date_Issued'),
+            'Items.Name',
+            'Image_SHA256',
+            'Image_PHash_Bands',
+            'Updated_At',
+            # One invoice per issuer, invoice number and issue date; invoices missing any of them are exempt.
+            {'fields': ('Issuer', 'Invoice_Number', 'Date_Issued'), 'unique': True,
+             'name': 'unique_invoice_identity',
+             'partialFilterExpression': {'Issuer': {'$type': 'string'}, 'Invoice_Number': {'$type': 'number'},
+                                         'Date_Issued': {'$type': 'date'}}},
+        ],
+        # Indexes are created by db_connection.ensure_indexes() when the app or CLI connects.
+        'auto_create_index': False,
+    }
+
+
+class SpendRollup(Document):
+    """Pre-aggregated spend per (period, issuer, product), maintained by invoicer.data.rollups.
+
+    Rows with ``Product`` set to None hold invoice-level totals for the period and issuer.
+    """
+    Granularity = StringField(required=True, choices=('day', 'month'))
+    Period = StringField(required=True)
+    Issuer = StringField()
+    Product = StringField()
+    Total_EUR = FloatField(default=0.0)
+    Quantity = FloatField(default=0.0)
+    Invoice_Count = IntField(default=0)
+    Item_Count = IntField(default=0)
+
+    meta = {
+        'indexes': [
+            {'fields': ('Granularity', 'Period', 'Issuer', 'Product'), 'unique': True},
+        ],
+        'auto_create_index': False,
+    }
+
+
+class ExtractionJob(Document):
+    """A queued extraction of one uploaded image, processed by ``invoicer worker`` (see invoicer.jobs)."""
+    Status = StringField(required=True, default='queued', choices=('queued', 'running', 'done', 'duplicate', 'failed'))
+    Image_SHA256 = StringField(required=True)
+    # Image_SHA256 while the job is queued or running, unset once it finishes: at most one job per image is active.
+    Active_Digest = StringField()
+    Mime_Type = StringField()
+    Filename = StringField()
+    Attempts = IntField(default=0)
+    Max_Attempts = IntField(default=3)
+    Created_At = DateTimeField()
+    Run_After = DateTimeField()
+    Worker = StringField()
+    Lease_Expires_At = DateTimeField()
+    Finished_At = DateTimeField()
+    Error = StringField()
+    Invoice_Id = ObjectIdField()
+
+    meta = {
+        'indexes': [
+            ('Status', 'Run_After', 'Created_At'),
+            ('Status', 'Lease_Expires_At'),
+            {'fields': ('Active_Digest',), 'unique': True, 'sparse': True},
+        ],
+        'auto_create_index': False,
+    }
+
+
+class PricePoint(Document):
+    """Unit price of one item of a dated invoice, maintained by invoicer.data.prices for price-trend queries.
+
+    ``Keys`` holds the catalog keys of the item's receipt, German and English names, so a product can be
+    looked up by any of them.
+    """
+    Keys = ListField(StringField())
+    Invoice_Id = ObjectIdField(required=True)
+    Name = StringField()
+    Product_Name_English = StringField()
+    Issuer = StringField()
+    Date_Issued = DateTimeField(required=True)
+    Unit_Price_EUR = FloatField(required=True)
+
+    meta = {
+        'indexes': [
+            ('Keys', 'Date_Issued'),
+            'Invoice_Id',
+        ],
+        'auto_create_index': False,
+    }
+
+
+class Product(Document):
+    """Canonical German/English names for a receipt item name, maintained by invoicer.data.catalog."""
+    Key = StringField(required=True)
+    Name = StringField()
+    Product_Name_German = StringField()
+    Product_Name_English = StringField()
+    Source = StringField(choices=('extracted', 'manual'), default='extracted')
+    Seen_Count = IntField(default=0)
+
+    meta = {
+        'indexes': [
+            {'fields': ('Key',), 'unique': True},
+        ],
+        'auto_create_index': False,
+    }
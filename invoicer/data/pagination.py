@@ -0,0 +1,61 @@
+import re
+from datetime import date, datetime, time
+from typing import List, Optional, Tuple
+
+from invoicer.data.model import Invoice
+from invoicer.data.readmodel import SUMMARY_PROJECTION
+from invoicer.metrics import timed
+
+PAGE_SIZE = 25
+
+SORT = [('Date_Issued', -1), ('_id', -1)]
+
+PageCursor = Tuple[Optional[datetime], object]
+
+
+def invoice_filter(issuer: Optional[str] = None, start_date: Optional[date] = None,
+                   end_date: Optional[date] = None, invoice_number: Optional[float] = None) -> dict:
+    """Query for the invoice picker; ``issuer`` matches as a case-insensitive prefix."""
+    query = {}
+    if issuer:
+        query['Issuer'] = {'$regex': f"^{re.escape(issuer)}", '$options': 'i'}
+    bounds = {}
+    if start_date is not None:
+        bounds['$gte'] = datetime.combine(start_date, time.min)
+    if end_date is not None:
+        bounds['$lte'] = datetime.combine(end_date, time.max)
+    if bounds:
+        query['Date_Issued'] = bounds
+    if invoice_number is not None:
+        query['Invoice_Number'] = invoice_number
+    return query
+
+
+def _after(cursor: PageCursor) -> dict:
+    """Condition selecting the invoices that sort after ``cursor`` in SORT order (newest first, undated last)."""
+    issued, invoice_id = cursor
+    if issued is None:
+        return {'Date_Issued': None, '_id': {'$lt': invoice_id}}
+    return {'$or': [
+        {'Date_Issued': {'$lt': issued}},
+        {'Date_Issued': issued, '_id': {'$lt': invoice_id}},
+        {'Date_Issued': None},
+    ]}
+
+
+@timed('mongo.page')
+def fetch_invoice_page(query: dict, after: Optional[PageCursor] = None,
+                       page_size: int = PAGE_SIZE) -> Tuple[List[dict], Optional[PageCursor]]:
+    """Return one page of invoice summaries matching ``query`` and the cursor of the next page.
+
+    Pages are addressed by the (Date_Issued, _id) of their predecessor's last row rather than by an
+    offset, so every page costs the same index seek however deep it is. The next cursor is None on
+    the last page.
+    """
+    if after is not None:
+        query = {'$and': [query, _after(after)]} if query else _after(after)
+    rows = list(Invoice._get_collection().find(query, SUMMARY_PROJECTION).sort(SORT).limit(page_size + 1))
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, (rows[-1].get('Date_Issued'), rows[-1]['_id'])
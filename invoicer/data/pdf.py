@@ -0,0 +1,171 @@
+"""Multi-page PDF invoices.
+
+A PDF is extracted page by page: each page is rendered to an image at the resolution the model needs (not the
+print resolution of the PDF), sent to the model, and the page responses are merged into one invoice. Pages are
+rendered lazily, just ahead of a bounded pool of extraction threads, so at most ``concurrency`` rendered pages
+are held in memory however long the document is. Requires pypdfium2.
+"""
+import logging
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+from invoicer.data.preprocess import encode_image, resolve_options as resolve_preprocess_options
+from invoicer.metrics import span, timed
+
+logger = logging.getLogger(__name__)
+
+PDF_MIME = 'application/pdf'
+
+DEFAULT_OPTIONS = {
+    'concurrency': 4,
+    'max_long_edge': 2000,
+}
+
+# Pages are never rendered above this resolution, so a small receipt PDF is not blown up to poster size.
+MAX_DPI = 300
+
+TOTAL_FIELD = 'Total Invoice Expense (EUR)'
+ITEM_TOTAL_FIELD = 'Total Price (EUR)'
+
+# Item lines that repeat the running total at a page break ("Übertrag von Seite 1") instead of naming a product.
+_CARRY_OVER = re.compile(r'^\s*(übertrag|uebertrag|zwischensumme|summe|subtotal|sub-total|total|carried forward|'
+                         r'brought forward)(\s+(von|aus|from)\s+(seite|page|s\.)\s*\d+)?[\s:.,\d€-]*$', re.IGNORECASE)
+
+# pdfium is not thread-safe, and PDFs are rendered from batch, worker and app threads at once. Every pdfium
+# call holds this lock; encoding the rendered page does not.
+_PDFIUM_LOCK = threading.Lock()
+
+
+def resolve_options(options: Optional[dict] = None) -> dict:
+    """Merge the ``pdf`` section of the config over the defaults."""
+    resolved = dict(DEFAULT_OPTIONS)
+    resolved.update(options or {})
+    return resolved
+
+
+def extraction_options(pdf_options: Optional[dict] = None, preprocess_options: Optional[dict] = None) -> dict:
+    """The settings a PDF's merged extraction depends on, for its cache key (concurrency does not count)."""
+    return {'max_long_edge': resolve_options(pdf_options)['max_long_edge'],
+            'preprocess': resolve_preprocess_options(preprocess_options)}
+
+
+def is_pdf(data: Union[bytes, memoryview]) -> bool:
+    return bytes(data[:5]) == b'%PDF-'
+
+
+def _pdfium():
+    try:
+        import pypdfium2
+    except ImportError:
+        raise RuntimeError("PDF invoices require pypdfium2: pip install 'invoicer[pdf]'")
+    return pypdfium2
+
+
+def iter_pdf_pages(source: Union[str, bytes], max_long_edge: int = DEFAULT_OPTIONS['max_long_edge'],
+                   preprocess_options: Optional[dict] = None) -> Iterator[Tuple[bytes, str]]:
+    """Render the pages of a PDF file or PDF bytes one at a time; yields each page's image bytes and MIME type.
+
+    Pages are scaled so their long edge is ``max_long_edge`` pixels (at most ``MAX_DPI``) and encoded with the
+    colour mode, format and quality of ``preprocess_options``. A page is only rendered when the next one is
+    requested. Calls into pdfium are serialized across threads; consume each iterator from a single thread.
+    """
+    pdfium = _pdfium()
+    options = resolve_preprocess_options(preprocess_options)
+    with _PDFIUM_LOCK:
+        document = pdfium.PdfDocument(source)
+        page_count = len(document)
+    try:
+        for index in range(page_count):
+            with span('pdf.render', page=index):
+                with _PDFIUM_LOCK:
+                    page = document[index]
+                    try:
+                        width, height = page.get_size()
+                        scale = min(max_long_edge / max(width, height), MAX_DPI / 72)
+                        bitmap = page.render(scale=scale, grayscale=options['grayscale'])
+                    except BaseException:
+                        page.close()
+                        raise
+                try:
+                    encoded = encode_image(bitmap.to_pil(), options)
+                finally:
+                    with _PDFIUM_LOCK:
+                        bitmap.close()
+                        page.close()
+            yield encoded
+    finally:
+        with _PDFIUM_LOCK:
+            document.close()
+
+
+def _number(value) -> Optional[float]:
+    try:
+        return float(str(value).replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def _is_set(value) -> bool:
+    return value is not None and value != ''
+
+
+def merge_pages(pages: List[dict]) -> dict:
+    """Merge the extraction responses of the pages of one invoice, given in page order.
+
+    Items are concatenated, without the carry-over lines that repeat the running total at a page break. Other
+    fields keep the first value any page states. A long invoice may print a running or grand total on every
+    page, so the total is the one stated on the last page that has one, never their sum; without any stated
+    total it is the sum of the item totals.
+    """
+    merged = {'Items': []}
+    total = None
+    for page in pages:
+        for item in page.get('Items') or []:
+            if not _CARRY_OVER.match(str(item.get('Name') or '')):
+                merged['Items'].append(item)
+        for key, value in page.items():
+            if key == 'Items' or not _is_set(value):
+                continue
+            if key == TOTAL_FIELD:
+                total = value
+            elif not _is_set(merged.get(key)):
+                merged[key] = value
+    if total is None:
+        prices = [_number(item.get(ITEM_TOTAL_FIELD)) for item in merged['Items']]
+        total = round(sum(price for price in prices if price is not None), 2)
+    merged[TOTAL_FIELD] = total
+    return merged
+
+
+@timed('pdf.extract')
+def extract_pdf(source: Union[str, bytes], extract_page: Callable[[bytes, str], dict],
+                concurrency: int = DEFAULT_OPTIONS['concurrency'],
+                max_long_edge: int = DEFAULT_OPTIONS['max_long_edge'],
+                preprocess_options: Optional[dict] = None) -> dict:
+    """Extract a PDF invoice with ``extract_page(image_bytes, mime_type)`` per page; returns the merged response.
+
+    Up to ``concurrency`` pages are extracted at a time. The next page is rendered only once a slot is free, so
+    memory use does not grow with the number of pages.
+    """
+    concurrency = max(1, concurrency)
+    responses = {}
+    pending = {}
+
+    def collect(futures):
+        for future in futures:
+            responses[pending.pop(future)] = future.result()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index, (image, mime_type) in enumerate(iter_pdf_pages(source, max_long_edge, preprocess_options)):
+            if len(pending) >= concurrency:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            pending[pool.submit(extract_page, image, mime_type)] = index
+            del image
+        collect(wait(pending).done)
+
+    if not responses:
+        raise ValueError("The PDF has no pages")
+    logger.info(f"Extracted {len(responses)} PDF pages")
+    return merge_pages([responses[index] for index in sorted(responses)])
@@ -0,0 +1,123 @@
+import io
+import logging
+import mimetypes
+from typing import Optional, Tuple
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps, UnidentifiedImageError
+
+from invoicer.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'enabled': True,
+    'exif_transpose': True,
+    'crop': False,
+    'max_long_edge': 1600,
+    'grayscale': True,
+    'format': 'JPEG',
+    'quality': 70,
+}
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+# Leading bytes of JPEG and PNG files, checked before trusting a file extension (WEBP is a RIFF container).
+_SIGNATURES = ((b'\xff\xd8\xff', 'image/jpeg'), (b'\x89PNG\r\n\x1a\n', 'image/png'))
+
+# Receipt detection works on a small thumbnail. Paper pixels are brighter than average and nearly
+# unsaturated; they must cover at least _CROP_MIN_AREA of the photo for the crop to be trusted, and the
+# crop keeps _CROP_MARGIN around them.
+_CROP_PROBE_SIZE = 256
+_CROP_MAX_SATURATION = 60
+_CROP_MIN_AREA = 0.2
+_CROP_MARGIN = 0.05
+
+
+def resolve_options(options: Optional[dict] = None) -> dict:
+    """Merge the ``preprocess`` section of the config over the defaults."""
+    resolved = dict(DEFAULT_OPTIONS)
+    resolved.update(options or {})
+    resolved['format'] = resolved['format'].upper()
+    return resolved
+
+
+def receipt_bounds(image: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    """Estimate the bounding box of the receipt: bright, unsaturated paper against the background.
+
+    Returns None when no plausible receipt region is found, in which case the image is left uncropped.
+    """
+    probe = image.copy()
+    probe.thumbnail((_CROP_PROBE_SIZE, _CROP_PROBE_SIZE))
+    probe = probe.convert('RGB')
+    _, saturation, value = probe.filter(ImageFilter.MedianFilter(5)).convert('HSV').split()
+    histogram = value.histogram()
+    threshold = sum(i * count for i, count in enumerate(histogram)) / sum(histogram)
+    paper = ImageChops.darker(saturation.point(lambda v: 255 if v < _CROP_MAX_SATURATION else 0),
+                              value.point(lambda v: 255 if v > threshold else 0))
+    box = paper.getbbox()
+    if box is None:
+        return None
+
+    left, top, right, bottom = box
+    if (right - left) * (bottom - top) < _CROP_MIN_AREA * probe.width * probe.height:
+        return None
+    scale_x, scale_y = image.width / probe.width, image.height / probe.height
+    margin_x, margin_y = _CROP_MARGIN * image.width, _CROP_MARGIN * image.height
+    return (max(0, int(left * scale_x - margin_x)), max(0, int(top * scale_y - margin_y)),
+            min(image.width, int(right * scale_x + margin_x)), min(image.height, int(bottom * scale_y + margin_y)))
+
+
+def image_mime_type(data: bytes, filename: Optional[str] = None) -> str:
+    """MIME type of image bytes from their signature, else from the file extension, else JPEG."""
+    for signature, mime_type in _SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    guessed = mimetypes.guess_type(filename)[0] if filename else None
+    return guessed or 'image/jpeg'
+
+
+@timed('image.encode')
+def preprocess_image(image_bytes: bytes, mime_type: str = 'image/jpeg',
+                     options: Optional[dict] = None) -> Tuple[bytes, str]:
+    """Shrink an invoice photo before it is sent to the model.
+
+    Applies, as configured: EXIF orientation fix, crop to the receipt, downscale to ``max_long_edge``,
+    grayscale and re-encoding at ``quality``. Returns the new bytes and their MIME type; the input is
+    returned unchanged when preprocessing is disabled, the data is not a decodable image, or the
+    result would not be smaller.
+    """
+    options = resolve_options(options)
+    if not options['enabled']:
+        return image_bytes, mime_type
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.load()
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning(f"Skipping preprocessing, image could not be decoded: {e}")
+        return image_bytes, mime_type
+
+    if options['exif_transpose']:
+        image = ImageOps.exif_transpose(image)
+    if options['crop']:
+        box = receipt_bounds(image)
+        if box is not None:
+            image = image.crop(box)
+    max_long_edge = options['max_long_edge']
+    if max_long_edge and max(image.size) > max_long_edge:
+        image.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+    processed, processed_type = encode_image(image, options)
+    if len(processed) >= len(image_bytes):
+        return image_bytes, mime_type
+    return processed, processed_type
+
+
+def encode_image(image: Image.Image, options: dict) -> Tuple[bytes, str]:
+    """Encode an image in the configured colour mode, format and quality; ``options`` as from resolve_options."""
+    if options['grayscale']:
+        image = image.convert('L')
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format=options['format'], quality=options['quality'], optimize=True)
+    return buffer.getvalue(), MIME_TYPES.get(options['format'], 'image/jpeg')
@@ -0,0 +1,104 @@
+"""Price history: the unit price of every item of every dated invoice, indexed by product and date.
+
+Each item becomes a PricePoint keyed by the catalog keys of its receipt, German and English names. The points
+are rewritten whenever an invoice is saved, edited or deleted (see invoicer.data.store), so the price trend
+of a product is an index range scan over its own points instead of a scan of every invoice's items.
+"""
+import statistics
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from dateutil.relativedelta import relativedelta
+from pymongo import DeleteMany, InsertOne
+
+from invoicer.data.catalog import normalize_name
+from invoicer.data.model import Invoice, PricePoint
+from invoicer.data.readmodel import PRICE_PROJECTION, PRODUCT_NAME_FIELDS
+from invoicer.metrics import timed
+
+DEFAULT_MONTHS = 12
+_POINT_FIELDS = {'_id': 0, 'Name': 1, 'Product_Name_English': 1, 'Issuer': 1, 'Date_Issued': 1, 'Unit_Price_EUR': 1}
+
+
+def unit_price(item: dict) -> Optional[float]:
+    """The item's unit price, or its total divided by the quantity when the receipt prints no unit price."""
+    if item.get('Unit_Price_EUR'):
+        return item['Unit_Price_EUR']
+    if item.get('Total_Price_EUR') and item.get('Quantity'):
+        return round(item['Total_Price_EUR'] / item['Quantity'], 4)
+    return None
+
+
+def price_points(invoice: dict) -> List[dict]:
+    """The PricePoint documents of a raw invoice document; none for an invoice without an issue date."""
+    issued = invoice.get('Date_Issued')
+    if not isinstance(issued, datetime):
+        return []
+    points = []
+    for item in invoice.get('Items') or []:
+        price = unit_price(item)
+        keys = sorted({normalize_name(item.get(name)) for name in PRODUCT_NAME_FIELDS} - {''})
+        if price is None or not keys:
+            continue
+        points.append({'Keys': keys, 'Invoice_Id': invoice['_id'], 'Name': item.get('Name'),
+                       'Product_Name_English': item.get('Product_Name_English'), 'Issuer': invoice.get('Issuer'),
+                       'Date_Issued': issued, 'Unit_Price_EUR': price})
+    return points
+
+
+def update_price_history(old: Iterable[dict] = (), new: Iterable[dict] = ()):
+    """Replace the price points of the ``old`` invoice documents with those of the ``new`` ones.
+
+    Pass the document as it was before an edit in ``old`` and as saved in ``new``; a plain insert only has
+    ``new`` and a delete only ``old``. Edits that leave every price point unchanged write nothing.
+    """
+    old, new = list(old), list(new)
+    old_points = [point for invoice in old for point in price_points(invoice)]
+    new_points = [point for invoice in new for point in price_points(invoice)]
+    if old_points == new_points:
+        return
+    operations = []
+    if old_points:
+        operations.append(DeleteMany({'Invoice_Id': {'$in': list({invoice['_id'] for invoice in old})}}))
+    operations.extend(InsertOne(point) for point in new_points)
+    PricePoint._get_collection().bulk_write(operations, ordered=True)
+
+
+def rebuild_price_history(batch_size: int = 1000) -> int:
+    """Rewrite the price history from every stored invoice; returns the number of price points."""
+    collection = PricePoint._get_collection()
+    collection.delete_many({})
+    points = []
+    count = 0
+    for invoice in Invoice._get_collection().find({}, PRICE_PROJECTION, batch_size=batch_size):
+        points.extend(price_points(invoice))
+        if len(points) >= batch_size:
+            collection.insert_many(points, ordered=False)
+            count += len(points)
+            points = []
+    if points:
+        collection.insert_many(points, ordered=False)
+        count += len(points)
+    return count
+
+
+@timed('mongo.price_history')
+def price_history(product: str, months: int = DEFAULT_MONTHS, now: Optional[datetime] = None) -> List[dict]:
+    """Price points of ``product`` (receipt, German or English name) in the last ``months`` months, oldest first."""
+    since = (now or datetime.now()) - relativedelta(months=months)
+    query = {'Keys': normalize_name(product), 'Date_Issued': {'$gte': since}}
+    return list(PricePoint._get_collection().find(query, _POINT_FIELDS).sort('Date_Issued', 1))
+
+
+def price_summary(points: Iterable[dict]) -> List[Dict[str, object]]:
+    """Minimum, median and last unit price per store of price points sorted by date; cheapest last price first."""
+    by_issuer = defaultdict(list)
+    for point in points:
+        by_issuer[point.get('Issuer')].append(point)
+    rows = []
+    for issuer, issuer_points in by_issuer.items():
+        prices = [point['Unit_Price_EUR'] for point in issuer_points]
+        rows.append({'issuer': issuer, 'min': min(prices), 'median': round(statistics.median(prices), 4),
+                     'last': prices[-1], 'last_date': issuer_points[-1]['Date_Issued'], 'purchases': len(prices)})
+    return sorted(rows, key=lambda row: row['last'])
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+from typing import List
+
+from invoicer.data.dedup import hash_bands
+from invoicer.data.model import Invoice, PricePoint, SpendRollup
+from invoicer.data.pagination import PAGE_SIZE, SORT, invoice_filter
+from invoicer.data.reports import date_match
+from invoicer.data.rollups import rollup_filter
+
+
+def standard_queries() -> dict:
+    """The queries the app and CLI issue routinely, as ``name -> (kind, spec)`` for explain().
+
+    Queries run against the Invoice collection unless the spec names another ``document`` class.
+    """
+    end = datetime.now()
+    start = end - timedelta(days=365)
+    date_range = {'Date_Issued': {'$gte': start, '$lte': end}}
+    return {
+        'date range': ('find', {'filter': date_range}),
+        'invoice picker page': ('find', {'filter': invoice_filter(), 'sort': SORT, 'limit': PAGE_SIZE + 1}),
+        'invoice picker by date': ('find', {'filter': invoice_filter(start_date=start.date(), end_date=end.date()),
+                                            'sort': SORT, 'limit': PAGE_SIZE + 1}),
+        'issuer in date range': ('find', {'filter': {'Issuer': 'EDEKA', **date_range}}),
+        'item name': ('find', {'filter': {'Items.Name': 'Milch'}}),
+        'image hash': ('find', {'filter': {'Image_SHA256': {'$in': ['0' * 64]}}}),
+        'similar image': ('find', {'filter': {'Image_PHash_Bands': {'$in': hash_bands('0' * 16)}}}),
+        'invoice identity': ('find', {'filter': {'Issuer': 'EDEKA', 'Invoice_Number': 3793.0, 'Date_Issued': end}}),
+        'analytics sync': ('find', {'filter': {'Updated_At': {'$gte': end}}}),
+        'price history': ('find', {'document': PricePoint, 'filter': {'Keys': 'milch', 'Date_Issued': {'$gte': start}},
+                                   'sort': [('Date_Issued', 1)]}),
+        'monthly report': ('find', {'document': SpendRollup,
+                                    'filter': rollup_filter(start.date(), end.date(), daily=False)}),
+        'daily report': ('find', {'document': SpendRollup,
+                                  'filter': rollup_filter(start.date(), end.date(), daily=True)}),
+        'report from invoices': ('aggregate', {'pipeline': [date_match(start, end),
+                                                            {'$group': {'_id': None, 'n': {'$sum': 1}}}]}),
+    }
+
+
+def winning_plan_stages(explain: dict) -> List[str]:
+    """Collect the stage names of every winning plan found anywhere in an explain() result."""
+    stages = []
+
+    def walk(node, in_winning_plan):
+        if isinstance(node, dict):
+            if in_winning_plan and isinstance(node.get('stage'), str):
+                stages.append(node['stage'])
+            for key, value in node.items():
+                walk(value, in_winning_plan or key == 'winningPlan')
+        elif isinstance(node, list):
+            for value in node:
+                walk(value, in_winning_plan)
+
+    walk(explain, False)
+    return stages
+
+
+def explain_query(kind: str, spec: dict) -> dict:
+    collection = spec.get('document', Invoice)._get_collection()
+    if kind == 'aggregate':
+        return collection.database.command('explain', {'aggregate': collection.name,
+                                                       'pipeline': spec['pipeline'],
+                                                       'cursor': {}},
+                                           verbosity='queryPlanner')
+    cursor = collection.find(spec['filter'])
+    if 'sort' in spec:
+        cursor = cursor.sort(spec['sort'])
+    if 'limit' in spec:
+        cursor = cursor.limit(spec['limit'])
+    return cursor.explain()
+
+
+def check_query_plans() -> List[dict]:
+    """Explain every standard query; each result records its plan stages and whether it scans the collection."""
+    results = []
+    for name, (kind, spec) in standard_queries().items():
+        stages = winning_plan_stages(explain_query(kind, spec))
+        results.append({'name': name, 'stages': stages, 'collscan': 'COLLSCAN' in stages})
+    return results
@@ -0,0 +1,129 @@
+"""Read-only access to invoices for lists, reports and forms.
+
+Read paths query the raw collection with a field projection and map the documents to small ``__slots__``
+records (or to item columns) instead of loading mongoengine documents, which convert and validate every
+field and track changes to every embedded item. The field names here are derived from the model, and the
+invoice read paths (lists, forms, analytics and the rebuilds of rollups, price history and catalog) take their
+projections from this module rather than spelling them out.
+"""
+import math
+from array import array
+from typing import Dict, Iterable, Iterator, Optional, Union
+
+from mongoengine import FloatField
+
+from invoicer.data.model import Invoice, Item
+
+ITEM_FIELDS = tuple(Item._fields_ordered)
+INVOICE_FIELDS = tuple(name for name in Invoice._fields_ordered if name not in ('id', 'Items'))
+# Fingerprints of the source image; only duplicate detection needs them.
+HASH_FIELDS = ('Image_PHash', 'Image_PHash_Bands')
+SUMMARY_FIELDS = ('Issuer', 'Invoice_Number', 'Date_Issued', 'Total_Invoice_Expense_EUR')
+DETAIL_FIELDS = tuple(name for name in INVOICE_FIELDS if name not in HASH_FIELDS) + ('Items',)
+# Item fields stored as floats, returned as ``array('d')`` columns by item_columns.
+NUMERIC_ITEM_FIELDS = tuple(name for name in ITEM_FIELDS if isinstance(Item._fields[name], FloatField))
+# The receipt name of an item and its German and English product names.
+PRODUCT_NAME_FIELDS = ('Name', 'Product_Name_German', 'Product_Name_English')
+# The analytics snapshot also tracks when each invoice last changed.
+ANALYTICS_FIELDS = SUMMARY_FIELDS + ('Updated_At',)
+
+
+def projection(fields: Iterable[str] = (), item_fields: Optional[Iterable[str]] = None) -> Dict[str, int]:
+    """MongoDB projection of ``fields``; ``item_fields`` loads only those fields of the embedded items."""
+    selected = dict.fromkeys(fields, 1)
+    if item_fields is not None:
+        selected.pop('Items', None)
+        selected.update((f"Items.{name}", 1) for name in item_fields)
+    return selected
+
+
+SUMMARY_PROJECTION = projection(SUMMARY_FIELDS)
+ANALYTICS_PROJECTION = projection(ANALYTICS_FIELDS, ITEM_FIELDS)
+# What the derived collections are rebuilt from; see invoicer.data.rollups, prices and catalog.
+ROLLUP_PROJECTION = projection(('Date_Issued', 'Issuer', 'Total_Invoice_Expense_EUR'),
+                               ('Name', 'Total_Price_EUR', 'Quantity'))
+PRICE_PROJECTION = projection(('Issuer', 'Date_Issued'),
+                              PRODUCT_NAME_FIELDS + ('Unit_Price_EUR', 'Total_Price_EUR', 'Quantity'))
+CATALOG_PROJECTION = projection(item_fields=PRODUCT_NAME_FIELDS)
+
+
+class ItemRecord:
+    """An invoice item as stored; fields left out of the projection are None."""
+    __slots__ = ITEM_FIELDS
+
+    def __init__(self, document: dict):
+        for name in ITEM_FIELDS:
+            setattr(self, name, document.get(name))
+
+    def to_mongo(self) -> dict:
+        return {name: getattr(self, name) for name in ITEM_FIELDS if getattr(self, name) is not None}
+
+
+class InvoiceRecord:
+    """An invoice as stored, with its items as ItemRecords; fields left out of the projection are None."""
+    __slots__ = ('id',) + INVOICE_FIELDS + ('Items',)
+
+    def __init__(self, document: dict):
+        self.id = document.get('_id')
+        for name in INVOICE_FIELDS:
+            setattr(self, name, document.get(name))
+        self.Items = [ItemRecord(item) for item in document.get('Items') or ()]
+
+    def to_mongo(self) -> dict:
+        """The raw document of the loaded fields."""
+        document = {'_id': self.id}
+        document.update((name, getattr(self, name)) for name in INVOICE_FIELDS if getattr(self, name) is not None)
+        document['Items'] = [item.to_mongo() for item in self.Items]
+        return document
+
+    def to_document(self) -> Invoice:
+        """An Invoice to edit or delete, built without another query.
+
+        Saving it writes only the fields changed since, so fields left out of the projection are kept.
+        """
+        return Invoice._from_son(self.to_mongo())
+
+
+def find_invoices(query: Optional[dict] = None, fields: Iterable[str] = SUMMARY_FIELDS,
+                  item_fields: Optional[Iterable[str]] = None, sort: Optional[list] = None, limit: int = 0,
+                  batch_size: int = 1000) -> Iterator[InvoiceRecord]:
+    """Records of the invoices matching ``query``, loading only ``fields`` (and ``item_fields`` of the items)."""
+    cursor = Invoice._get_collection().find(query or {}, projection(fields, item_fields), batch_size=batch_size)
+    if sort:
+        cursor = cursor.sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    return (InvoiceRecord(document) for document in cursor)
+
+
+def get_invoice(invoice_id) -> Optional[InvoiceRecord]:
+    """The invoice with its items, without the image hashes; None if it does not exist."""
+    document = Invoice._get_collection().find_one({'_id': invoice_id}, projection(DETAIL_FIELDS))
+    return None if document is None else InvoiceRecord(document)
+
+
+def item_columns(documents: Iterable[dict],
+                 fields: Iterable[str] = ITEM_FIELDS) -> Dict[str, Union[array, list]]:
+    """The items of raw invoice documents as columns, with the ``invoice_id`` of each item.
+
+    Numeric fields are ``array('d')`` columns with NaN for missing values; the others are lists.
+    """
+    fields = tuple(fields)
+    columns = {'invoice_id': []}
+    columns.update((name, array('d') if name in NUMERIC_ITEM_FIELDS else []) for name in fields)
+    for document in documents:
+        invoice_id = document.get('_id')
+        for item in document.get('Items') or ():
+            columns['invoice_id'].append(invoice_id)
+            for name in fields:
+                value = item.get(name)
+                columns[name].append(math.nan if value is None and name in NUMERIC_ITEM_FIELDS else value)
+    return columns
+
+
+def find_item_columns(query: Optional[dict] = None, fields: Iterable[str] = ITEM_FIELDS,
+                      batch_size: int = 1000) -> Dict[str, Union[array, list]]:
+    """Columns of the items of the invoices matching ``query``, loading only ``fields`` of the items."""
+    fields = tuple(fields)
+    cursor = Invoice._get_collection().find(query or {}, projection(item_fields=fields), batch_size=batch_size)
+    return item_columns(cursor, fields)
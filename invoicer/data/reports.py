@@ -0,0 +1,87 @@
+from datetime import date, datetime, time
+from typing import Optional, Union
+
+from invoicer.metrics import timed
+
+DateLike = Union[date, datetime, None]
+
+GROUPINGS = ('product', 'issuer', 'day', 'week', 'month')
+
+_DATE_FORMATS = {
+    'day': '%Y-%m-%d',
+    'week': '%G-W%V',
+    'month': '%Y-%m',
+}
+
+
+def _as_datetime(value: DateLike, end_of_day: bool = False) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.combine(value, time.max if end_of_day else time.min)
+
+
+def date_match(start_date: DateLike = None, end_date: DateLike = None) -> dict:
+    """``$match`` stage restricting invoices to ``Date_Issued`` in [start_date, end_date], both inclusive."""
+    bounds = {}
+    if start_date is not None:
+        bounds['$gte'] = _as_datetime(start_date)
+    if end_date is not None:
+        bounds['$lte'] = _as_datetime(end_date, end_of_day=True)
+    return {'$match': {'Date_Issued': bounds} if bounds else {}}
+
+
+def _group_stages(grouping: str) -> list:
+    if grouping == 'product':
+        return [
+            {'$unwind': '$Items'},
+            {'$group': {'_id': '$Items.Name',
+                        'total': {'$sum': '$Items.Total_Price_EUR'},
+                        'quantity': {'$sum': '$Items.Quantity'}}},
+            {'$sort': {'total': -1}},
+        ]
+    if grouping == 'issuer':
+        return [
+            {'$group': {'_id': '$Issuer',
+                        'total': {'$sum': '$Total_Invoice_Expense_EUR'},
+                        'invoices': {'$sum': 1}}},
+            {'$sort': {'total': -1}},
+        ]
+    return [
+        {'$match': {'Date_Issued': {'$type': 'date'}}},
+        {'$group': {'_id': {'$dateToString': {'format': _DATE_FORMATS[grouping], 'date': '$Date_Issued'}},
+                    'total': {'$sum': '$Total_Invoice_Expense_EUR'},
+                    'invoices': {'$sum': 1}}},
+        {'$sort': {'_id': 1}},
+    ]
+
+
+@timed('mongo.report')
+def expenditure_report(start_date: DateLike = None, end_date: DateLike = None, groupings=GROUPINGS) -> dict:
+    """Compute expenditure totals for a date range with a single aggregation round trip over the invoices.
+
+    Reports normally read the spend rollups (``rollups.rollup_report``); this is the fallback behind
+    ``invoicer generate-report --from-invoices``, independent of the rollups being up to date.
+
+    Returns ``{'total': float, 'invoices': int, <grouping>: [{'key', 'total', ...}, ...]}`` for each
+    requested grouping in ``GROUPINGS``; product groups also carry the summed ``quantity``.
+    """
+    # Imported here so the CLI can read GROUPINGS without loading the database layer.
+    from invoicer.data.model import Invoice
+
+    facets = {'summary': [{'$group': {'_id': None,
+                                      'total': {'$sum': '$Total_Invoice_Expense_EUR'},
+                                      'invoices': {'$sum': 1}}}]}
+    for grouping in groupings:
+        facets[grouping] = _group_stages(grouping)
+
+    pipeline = [date_match(start_date, end_date), {'$facet': facets}]
+    result = next(Invoice._get_collection().aggregate(pipeline))
+
+    summary = result.pop('summary')
+    report = {
+        'total': summary[0]['total'] if summary else 0.0,
+        'invoices': summary[0]['invoices'] if summary else 0,
+    }
+    for grouping, rows in result.items():
+        report[grouping] = [{'key': row.pop('_id'), **row} for row in rows]
+    return report
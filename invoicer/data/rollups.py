@@ -0,0 +1,195 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from pymongo import DeleteOne, UpdateOne
+
+from invoicer.data.model import Invoice, SpendRollup
+from invoicer.data.readmodel import ROLLUP_PROJECTION
+from invoicer.data.reports import GROUPINGS
+from invoicer.metrics import timed
+
+RollupKey = Tuple[str, str, Optional[str], Optional[str]]
+
+UNNAMED_PRODUCT = '(unnamed)'
+COUNTERS = ('Total_EUR', 'Quantity', 'Invoice_Count', 'Item_Count')
+_KEY_FIELDS = ('Granularity', 'Period', 'Issuer', 'Product')
+_TOLERANCE = 1e-6
+
+
+def _periods(issued: datetime) -> Dict[str, str]:
+    return {'day': issued.strftime('%Y-%m-%d'), 'month': issued.strftime('%Y-%m')}
+
+
+def _key_filter(key: RollupKey) -> dict:
+    return dict(zip(_KEY_FIELDS, key))
+
+
+def rollup_contributions(invoice: dict, sign: int = 1) -> Dict[RollupKey, dict]:
+    """Amounts a raw invoice document (e.g. ``Invoice.to_mongo()``) adds to each rollup row.
+
+    Every invoice adds its total to an invoice-level row (``Product`` None) and each item's total
+    and quantity to a product row, at both day and month granularity. ``sign=-1`` gives the amounts
+    to subtract when the invoice is changed or removed.
+    """
+    issued = invoice.get('Date_Issued')
+    if not isinstance(issued, datetime):
+        return {}
+    issuer = invoice.get('Issuer')
+    contributions = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for granularity, period in _periods(issued).items():
+        row = contributions[(granularity, period, issuer, None)]
+        row['Total_EUR'] += sign * (invoice.get('Total_Invoice_Expense_EUR') or 0.0)
+        row['Invoice_Count'] += sign
+        for item in invoice.get('Items') or []:
+            row = contributions[(granularity, period, issuer, item.get('Name') or UNNAMED_PRODUCT)]
+            row['Total_EUR'] += sign * (item.get('Total_Price_EUR') or 0.0)
+            row['Quantity'] += sign * (item.get('Quantity') or 0.0)
+            row['Item_Count'] += sign
+    return contributions
+
+
+def _merge(target: dict, contributions: Dict[RollupKey, dict]):
+    for key, counters in contributions.items():
+        row = target.setdefault(key, dict.fromkeys(COUNTERS, 0))
+        for name, value in counters.items():
+            row[name] += value
+
+
+def update_rollups(old: Iterable[dict] = (), new: Iterable[dict] = ()):
+    """Move the rollups from the ``old`` invoice documents to the ``new`` ones with a single bulk write.
+
+    Pass the document as it was before an edit in ``old`` and as saved in ``new``; a plain insert
+    only has ``new`` and a delete only ``old``.
+    """
+    delta = {}
+    for invoice in old:
+        _merge(delta, rollup_contributions(invoice, sign=-1))
+    for invoice in new:
+        _merge(delta, rollup_contributions(invoice))
+    delta = {key: counters for key, counters in delta.items() if any(counters.values())}
+    if not delta:
+        return
+
+    collection = SpendRollup._get_collection()
+    collection.bulk_write([UpdateOne(_key_filter(key), {'$inc': counters}, upsert=True)
+                           for key, counters in delta.items()], ordered=False)
+    collection.delete_many({'$or': [_key_filter(key) for key in delta],
+                            'Invoice_Count': {'$lte': 0}, 'Item_Count': {'$lte': 0}})
+
+
+def rebuild_rollups(apply: bool = True) -> Dict[str, int]:
+    """Recompute every rollup row from the invoices and repair the rows that disagree.
+
+    With ``apply=False`` the collection is only checked. Returns the number of rows that are
+    ``missing``, ``stale`` (wrong amounts) and ``orphaned`` (no longer backed by any invoice).
+    """
+    expected = {}
+    for invoice in Invoice._get_collection().find({}, ROLLUP_PROJECTION, batch_size=1000):
+        _merge(expected, rollup_contributions(invoice))
+
+    collection = SpendRollup._get_collection()
+    existing = {tuple(row.get(field) for field in _KEY_FIELDS): row for row in collection.find({})}
+
+    operations = []
+    counts = {'missing': 0, 'stale': 0, 'orphaned': 0}
+    for key, counters in expected.items():
+        row = existing.pop(key, None)
+        if row is not None and all(abs((row.get(name) or 0) - counters[name]) <= _TOLERANCE for name in COUNTERS):
+            continue
+        counts['missing' if row is None else 'stale'] += 1
+        operations.append(UpdateOne(_key_filter(key), {'$set': counters}, upsert=True))
+    for row in existing.values():
+        counts['orphaned'] += 1
+        operations.append(DeleteOne({'_id': row['_id']}))
+
+    if apply and operations:
+        collection.bulk_write(operations, ordered=False)
+    return counts
+
+
+def _as_date(value: Union[date, datetime, None]) -> Optional[date]:
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _between(granularity: str, first: Optional[str], last: Optional[str]) -> dict:
+    bounds = {}
+    if first is not None:
+        bounds['$gte'] = first
+    if last is not None:
+        bounds['$lte'] = last
+    return {'Granularity': granularity, 'Period': bounds} if bounds else {'Granularity': granularity}
+
+
+def rollup_filter(start: Optional[date], end: Optional[date], daily: bool) -> dict:
+    """Select the fewest rollup rows covering [start, end]: month rows for whole months, day rows for the rest."""
+    def day(value):
+        return value.isoformat() if value is not None else None
+
+    if daily:
+        return _between('day', day(start), day(end))
+
+    first_full = start
+    if start is not None and start.day != 1:
+        first_full = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    after_last_full = end + timedelta(days=1) if end is not None else None
+    if after_last_full is not None and after_last_full.day != 1:
+        after_last_full = after_last_full.replace(day=1)
+    if first_full is not None and after_last_full is not None and first_full >= after_last_full:
+        return _between('day', day(start), day(end))
+
+    ranges = [_between('month', first_full and first_full.strftime('%Y-%m'),
+                       after_last_full and (after_last_full - timedelta(days=1)).strftime('%Y-%m'))]
+    if start is not None and start < first_full:
+        ranges.append(_between('day', day(start), day(first_full - timedelta(days=1))))
+    if end is not None and after_last_full <= end:
+        ranges.append(_between('day', day(after_last_full), day(end)))
+    return {'$or': ranges}
+
+
+def _period_key(period: str, grouping: str) -> str:
+    if grouping == 'month':
+        return period[:7]
+    if grouping == 'week':
+        year, week, _ = date.fromisoformat(period).isocalendar()
+        return f"{year}-W{week:02d}"
+    return period
+
+
+@timed('mongo.report')
+def rollup_report(start_date=None, end_date=None, groupings=GROUPINGS) -> dict:
+    """Same result as ``reports.expenditure_report``, computed from the rollup rows instead of the invoices."""
+    daily = 'day' in groupings or 'week' in groupings
+    cursor = SpendRollup._get_collection().find(rollup_filter(_as_date(start_date), _as_date(end_date), daily),
+                                                {'_id': 0})
+
+    report = {'total': 0.0, 'invoices': 0}
+    groups = {grouping: defaultdict(lambda: defaultdict(float)) for grouping in groupings}
+    for row in cursor:
+        if row.get('Product') is not None:
+            if 'product' in groups:
+                group = groups['product'][row['Product']]
+                group['total'] += row['Total_EUR']
+                group['quantity'] += row['Quantity']
+            continue
+
+        report['total'] += row['Total_EUR']
+        report['invoices'] += row['Invoice_Count']
+        for grouping, group in groups.items():
+            if grouping == 'product':
+                continue
+            key = row.get('Issuer') if grouping == 'issuer' else _period_key(row['Period'], grouping)
+            group[key]['total'] += row['Total_EUR']
+            group[key]['invoices'] += row['Invoice_Count']
+
+    for grouping, group in groups.items():
+        rows = [{'key': key, **values} for key, values in group.items()]
+        for row in rows:
+            if 'invoices' in row:
+                row['invoices'] = int(row['invoices'])
+        if grouping in ('product', 'issuer'):
+            rows.sort(key=lambda row: row['total'], reverse=True)
+        else:
+            rows.sort(key=lambda row: row['key'])
+        report[grouping] = rows
+    return report
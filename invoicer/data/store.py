@@ -0,0 +1,91 @@
+"""Write paths for invoices.
+
+Every change to the Invoice collection goes through these functions so the derived collections
+(spend rollups, product catalog, price history) stay in step with the invoices.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from mongoengine import NotUniqueError
+from pymongo.errors import BulkWriteError
+
+from invoicer.data.catalog import learn_products
+from invoicer.data.dedup import describe_duplicate, find_invoice_duplicate
+from invoicer.data.model import Invoice
+from invoicer.data.prices import update_price_history
+from invoicer.data.rollups import update_rollups
+from invoicer.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+
+def _now() -> datetime:
+    # Naive UTC, as MongoDB returns it; the analytics snapshot syncs invoices changed after its last sync.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def snapshot(invoice: Invoice) -> dict:
+    """The invoice's current field values as a raw document, to pass as ``previous`` before editing it."""
+    return invoice.to_mongo().to_dict()
+
+
+class DuplicateInvoiceError(Exception):
+    """Raised when an invoice with the same issuer, invoice number and issue date is already stored."""
+
+    def __init__(self, existing: dict):
+        self.existing = existing
+        super().__init__(f"This invoice is already stored: {describe_duplicate(existing)}")
+
+
+@timed('mongo.save')
+def save_invoice(invoice: Invoice, previous: Optional[dict] = None, source: str = 'extracted') -> Invoice:
+    """Save a new or edited invoice; ``previous`` is the ``snapshot()`` taken before an edit.
+
+    ``source`` is 'manual' for invoices typed in by the user, whose product names override the catalog.
+    Raises DuplicateInvoiceError instead of saving a second copy of a stored invoice.
+    """
+    existing = find_invoice_duplicate(invoice)
+    if existing is not None:
+        raise DuplicateInvoiceError(existing)
+    invoice.Updated_At = _now()
+    try:
+        invoice.save()
+    except NotUniqueError:
+        # Saved concurrently by someone else between the check and the write.
+        raise DuplicateInvoiceError(find_invoice_duplicate(invoice) or {})
+    document = snapshot(invoice)
+    update_rollups(old=[previous] if previous else [], new=[document])
+    update_price_history(old=[previous] if previous else [], new=[document])
+    learn_products(document.get('Items', []), source)
+    return invoice
+
+
+@timed('mongo.delete')
+def delete_invoice(invoice: Invoice):
+    previous = snapshot(invoice)
+    invoice.delete()
+    update_rollups(old=[previous])
+    update_price_history(old=[previous])
+
+
+@timed('mongo.insert_many')
+def insert_invoices(invoices: List[Invoice]) -> int:
+    """Write validated ``invoices`` with one unordered ``insert_many``; returns the number inserted."""
+    if not invoices:
+        return 0
+    now = _now()
+    documents = [dict(invoice.to_mongo().to_dict(), Updated_At=now) for invoice in invoices]
+    failed = set()
+    try:
+        Invoice._get_collection().insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        logger.error(f"Batch insert: {len(errors)} of {len(documents)} invoices rejected, e.g. "
+                     f"{[error.get('errmsg') for error in errors[:3]]}")
+        failed = {error['index'] for error in errors}
+    inserted = [document for index, document in enumerate(documents) if index not in failed]
+    update_rollups(new=inserted)
+    update_price_history(new=inserted)
+    learn_products(item for document in inserted for item in document.get('Items', []))
+    return len(inserted)
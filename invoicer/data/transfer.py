@@ -0,0 +1,242 @@
+"""Streaming bulk export and import of invoices.
+
+JSONL files hold one nested invoice per line. CSV and Parquet files are flattened to one row per item
+(invoices without items get a single row with empty item columns); rows of the same invoice share an
+``invoice_id`` and must be contiguous, as written by the exporter. Memory use is bounded by
+``batch_size`` in both directions.
+"""
+import csv
+import itertools
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from mongoengine import DateTimeField, FloatField, IntField, ValidationError
+
+from invoicer.data.dedup import hash_bands
+from invoicer.data.formats import DEFAULT_BATCH_SIZE
+from invoicer.data.model import Invoice, Item
+from invoicer.data.readmodel import INVOICE_FIELDS, ITEM_FIELDS
+from invoicer.data.store import insert_invoices
+
+logger = logging.getLogger(__name__)
+
+# The perceptual hash bands are derived from Image_PHash and rebuilt on import.
+INVOICE_COLUMNS = [name for name in INVOICE_FIELDS if name != 'Image_PHash_Bands']
+ITEM_COLUMNS = list(ITEM_FIELDS)
+ID_COLUMN = 'invoice_id'
+ITEM_PREFIX = 'Item_'
+FLAT_COLUMNS = [ID_COLUMN] + INVOICE_COLUMNS + [ITEM_PREFIX + name for name in ITEM_COLUMNS]
+
+
+# Export
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def iter_invoice_documents(query: Optional[dict] = None, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[dict]:
+    """Raw invoice documents from a server-side cursor fetching ``batch_size`` documents per round trip."""
+    return Invoice._get_collection().find(query or {}, batch_size=batch_size).sort('_id', 1)
+
+
+def flatten_invoice(document: dict) -> List[dict]:
+    """The item-level rows of one raw invoice document, keyed by FLAT_COLUMNS."""
+    invoice = {ID_COLUMN: str(document['_id'])}
+    invoice.update({name: document.get(name) for name in INVOICE_COLUMNS})
+    items = document.get('Items') or [{}]
+    return [dict(invoice, **{ITEM_PREFIX + name: item.get(name) for name in ITEM_COLUMNS}) for item in items]
+
+
+def _write_jsonl(documents: Iterable[dict], path: str, batch_size: int) -> int:
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for document in documents:
+            f.write(json.dumps(document, default=_json_default, ensure_ascii=False))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def _write_csv(documents: Iterable[dict], path: str, batch_size: int) -> int:
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FLAT_COLUMNS)
+        writer.writeheader()
+        for document in documents:
+            for row in flatten_invoice(document):
+                writer.writerow({key: _json_default(value) if isinstance(value, datetime) else value
+                                 for key, value in row.items()})
+            count += 1
+    return count
+
+
+def _parquet_schema():
+    import pyarrow as pa
+
+    types = {}
+    for name in INVOICE_COLUMNS:
+        types[name] = Invoice._fields[name]
+    for name in ITEM_COLUMNS:
+        types[ITEM_PREFIX + name] = Item._fields[name]
+
+    def arrow_type(field):
+        if isinstance(field, FloatField):
+            return pa.float64()
+        if isinstance(field, IntField):
+            return pa.int64()
+        if isinstance(field, DateTimeField):
+            return pa.timestamp('ms')
+        return pa.string()
+
+    return pa.schema([(ID_COLUMN, pa.string())] + [(name, arrow_type(field)) for name, field in types.items()])
+
+
+def _write_parquet(documents: Iterable[dict], path: str, batch_size: int) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow: pip install 'invoicer[analytics]'")
+
+    schema = _parquet_schema()
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        iterator = iter(documents)
+        while True:
+            batch = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                break
+            rows = [row for document in batch for row in flatten_invoice(document)]
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            count += len(batch)
+    return count
+
+
+_WRITERS = {'jsonl': _write_jsonl, 'csv': _write_csv, 'parquet': _write_parquet}
+
+
+def export_invoices(path: str, file_format: str, query: Optional[dict] = None,
+                    batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, float]:
+    """Stream the invoices matching ``query`` into ``path``; returns the count and throughput."""
+    started = time.monotonic()
+    count = _WRITERS[file_format](iter_invoice_documents(query, batch_size), path, batch_size)
+    elapsed = time.monotonic() - started
+    return {'invoices': count, 'elapsed_s': elapsed, 'invoices_per_s': count / elapsed if elapsed else 0.0}
+
+
+# Import
+
+def _coerce(field, value):
+    """Convert a value read from a file into the Python type ``field`` stores; blanks become None."""
+    if value is None or value == '' or value != value:  # value != value catches NaN
+        return None
+    if isinstance(field, FloatField):
+        return float(value)
+    if isinstance(field, IntField):
+        return int(value)
+    if isinstance(field, DateTimeField):
+        return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    return str(value)
+
+
+def _build_item(values: dict) -> Item:
+    return Item(**{name: _coerce(Item._fields[name], values.get(name)) for name in ITEM_COLUMNS})
+
+
+def _build_invoice(invoice_id, values: dict, items: List[dict], keep_ids: bool) -> Invoice:
+    invoice = Invoice(**{name: _coerce(Invoice._fields[name], values.get(name)) for name in INVOICE_COLUMNS})
+    invoice.Items = [_build_item(item) for item in items]
+    if invoice.Image_PHash:
+        invoice.Image_PHash_Bands = hash_bands(invoice.Image_PHash)
+    if keep_ids and invoice_id:
+        invoice.id = ObjectId(str(invoice_id))
+    return invoice
+
+
+def _read_jsonl(path: str, batch_size: int) -> Iterator[Tuple[int, int, dict, List[dict]]]:
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                document = json.loads(line)
+                yield line_number, 1, document, document.get('Items') or []
+
+
+def _group_flat_rows(rows: Iterable[Tuple[int, dict]]) -> Iterator[Tuple[int, int, dict, List[dict]]]:
+    """Reassemble contiguous item-level rows into (first row number, row count, invoice values, item values)."""
+    for _, group in itertools.groupby(rows, key=lambda numbered: numbered[1].get(ID_COLUMN)):
+        group = list(group)
+        first_number, first = group[0]
+        values = dict(first, _id=first.get(ID_COLUMN))
+        items = [{name: row.get(ITEM_PREFIX + name) for name in ITEM_COLUMNS} for _, row in group]
+        items = [item for item in items if any(value not in (None, '') for value in item.values())]
+        yield first_number, len(group), values, items
+
+
+def _read_csv(path: str, batch_size: int) -> Iterator[Tuple[int, int, dict, List[dict]]]:
+    with open(path, encoding='utf-8', newline='') as f:
+        yield from _group_flat_rows(enumerate(csv.DictReader(f), 2))
+
+
+def _read_parquet(path: str, batch_size: int) -> Iterator[Tuple[int, int, dict, List[dict]]]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet import requires pyarrow: pip install 'invoicer[analytics]'")
+
+    def rows():
+        number = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            for row in batch.to_pylist():
+                number += 1
+                yield number, row
+
+    yield from _group_flat_rows(rows())
+
+
+_READERS = {'jsonl': _read_jsonl, 'csv': _read_csv, 'parquet': _read_parquet}
+
+
+def import_invoices(path: str, file_format: str, batch_size: int = DEFAULT_BATCH_SIZE, keep_ids: bool = True,
+                    echo: Callable[[str], None] = logger.info) -> Dict[str, float]:
+    """Validate the invoices in ``path`` and insert them with batched unordered ``insert_many`` calls.
+
+    Invalid records are reported through ``echo`` and skipped; records whose ``_id`` already exists
+    are rejected by the database and counted as failed. Returns counts and throughput.
+    """
+    started = time.monotonic()
+    counts = {'rows': 0, 'invoices': 0, 'inserted': 0, 'invalid': 0, 'failed': 0}
+    buffer = []
+
+    def flush():
+        inserted = insert_invoices(buffer)
+        counts['inserted'] += inserted
+        counts['failed'] += len(buffer) - inserted
+        buffer.clear()
+
+    for row_number, row_count, values, items in _READERS[file_format](path, batch_size):
+        counts['rows'] += row_count
+        counts['invoices'] += 1
+        try:
+            invoice = _build_invoice(values.get('_id'), values, items, keep_ids)
+            invoice.validate()
+        except (ValidationError, InvalidId, ValueError, TypeError) as e:
+            counts['invalid'] += 1
+            echo(f"Row {row_number}: invalid invoice: {e}")
+            continue
+        buffer.append(invoice)
+        if len(buffer) >= batch_size:
+            flush()
+    flush()
+
+    elapsed = time.monotonic() - started
+    counts.update(elapsed_s=elapsed, rows_per_s=counts['rows'] / elapsed if elapsed else 0.0)
+    return counts
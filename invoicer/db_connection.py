@@ -1,6 +1,13 @@
+import logging
+
 from mongoengine import connect
+from pymongo.errors import OperationFailure
 import yaml
 
+from invoicer.data.model import ExtractionJob, Invoice, PricePoint, Product, SpendRollup
+
+logger = logging.getLogger(__name__)
+
 
 def get_mongo_uri(config_filepath: str):
     with open(config_filepath, "r") as file:
@@ -11,3 +18,18 @@ def get_mongo_uri(config_filepath: str):
 def connect_to_db(config_filepath: str):
     uri, db_name = get_mongo_uri(config_filepath)
     connect(db=db_name, host=uri)
+    ensure_indexes()
+
+
+def ensure_indexes():
+    """Create the declared indexes of every collection; a no-op for indexes that already exist."""
+    try:
+        Invoice.ensure_indexes()
+    except OperationFailure as e:
+        # Typically the unique invoice index, which cannot be built while duplicates are stored.
+        logger.warning(f"Could not create all Invoice indexes ({e}); run `invoicer duplicates` to find "
+                       f"invoices stored more than once")
+    SpendRollup.ensure_indexes()
+    ExtractionJob.ensure_indexes()
+    Product.ensure_indexes()
+    PricePoint.ensure_indexes()
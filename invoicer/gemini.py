@@ -0,0 +1,170 @@
+"""Client for the Gemini ``generateContent`` REST endpoint.
+
+One ``GeminiClient`` keeps a pooled keep-alive session, applies per-request timeouts, retries
+throttled (429), unavailable (5xx) and dropped requests with exponential backoff and jitter while
+honouring ``Retry-After``, and optionally limits the request rate with a token bucket. It is safe
+to share between threads.
+"""
+import base64
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from invoicer.metrics import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENDPOINT = 'https://generativelanguage.googleapis.com/v1beta'
+DEFAULT_MODEL = 'gemini-1.5-flash'
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class GeminiError(Exception):
+    """Raised when the API rejects a request or keeps failing after all retries."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing ``rate`` requests per second with bursts of up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute: Optional[float], burst: float = 1.0) -> Optional['TokenBucket']:
+        return cls(requests_per_minute / 60.0, burst) if requests_per_minute else None
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Parse a ``Retry-After`` header given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class GeminiClient:
+    def __init__(self, api_key: str, model: str = DEFAULT_MODEL, endpoint: str = DEFAULT_ENDPOINT,
+                 timeout: Union[float, Tuple[float, float]] = (10, 120), max_retries: int = 5,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0,
+                 requests_per_minute: Optional[float] = None, pool_size: int = 16):
+        self.api_key = api_key
+        self.model = model
+        self.endpoint = endpoint.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = TokenBucket.per_minute(requests_per_minute)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_config(cls, config: dict, **overrides) -> 'GeminiClient':
+        """Build a client from the ``gemini`` section of the configuration; ``overrides`` win over it."""
+        gemini = config['gemini']
+        options = {
+            'model': gemini.get('gemini_model', DEFAULT_MODEL),
+            'endpoint': gemini.get('endpoint', DEFAULT_ENDPOINT),
+            'max_retries': gemini.get('max_retries', 5),
+            'requests_per_minute': gemini.get('requests_per_minute'),
+        }
+        if 'timeout' in gemini:
+            # YAML reads `[connect, read]` as a list; requests only accepts a number or a tuple.
+            timeout = gemini['timeout']
+            options['timeout'] = tuple(timeout) if isinstance(timeout, list) else timeout
+        options.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(gemini['google_api_key'], **options)
+
+    @property
+    def url(self) -> str:
+        return f"{self.endpoint}/models/{self.model}:generateContent"
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response]) -> float:
+        retry_after = retry_after_seconds(response.headers.get('Retry-After')) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def generate_content(self, payload: dict) -> dict:
+        """POST ``payload`` to generateContent and return the decoded response, retrying transient failures."""
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            response = None
+            try:
+                response = self.session.post(self.url, json=payload, timeout=self.timeout,
+                                             headers={'x-goog-api-key': self.api_key})
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code == 200:
+                    return response.json()
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+                if response.status_code not in RETRY_STATUSES:
+                    raise GeminiError(error)
+
+            if attempt == self.max_retries:
+                raise GeminiError(f"Giving up after {attempt + 1} attempts; last error: {error}")
+            delay = self._backoff(attempt, response)
+            logger.warning(f"Gemini request failed ({error}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def extract(self, image_data: bytes, mime_type: str, prompt: str) -> str:
+        """Send one image with ``prompt`` and return the generated text."""
+        payload = {
+            "contents": [{
+                "parts": [
+                    {"text": prompt},
+                    {
+                        "inline_data": {
+                            "mime_type": mime_type,
+                            "data": base64.b64encode(image_data).decode('utf-8')
+                        }
+                    }
+                ]
+            }]
+        }
+        with span('llm.call', model=self.model):
+            return self._text(self.generate_content(payload))
+
+    def generate_text(self, prompt: str) -> str:
+        """Send a text-only ``prompt`` and return the generated text."""
+        return self._text(self.generate_content({"contents": [{"parts": [{"text": prompt}]}]}))
+
+    @staticmethod
+    def _text(response_data: dict) -> str:
+        try:
+            return response_data['candidates'][0]['content']['parts'][0]['text']
+        except (KeyError, IndexError) as e:
+            raise GeminiError(f"Unexpected response structure: {str(response_data)[:200]}") from e
@@ -0,0 +1,263 @@
+"""Durable extraction job queue stored in MongoDB.
+
+The app enqueues one ``ExtractionJob`` per uploaded image and returns immediately; ``invoicer worker``
+processes claim jobs atomically with ``find_one_and_update``, extract and save the invoice, and record
+the outcome. A job refers to its image by SHA-256 only; each worker reads it from its own BlobStore, which
+must be backed by the same directory as the app's. A claim is a lease that the worker renews while it works.
+If a worker dies, its lease expires and the job is claimed again. Failed attempts are retried with
+exponential backoff until ``Max_Attempts`` is reached.
+"""
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from bson import ObjectId
+from mongoengine import NotUniqueError
+from pymongo import ReturnDocument
+
+from invoicer.data.blobs import BlobStore
+from invoicer.data.dedup import image_fingerprint
+from invoicer.data.extraction import build_invoice
+from invoicer.data.model import ExtractionJob, Invoice
+from invoicer.data.store import DuplicateInvoiceError, save_invoice
+from invoicer.metrics import span, timed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 30
+
+
+def _now() -> datetime:
+    # MongoDB stores naive UTC datetimes; every worker compares leases on the same clock.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def enqueue(store: BlobStore, image, filename: str = None, mime_type: str = 'image/jpeg',
+            max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> ExtractionJob:
+    """Put the image (bytes or a binary file object) in the blob store and queue a job for it.
+
+    The store must be shared with the workers; its images are not evicted while their jobs are pending. If a
+    job for the same image is already queued or running, the new job is recorded as a duplicate of it instead,
+    so the image is extracted once.
+    """
+    digest = store.put(image)
+    now = _now()
+    job = ExtractionJob(Image_SHA256=digest, Active_Digest=digest, Mime_Type=mime_type, Filename=filename,
+                        Max_Attempts=max_attempts, Created_At=now, Run_After=now)
+    try:
+        job.save()
+    except NotUniqueError:
+        active = ExtractionJob._get_collection().find_one({'Active_Digest': digest}, {'_id': 1})
+        job = ExtractionJob(Status='duplicate', Image_SHA256=digest, Mime_Type=mime_type, Filename=filename,
+                            Max_Attempts=max_attempts, Created_At=now, Finished_At=now,
+                            Error=f"This image is already queued as job {active and active['_id']}")
+        job.save()
+    return job
+
+
+@timed('mongo.job_claim')
+def claim_job(worker_id: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> Optional[dict]:
+    """Atomically claim the oldest runnable job: a queued one that is due, or a running one whose lease expired."""
+    now = _now()
+    return ExtractionJob._get_collection().find_one_and_update(
+        {'$or': [
+            {'Status': 'queued', 'Run_After': {'$lte': now}},
+            {'Status': 'running', 'Lease_Expires_At': {'$lt': now}},
+        ]},
+        {'$set': {'Status': 'running', 'Worker': worker_id,
+                  'Lease_Expires_At': now + timedelta(seconds=lease_seconds)},
+         '$inc': {'Attempts': 1}},
+        sort=[('Created_At', 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _update_claimed(job: dict, update: dict, finished: bool = False) -> bool:
+    """Apply ``update`` only while ``job`` is still claimed by the same worker; False if the claim was lost.
+
+    A ``finished`` job releases its image, so it may be queued again.
+    """
+    operations = {'$set': update}
+    if finished:
+        operations['$unset'] = {'Active_Digest': ''}
+    result = ExtractionJob._get_collection().update_one(
+        {'_id': job['_id'], 'Status': 'running', 'Worker': job['Worker']}, operations)
+    return result.modified_count == 1
+
+
+def renew_lease(job: dict, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+    return _update_claimed(job, {'Lease_Expires_At': _now() + timedelta(seconds=lease_seconds)})
+
+
+def complete_job(job: dict, invoice_id: ObjectId) -> bool:
+    return _update_claimed(job, {'Status': 'done', 'Invoice_Id': invoice_id, 'Finished_At': _now(),
+                                 'Lease_Expires_At': None, 'Error': None}, finished=True)
+
+
+def mark_duplicate(job: dict, invoice_id: Optional[ObjectId], error: str) -> bool:
+    """Finish the job without an invoice of its own, pointing at the stored invoice it duplicates."""
+    return _update_claimed(job, {'Status': 'duplicate', 'Invoice_Id': invoice_id, 'Error': error,
+                                 'Finished_At': _now(), 'Lease_Expires_At': None}, finished=True)
+
+
+def fail_job(job: dict, error: str) -> bool:
+    """Requeue the job with exponential backoff, or mark it failed once it has used all its attempts."""
+    attempts = job.get('Attempts', 1)
+    if attempts >= job.get('Max_Attempts', DEFAULT_MAX_ATTEMPTS):
+        return _update_claimed(job, {'Status': 'failed', 'Error': error, 'Finished_At': _now(),
+                                     'Lease_Expires_At': None}, finished=True)
+    delay = RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+    return _update_claimed(job, {'Status': 'queued', 'Error': error, 'Lease_Expires_At': None,
+                                 'Run_After': _now() + timedelta(seconds=delay)})
+
+
+class _LeaseKeeper:
+    """Renews a job's lease from a background thread until stopped."""
+
+    def __init__(self, job: dict, lease_seconds: float):
+        self.job = job
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            if not renew_lease(self.job, self.lease_seconds):
+                logger.warning(f"Lost the claim on job {self.job['_id']}")
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def _saved_by(job: dict, invoice_id: ObjectId) -> bool:
+    """True if the invoice was saved after the job was created, i.e. by an earlier attempt of this job."""
+    created = job.get('Created_At')
+    # ObjectIds record their creation time to the second.
+    return created is not None and invoice_id.generation_time.replace(tzinfo=None) >= created.replace(microsecond=0)
+
+
+def process_job(job: dict, extract: Callable[[str], dict], store: BlobStore,
+                lease_seconds: float = DEFAULT_LEASE_SECONDS) -> str:
+    """Extract and save the invoice for a claimed job, reading its image from ``store``; returns the job's status."""
+    digest = job['Image_SHA256']
+    existing = Invoice.objects(Image_SHA256=digest).only('id').first()
+    if existing is not None:
+        # A worker that crashed after saving the invoice leaves it behind; finish the job with it. An invoice
+        # stored before the job was queued was extracted from an earlier upload of the same image.
+        if job.get('Attempts', 1) > 1 and _saved_by(job, existing.id):
+            complete_job(job, existing.id)
+            return 'done'
+        mark_duplicate(job, existing.id, "This image was already extracted")
+        return 'duplicate'
+    try:
+        with _LeaseKeeper(job, lease_seconds), span('job.process'):
+            with store.open(digest) as image:
+                fingerprint = image_fingerprint(image)
+            response = extract(store.path(digest))
+            invoice = build_invoice(response, **fingerprint)
+            invoice.validate()
+            save_invoice(invoice)
+    except DuplicateInvoiceError as e:
+        mark_duplicate(job, e.existing.get('_id'), str(e))
+        return 'duplicate'
+    except Exception as e:
+        logger.error(f"Job {job['_id']} failed (attempt {job.get('Attempts')}): {e}")
+        fail_job(job, f"{type(e).__name__}: {e}")
+        return 'failed' if job.get('Attempts', 1) >= job.get('Max_Attempts', DEFAULT_MAX_ATTEMPTS) else 'queued'
+    complete_job(job, invoice.id)
+    return 'done'
+
+
+def _exhausted_claim(job: dict) -> bool:
+    """True if the job was reclaimed after its lease expired more often than it may be attempted."""
+    return job.get('Attempts', 1) > job.get('Max_Attempts', DEFAULT_MAX_ATTEMPTS)
+
+
+def run_worker(extract: Callable[[str], dict], store: BlobStore, worker_id: Optional[str] = None, concurrency: int = 1,
+               lease_seconds: float = DEFAULT_LEASE_SECONDS, poll_interval: float = 2.0,
+               max_jobs: Optional[int] = None, stop: Optional[threading.Event] = None,
+               echo: Callable[[str], None] = logger.info) -> Dict[str, int]:
+    """Claim and process jobs with ``concurrency`` threads until ``stop`` is set or ``max_jobs`` were processed.
+
+    Images are read from ``store``. With ``max_jobs`` the worker also returns once the queue is empty.
+    """
+    worker_id = worker_id or default_worker_id()
+    stop = stop or threading.Event()
+    counts = {'done': 0, 'duplicate': 0, 'queued': 0, 'failed': 0}
+    lock = threading.Lock()
+    claimed = [0]
+
+    def loop(thread_id):
+        while not stop.is_set():
+            with lock:
+                if max_jobs is not None and claimed[0] >= max_jobs:
+                    return
+                claimed[0] += 1
+            job = claim_job(f"{worker_id}/{thread_id}", lease_seconds)
+            if job is None:
+                with lock:
+                    claimed[0] -= 1
+                if max_jobs is not None:
+                    return
+                stop.wait(poll_interval)
+                continue
+            if _exhausted_claim(job):
+                fail_job(job, "Claim expired too many times; the worker processing it probably crashed")
+                status = 'failed'
+            else:
+                status = process_job(job, extract, store, lease_seconds)
+            with lock:
+                counts[status] += 1
+            echo(f"Job {job['_id']} ({job.get('Filename') or job['Image_SHA256'][:12]}): {status}")
+
+    threads = [threading.Thread(target=loop, args=(i,), daemon=True) for i in range(max(1, concurrency))]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        echo("Stopping after the jobs in progress...")
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return counts
+
+
+def job_statuses(job_ids: Iterable) -> List[dict]:
+    """Status rows for the given job ids in the order given, for polling from the UI."""
+    ids = [ObjectId(job_id) for job_id in job_ids]
+    fields = {'Status': 1, 'Filename': 1, 'Attempts': 1, 'Max_Attempts': 1, 'Error': 1, 'Invoice_Id': 1,
+              'Created_At': 1, 'Finished_At': 1}
+    rows = {row['_id']: row for row in ExtractionJob._get_collection().find({'_id': {'$in': ids}}, fields)}
+    return [rows[job_id] for job_id in ids if job_id in rows]
+
+
+def pending_images() -> Set[str]:
+    """SHA-256 of the images of queued and running jobs, which must stay in the blob store."""
+    return set(ExtractionJob._get_collection().distinct('Image_SHA256', {'Status': {'$in': ['queued', 'running']}}))
+
+
+def queue_counts() -> Dict[str, int]:
+    """Number of jobs per status."""
+    pipeline = [{'$group': {'_id': '$Status', 'count': {'$sum': 1}}}]
+    counts = {status: 0 for status in ('queued', 'running', 'done', 'duplicate', 'failed')}
+    counts.update({row['_id']: row['count'] for row in ExtractionJob._get_collection().aggregate(pipeline)})
+    return counts
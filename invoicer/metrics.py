@@ -0,0 +1,238 @@
+"""Lightweight timing instrumentation.
+
+Code paths are wrapped in named spans (``with span('llm.call'):`` or ``@timed('mongo.save')``). When
+instrumentation is enabled through the ``metrics`` config section, every span updates an in-process latency
+histogram, which can be scraped in Prometheus text format, and is appended as one JSON line to a log file
+that ``invoicer stats`` summarizes. When it is disabled (the default) a span is a shared no-op object.
+"""
+import bisect
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_PATH = '.invoicer_cache/metrics.jsonl'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = None
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of ``values`` for ``q`` in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100.0 * len(ordered)) - 1)]
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, failed: bool):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            self.buckets[index] += 1
+        self.count += 1
+        self.sum += seconds
+        if failed:
+            self.errors += 1
+
+
+class Registry:
+    """Span histograms of this process, plus the optional JSON-lines span log."""
+
+    def __init__(self, log_path: Optional[str] = DEFAULT_LOG_PATH):
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._log = None
+        if log_path:
+            directory = os.path.dirname(log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._log = open(log_path, 'a', buffering=1, encoding='utf-8')
+
+    def record(self, name: str, seconds: float, failed: bool, fields: dict):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds, failed)
+            if self._log is not None:
+                entry = {'ts': round(time.time(), 3), 'span': name, 'seconds': round(seconds, 6), 'ok': not failed}
+                entry.update(fields)
+                self._log.write(json.dumps(entry, default=str) + '\n')
+
+    def prometheus_text(self) -> str:
+        """The histograms in the Prometheus text exposition format."""
+        lines = ['# HELP invoicer_span_seconds Duration of instrumented invoicer operations.',
+                 '# TYPE invoicer_span_seconds histogram']
+        errors = ['# HELP invoicer_span_errors_total Instrumented operations that raised an exception.',
+                  '# TYPE invoicer_span_errors_total counter']
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.buckets):
+                    cumulative += count
+                    lines.append(f'invoicer_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'invoicer_span_seconds_bucket{{span="{name}",le="+Inf"}} {histogram.count}')
+                lines.append(f'invoicer_span_seconds_sum{{span="{name}"}} {histogram.sum}')
+                lines.append(f'invoicer_span_seconds_count{{span="{name}"}} {histogram.count}')
+                errors.append(f'invoicer_span_errors_total{{span="{name}"}} {histogram.errors}')
+        return '\n'.join(lines + errors) + '\n'
+
+
+class Span:
+    __slots__ = ('name', 'fields', 'started')
+
+    def __init__(self, name: str, fields: dict):
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        registry = _registry
+        if registry is not None:
+            registry.record(self.name, time.perf_counter() - self.started, exc_type is not None, self.fields)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **fields):
+    """Context manager timing the enclosed block as ``name``; ``fields`` are added to its log line."""
+    if _registry is None:
+        return _NOOP_SPAN
+    return Span(name, fields)
+
+
+def timed(name: str):
+    """Decorator timing every call of the function as span ``name``."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _registry is None:
+                return func(*args, **kwargs)
+            with Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def enabled() -> bool:
+    return _registry is not None
+
+
+def registry() -> Optional[Registry]:
+    return _registry
+
+
+def configure(config: dict) -> Optional[Registry]:
+    """Enable or disable instrumentation from the ``metrics`` section of the configuration.
+
+    Reconfiguring an enabled process keeps its histograms; the Prometheus endpoint is started at most once.
+    """
+    global _registry
+    metrics_config = config.get('metrics') or {}
+    if not metrics_config.get('enabled', False):
+        _registry = None
+        return None
+    if _registry is None:
+        _registry = Registry(metrics_config.get('log_path', DEFAULT_LOG_PATH))
+    port = metrics_config.get('prometheus_port')
+    if port:
+        start_http_server(port, metrics_config.get('prometheus_host', '127.0.0.1'))
+    return _registry
+
+
+_servers = {}
+
+
+def start_http_server(port: int, host: str = '127.0.0.1'):
+    """Serve the histograms at ``/metrics`` from a daemon thread; a no-op if already serving on ``port``."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    if port in _servers:
+        return _servers[port]
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics' or _registry is None:
+                self.send_error(404)
+                return
+            body = _registry.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        logger.warning(f"Could not start the metrics endpoint on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    _servers[port] = server
+    return server
+
+
+def read_span_log(path: str, since: Optional[float] = None) -> Iterable[dict]:
+    """The span records of a JSON-lines span log, optionally only those newer than the ``since`` timestamp."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if since is None or entry.get('ts', 0) >= since:
+                yield entry
+
+
+def summarize(entries: Iterable[dict]) -> Dict[str, dict]:
+    """Per-span count, error count, total, mean and p50/p95/p99 latency (seconds) of span records."""
+    durations, errors = {}, {}
+    for entry in entries:
+        name = entry['span']
+        durations.setdefault(name, []).append(entry['seconds'])
+        errors[name] = errors.get(name, 0) + (0 if entry.get('ok', True) else 1)
+    return {
+        name: {
+            'count': len(values),
+            'errors': errors[name],
+            'total': sum(values),
+            'mean': sum(values) / len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+        }
+        for name, values in sorted(durations.items())
+    }
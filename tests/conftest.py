@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The fake Gemini endpoint lives with the benchmarks, which are scripts rather than a package.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
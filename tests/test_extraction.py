@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from invoicer.data.extraction import ItemStreamParser
+
+RESPONSE = {
+    'Issuer': 'EDEKA {Christ}',
+    'Items': [
+        {'Name': 'Milch 1,5%', 'Total Price (EUR)': 1.19},
+        {'Name': 'Brot "Vollkorn" [500g]', 'Total Price (EUR)': 2.49},
+        {'Name': 'Eier\\M', 'Total Price (EUR)': 3.29},
+    ],
+    'Total Invoice Expense (EUR)': 6.97,
+}
+TEXT = '```json\n' + json.dumps(RESPONSE, ensure_ascii=False) + '\n```'
+
+
+def feed_chunks(chunks):
+    parser = ItemStreamParser()
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    return parser, items
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 16, len(TEXT)])
+def test_items_are_returned_once_whatever_the_chunk_boundaries(size):
+    parser, items = feed_chunks(TEXT[i:i + size] for i in range(0, len(TEXT), size))
+
+    assert items == RESPONSE['Items']
+    assert parser.text == TEXT
+    assert parser.result() == RESPONSE
+
+
+def test_item_is_returned_by_the_chunk_that_completes_it():
+    first = TEXT.index('1.19}') + len('1.19}')
+    parser = ItemStreamParser()
+
+    assert parser.feed(TEXT[:first - 1]) == []
+    assert parser.feed(TEXT[first - 1:first]) == [RESPONSE['Items'][0]]
+
+
+def test_braces_in_strings_and_nested_arrays_outside_items_are_ignored():
+    text = '{"Note": "[{not an item}]", "Tags": [{"Name": "x"}], "Items": [{"Name": "a", "Codes": [1, {"b": 2}]}]}'
+
+    _, items = feed_chunks(text[i:i + 5] for i in range(0, len(text), 5))
+
+    assert items == [{'Name': 'a', 'Codes': [1, {'b': 2}]}]
@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+from fake_gemini import DEFAULT_RESPONSE, FakeGeminiServer
+from invoicer.data.extraction import load_response_json
+from invoicer.gemini import GeminiClient, GeminiError, TokenBucket, retry_after_seconds
+
+
+def client_for(server, **options):
+    options = dict({'backoff_base': 0.01, 'backoff_max': 5.0}, **options)
+    return GeminiClient('test-key', model='fake-model', endpoint=server.endpoint, **options)
+
+
+def test_throttled_requests_are_retried():
+    with FakeGeminiServer(latency=0, jitter=0, fail_first=2) as server:
+        response = client_for(server).extract(b'image', 'image/jpeg', 'prompt')
+
+    assert server.requests == 3
+    assert server.errors == 2
+    assert load_response_json(response)['Issuer'] == DEFAULT_RESPONSE['Issuer']
+
+
+def test_retry_after_is_honoured():
+    with FakeGeminiServer(latency=0, jitter=0, fail_first=2, retry_after='0.3') as server:
+        started = time.monotonic()
+        client_for(server, backoff_base=0.0).generate_text('prompt')
+        elapsed = time.monotonic() - started
+
+    assert server.requests == 3
+    assert 0.6 <= elapsed < 2.0
+
+
+def test_retry_after_is_capped_by_backoff_max():
+    with FakeGeminiServer(latency=0, jitter=0, fail_first=1, retry_after='30') as server:
+        started = time.monotonic()
+        client_for(server, backoff_max=0.2).generate_text('prompt')
+
+    assert time.monotonic() - started < 2.0
+
+
+def test_retries_stop_at_max_retries():
+    with FakeGeminiServer(latency=0, jitter=0, error_rate=1.0) as server:
+        with pytest.raises(GeminiError, match='Giving up after 3 attempts'):
+            client_for(server, max_retries=2).generate_text('prompt')
+
+    assert server.requests == 3
+
+
+def test_token_bucket_paces_requests():
+    with FakeGeminiServer(latency=0, jitter=0) as server:
+        client = client_for(server, requests_per_minute=600)
+        started = time.monotonic()
+        for _ in range(4):
+            client.generate_text('prompt')
+        elapsed = time.monotonic() - started
+
+    # A burst of one, then one request every 0.1 s.
+    assert server.requests == 4
+    assert elapsed >= 0.3
+
+
+def test_token_bucket_allows_bursts_up_to_capacity():
+    bucket = TokenBucket(rate=1.0, capacity=3)
+    started = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+
+    assert time.monotonic() - started < 0.1
+
+
+def test_retry_after_header_formats():
+    assert retry_after_seconds('2.5') == 2.5
+    assert retry_after_seconds('-1') == 0.0
+    assert retry_after_seconds('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert retry_after_seconds('soon') is None
+    assert retry_after_seconds(None) is None
@@ -0,0 +1,42 @@
+from invoicer.data.pdf import ITEM_TOTAL_FIELD, TOTAL_FIELD, merge_pages
+
+
+def item(name, total):
+    return {'Name': name, ITEM_TOTAL_FIELD: total}
+
+
+def test_carry_over_lines_are_dropped():
+    pages = [
+        {'Items': [item('Milch', 1.19), item('Zwischensumme', 1.19)]},
+        {'Items': [item('Übertrag von Seite 1', 1.19), item('Total Pflege Shampoo', 3.45),
+                   item('Summe: 4,64 €', 4.64)]},
+    ]
+
+    merged = merge_pages(pages)
+
+    assert [row['Name'] for row in merged['Items']] == ['Milch', 'Total Pflege Shampoo']
+
+
+def test_total_is_the_last_stated_total_not_the_sum():
+    pages = [
+        {'Items': [item('Milch', 1.19)], TOTAL_FIELD: 1.19, 'Issuer': 'EDEKA'},
+        {'Items': [item('Brot', 2.49)], TOTAL_FIELD: 3.68, 'Issuer': 'EDEKA Christ'},
+        {'Items': [], TOTAL_FIELD: None},
+    ]
+
+    merged = merge_pages(pages)
+
+    assert merged[TOTAL_FIELD] == 3.68
+    assert merged['Issuer'] == 'EDEKA'
+
+
+def test_total_falls_back_to_the_sum_of_item_totals():
+    pages = [
+        {'Items': [item('Milch', '1,19'), item('Brot', 2.49)], 'Issuer': None},
+        {'Items': [item('Eier', 3.29), item('Pfand', None)], 'Issuer': 'REWE'},
+    ]
+
+    merged = merge_pages(pages)
+
+    assert merged[TOTAL_FIELD] == 6.97
+    assert merged['Issuer'] == 'REWE'
@@ -0,0 +1,42 @@
+from datetime import date
+
+from invoicer.data.rollups import rollup_filter
+
+
+def test_whole_months_use_month_rows():
+    assert rollup_filter(date(2024, 1, 1), date(2024, 3, 31), daily=False) == {'$or': [
+        {'Granularity': 'month', 'Period': {'$gte': '2024-01', '$lte': '2024-03'}},
+    ]}
+
+
+def test_partial_months_at_both_ends_use_day_rows():
+    assert rollup_filter(date(2024, 1, 15), date(2024, 4, 10), daily=False) == {'$or': [
+        {'Granularity': 'month', 'Period': {'$gte': '2024-02', '$lte': '2024-03'}},
+        {'Granularity': 'day', 'Period': {'$gte': '2024-01-15', '$lte': '2024-01-31'}},
+        {'Granularity': 'day', 'Period': {'$gte': '2024-04-01', '$lte': '2024-04-10'}},
+    ]}
+
+
+def test_partial_month_ending_in_december_and_leap_february():
+    assert rollup_filter(date(2023, 12, 2), date(2024, 2, 29), daily=False) == {'$or': [
+        {'Granularity': 'month', 'Period': {'$gte': '2024-01', '$lte': '2024-02'}},
+        {'Granularity': 'day', 'Period': {'$gte': '2023-12-02', '$lte': '2023-12-31'}},
+    ]}
+
+
+def test_range_within_one_month_uses_day_rows():
+    assert rollup_filter(date(2024, 5, 3), date(2024, 5, 20), daily=False) == {
+        'Granularity': 'day', 'Period': {'$gte': '2024-05-03', '$lte': '2024-05-20'}}
+
+
+def test_open_ranges():
+    assert rollup_filter(date(2024, 5, 3), None, daily=False) == {'$or': [
+        {'Granularity': 'month', 'Period': {'$gte': '2024-06'}},
+        {'Granularity': 'day', 'Period': {'$gte': '2024-05-03', '$lte': '2024-05-31'}},
+    ]}
+    assert rollup_filter(None, None, daily=False) == {'$or': [{'Granularity': 'month'}]}
+
+
+def test_daily_groupings_use_day_rows_only():
+    assert rollup_filter(date(2024, 1, 15), date(2024, 4, 10), daily=True) == {
+        'Granularity': 'day', 'Period': {'$gte': '2024-01-15', '$lte': '2024-04-10'}}